@@ -1,68 +1,112 @@
-import matplotlib.pyplot as plt
+import argparse
+import os
+import random
+
 import numpy as np
 
 from utils.agents import QSheep, QWolves
-from utils.board import BaghChal
+from utils.board import BaghChal, BatchBaghChal
+from utils.agents.base import STATES_CACHE_SIZE
+from utils.checkpoint import QTableLog, TrackedTable
+from utils.engine import MoveCache
+from utils.metrics import TrainingMetrics
+from utils.training import ParallelTrainer, play_batch, play_episode
 
 
-game_env = BaghChal(sheep_agent_cls=QSheep, wolves_agent_cls=QWolves)
+def main():
+    parser = argparse.ArgumentParser(description="Train QSheep against QWolves with self-play")
+    parser.add_argument("--epochs", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="self-play processes, their Q-updates are merged every --sync-every episodes "
+                             "(0: every core)")
+    parser.add_argument("--sync-every", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="games played at once on one (B,5,5) array by each process (0: one at a time)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory of the q-sheep1/q-wolves1 snapshots (.npy) and update logs (.log)")
+    parser.add_argument("--checkpoint-every", type=int, default=1000,
+                        help="episodes between appending the changed Q-table rows to the logs")
+    parser.add_argument("--compact-every", type=int, default=10,
+                        help="checkpoints between folding the logs into new snapshots")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from the snapshots and logs in --out, without it they are overwritten")
+    parser.add_argument("--metrics", default=None,
+                        help="file the rolling metrics are streamed to, .csv or JSON lines "
+                             "(default: metrics.csv in --out), draw it with plot.py")
+    parser.add_argument("--window", type=int, default=1000, help="episodes the rolling metrics cover")
+    parser.add_argument("--log-every", type=int, default=1000, help="episodes between two rows of metrics")
+    parser.add_argument("--move-cache", type=int, default=STATES_CACHE_SIZE,
+                        help="positions whose successors each side keeps per process (0: no cache)")
+    args = parser.parse_args()
 
-history = {
-    "rounds": [],
-    "wolves": 0,
-    "sheep": 0,
-    "captured": [],
-}
-epochs = 1000
-for epoch in range(1, epochs+1):
-    _round = 1
-    while True:
-        # Sheep turn:
-        new_state = game_env.sheep.make_turn(epoch,game_env.get_state())
-        if new_state is None:
-            game_env.sheep.update_q_from_trajectory(-1)
-            # game_env.wolves.update_q_from_trajectory(1)
-            history["wolves"] += 1
-            break
-        elif len(new_state) == 0:
-            # all sheep are blocked
-            game_env.sheep.update_q_from_trajectory(-1)
-            # game_env.wolves.update_q_from_trajectory(-1)
-            break
-        else:
-            game_env.step(new_state)
+    os.makedirs(args.out, exist_ok=True)
+    logs = QTableLog(args.out, "q-sheep1"), QTableLog(args.out, "q-wolves1")
+    if args.resume:
+        (sheep_table, start), (wolves_table, _) = (log.load() for log in logs)
+        print(f"Resuming after {start} episodes, {len(sheep_table)} sheep and {len(wolves_table)} wolves states")
+    else:
+        sheep_table, wolves_table, start = TrackedTable(), TrackedTable(), 0
+        # Replace an earlier run's files at once, its log must not be replayed over this run
+        for log, q_table in zip(logs, (sheep_table, wolves_table)):
+            log.compact(q_table, start)
 
-        # Wolves turn
-        new_state = game_env.wolves.make_turn(game_env.get_state())
-        if new_state is None:
-            game_env.sheep.update_q_from_trajectory(1)
-            # game_env.wolves.update_q_from_trajectory(-1)
-            history["sheep"] += 1
-            break 
+    metrics = TrainingMetrics(args.metrics or os.path.join(args.out, "metrics.csv"), args.window, args.resume)
+    epochs = args.epochs
+    sheep_cache, wolves_cache = MoveCache(args.move_cache), MoveCache(args.move_cache)
+    if args.workers != 1:
+        # Every worker gets its own copy of the caches
+        trainer = ParallelTrainer(args.workers, args.sync_every, args.seed,
+                                  {"q_table": sheep_table, "move_cache": sheep_cache},
+                                  {"q_table": wolves_table, "move_cache": wolves_cache}, args.batch_size)
+        trainer.episodes = start
+        game_env = trainer.env
+        results = trainer.train(epochs)
+    else:
+        trainer = None
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+        game_env = BaghChal(sheep_agent_cls=lambda: QSheep(q_table=sheep_table, move_cache=sheep_cache),
+                            wolves_agent_cls=lambda: QWolves(q_table=wolves_table, move_cache=wolves_cache))
+        if args.batch_size:
+            results = play_batch(BatchBaghChal(args.batch_size), game_env.sheep, game_env.wolves, epochs,
+                                 start + 1)
         else:
-            game_env.step(new_state)
+            results = (play_episode(game_env, epoch) for epoch in range(start + 1, start + epochs + 1))
+
+    sheep = game_env.sheep
+    print(f"alpha: {sheep.alpha}, gamma: {sheep.gamma}, eps: {sheep.eps}, lambda: {sheep.lam}")
 
-    _round += 1
-    history["captured"].append(game_env.wolves.captured_sheep)
-    history["rounds"].append(_round)
-    game_env.restart()
-    if epoch % 1000 == 0:
-        print(f"W: {history['wolves']}, S: {history['sheep']}, R : {epoch/1000}")
-        history["wolves"] = 0
-        history["sheep"] = 0
-        # print(game_env.sheep.q_table)
+    checkpoints = 0
+    for epoch, (winner, _round, captured) in enumerate(results, start + 1):
+        metrics.record(winner, _round, captured)
+        if epoch % args.log_every == 0:
+            row = metrics.write(epoch, len(sheep_table), len(wolves_table))
+            line = (f"{epoch}: W: {row['wolves_win_rate']:.3f}, S: {row['sheep_win_rate']:.3f}, "
+                    f"captured: {row['captured_mean']:.2f}, turns: {row['turns_mean']:.1f}, "
+                    f"{row['episodes_per_s']:.0f} episodes/s")
+            # Only these caches play here: workers use their copies and batched games generate per ply
+            if trainer is None and not args.batch_size:
+                line += f", move cache hits: S: {sheep_cache.hit_rate():.2f}, W: {wolves_cache.hit_rate():.2f}"
+            print(line)
+            # print(game_env.sheep.q_table)
+        if epoch % args.checkpoint_every == 0:
+            checkpoints += 1
+            for log, q_table in zip(logs, (sheep_table, wolves_table)):
+                if checkpoints % args.compact_every == 0:
+                    log.compact(q_table, epoch)
+                else:
+                    log.append(q_table, epoch)
 
-# print(game_env.sheep.q_table)
-# print(game_env.wolves.q_table)
-game_env.wolves.save(path=r"C:\\Users\\dhung\\OneDrive\\Desktop\AIFinal\\AI-plays-Baagchal\\Qlearning", filename="q-wolves1")
-game_env.sheep.save(path=r"C:\\Users\\dhung\\OneDrive\\Desktop\AIFinal\\AI-plays-Baagchal\\Qlearning", filename="q-sheep1")
+    if trainer is not None:
+        trainer.close()
+    # print(game_env.sheep.q_table)
+    # print(game_env.wolves.q_table)
+    for log, q_table in zip(logs, (sheep_table, wolves_table)):
+        log.compact(q_table, start + epochs)
+    metrics.close()
 
-# plot results:
-fig, axs = plt.subplots(1, 2, figsize=(15, 7))
-fig.suptitle(f"W: {history['wolves']}, S: {history['sheep']}")
 
-axs[0].plot(history["rounds"], label='rounds/match')
-axs[0].legend()
-axs[1].plot(history["captured"], label="captured/match")
-axs[1].legend()
-plt.show()
+# Worker processes import this module again when they are spawned (Windows), only train when run
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import argparse
+
+import matplotlib.pyplot as plt
+
+from utils.metrics import read_metrics
+
+parser = argparse.ArgumentParser(description="Plot the metrics main.py streamed, during or after a run")
+parser.add_argument("path", nargs="?", default="metrics.csv")
+args = parser.parse_args()
+
+metrics = read_metrics(args.path)
+episodes = metrics["episode"]
+
+fig, axs = plt.subplots(2, 2, figsize=(15, 10))
+fig.suptitle(args.path)
+
+axs[0, 0].plot(episodes, metrics["wolves_win_rate"], label="wolves win rate")
+axs[0, 0].plot(episodes, metrics["sheep_win_rate"], label="sheep win rate")
+axs[0, 0].plot(episodes, metrics["blocked_rate"], label="sheep blocked")
+axs[0, 0].legend()
+axs[0, 1].plot(episodes, metrics["turns_mean"], label="rounds/match")
+axs[0, 1].plot(episodes, metrics["captured_mean"], label="captured/match")
+axs[0, 1].legend()
+axs[1, 0].plot(episodes, metrics["episodes_per_s"], label="episodes/s")
+axs[1, 0].legend()
+axs[1, 1].plot(episodes, metrics["sheep_states"], label="sheep states")
+axs[1, 1].plot(episodes, metrics["wolves_states"], label="wolves states")
+axs[1, 1].set_xlabel("episode")
+axs[1, 1].legend()
+rss = axs[1, 1].twinx()
+rss.plot(episodes, metrics["rss_mb"], color="grey", label="RSS (MB)")
+rss.legend(loc="lower right")
+plt.show()
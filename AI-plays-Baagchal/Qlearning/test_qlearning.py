@@ -0,0 +1,109 @@
+"""
+Tests for the Q-learning updates and Q-table storage, run with python -m pytest from this directory
+(or from the engine directory above it).
+"""
+import os
+
+import numpy as np
+import pytest
+
+from utils.agents.agents_hub import backward_update, forward_update
+from utils.checkpoint import QTableLog, TrackedTable
+from utils.qtable import MappedQTable
+
+ALPHA, GAMMA = 0.5, 0.9
+
+
+def table(trajectory, seed=0):
+    """Q-table with random rows of 4 actions for every key of trajectory"""
+    rng = np.random.default_rng(seed)
+    return {key: rng.normal(size=4) for key, _ in trajectory}
+
+
+def copy(q_table):
+    return {key: row.copy() for key, row in q_table.items()}
+
+
+@pytest.mark.parametrize("reward", [1, -1])
+@pytest.mark.parametrize("trajectory", [
+    [(10, 0), (11, 3), (12, 1), (13, 2)],
+    # Comes back to key 10, later steps read the updated row
+    [(10, 0), (11, 3), (10, 2), (12, 1)],
+])
+def test_backward_update_without_traces_matches_forward_update(trajectory, reward):
+    forward = table(trajectory)
+    backward = copy(forward)
+    forward_update(forward, trajectory, reward, ALPHA, GAMMA)
+    backward_update(backward, trajectory, reward, ALPHA, GAMMA, lam=0.0)
+    assert forward.keys() == backward.keys()
+    for key in forward:
+        np.testing.assert_allclose(backward[key], forward[key])
+
+
+def test_backward_update_with_full_traces_uses_the_monte_carlo_return():
+    trajectory = [(10, 0), (11, 3), (12, 1), (13, 2)]
+    q_table = {key: np.zeros(4) for key, _ in trajectory}
+    backward_update(q_table, trajectory, 1, ALPHA, GAMMA, lam=1.0)
+    for j, (key, action) in enumerate(trajectory):
+        expected = np.zeros(4)
+        expected[action] = ALPHA * GAMMA ** (len(trajectory) - j)
+        np.testing.assert_allclose(q_table[key], expected)
+
+
+def test_q_table_log_replays_blocks_and_drops_a_torn_one(tmp_path):
+    log = QTableLog(str(tmp_path), "sheep")
+    q_table = TrackedTable({1: np.zeros(3), 2: np.zeros(2)})
+    log.compact(q_table, 0)
+
+    q_table[1][0] = 1.0
+    q_table[3] = np.array([0.5, -0.5])
+    assert log.append(q_table, 100) == 2
+    logged = {key: row.copy() for key, row in q_table.items()}
+
+    q_table[2][1] = 7.0
+    log.append(q_table, 200)
+    # A crash while the last block was written
+    with open(log.log_path, "r+b") as f:
+        f.truncate(os.path.getsize(log.log_path) - 5)
+
+    loaded, episodes = log.load()
+    assert episodes == 100
+    assert loaded.keys() == logged.keys()
+    for key, row in logged.items():
+        np.testing.assert_array_equal(loaded[key], row)
+
+
+def test_q_table_log_compaction_keeps_the_table(tmp_path):
+    log = QTableLog(str(tmp_path), "wolves")
+    q_table = TrackedTable({key: np.full(2, float(key)) for key in range(5)})
+    log.compact(q_table, 0)
+    q_table[4][1] = -1.0
+    log.append(q_table, 50)
+    log.compact(q_table, 80)
+
+    loaded, episodes = log.load()
+    assert episodes == 80
+    assert loaded.keys() == q_table.keys()
+    for key in q_table:
+        np.testing.assert_array_equal(loaded[key], dict.__getitem__(q_table, key))
+
+
+def test_mapped_q_table_grows_and_reopens(tmp_path):
+    path = str(tmp_path / "sheep.qt")
+    q_table = MappedQTable(path, capacity=8)
+    # Key 0 is stored as 1, an empty slot is 0
+    rows = {key: np.arange(key % 7 + 1, dtype=np.float64) * key for key in range(0, 400, 3)}
+    for key, row in rows.items():
+        q_table[key] = row
+    q_table[3][0] += 0.25
+    rows[3][0] += 0.25
+    assert q_table.capacity > 8
+    q_table.close()
+
+    reopened = MappedQTable(path)
+    assert len(reopened) == len(rows)
+    assert 1 not in reopened
+    assert dict(reopened.items()).keys() == rows.keys()
+    for key, row in rows.items():
+        np.testing.assert_array_equal(reopened[key], row)
+    reopened.close()
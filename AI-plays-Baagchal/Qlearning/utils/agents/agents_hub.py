@@ -5,22 +5,100 @@ from typing import List, Union
 import numpy as np
 
 from utils.agents.base import Sheep, Wolves
+from utils.engine import INVERSE, canonical_array, transform_array
+from utils.keys import sheep_key, wolves_key
+from utils.qtable import MappedQTable, load_q_table
 
 
-class QSheep(Sheep):
-    """Q-learning with eps-Greedy approach"""
+def save_q_table(q_table, path, filename):
+    """A dict is pickled to path/filename.npy, a MappedQTable lives in its file and is only flushed"""
+    if isinstance(q_table, MappedQTable):
+        q_table.flush()
+    else:
+        np.save(os.path.join(path, f"{filename}.npy"), q_table)
+
+
+def forward_update(q_table, trajectory, reward, alpha, gamma):
+    """One-step Q-learning over the episode from its first step, each step reading the updated table"""
+    for j, (q_s, idx) in enumerate(trajectory):
+        if j + 1 < len(trajectory):
+            target = gamma * np.max(q_table[trajectory[j + 1][0]])
+        else:
+            target = gamma * reward
+        q_table[q_s][idx] += alpha * (target - q_table[q_s][idx])
+
+
+def backward_update(q_table, trajectory, reward, alpha, gamma, lam=0.0):
+    """
+    TD(lambda) over a whole episode in one reverse pass: the lambda-returns
+        G[last] = gamma * reward
+        G[j] = gamma * ((1 - lam) * max Q(s[j + 1]) + lam * G[j + 1])
+    are built backwards in a preallocated array from the values the episode saw, then every Q(s[j], a[j])
+    moves alpha of the way to G[j] (the offline equivalent of accumulating eligibility traces that decay
+    by gamma * lam). lam=0 is one-step Q-learning and gives the same table as forward_update; an episode
+    that comes back to a position it left is handed to forward_update then, since there each step reads
+    the updates of the steps before it.
+    """
+    steps = len(trajectory)
+    if not steps:
+        return
+    keys = [q_s for q_s, _ in trajectory]
+    if lam == 0 and len(set(keys)) < steps:
+        forward_update(q_table, trajectory, reward, alpha, gamma)
+        return
+    rows = [q_table[q_s] for q_s in keys]
+    actions = np.fromiter((idx for _, idx in trajectory), dtype=np.intp, count=steps)
+    next_max = np.empty(steps)
+    next_max[:-1] = [row.max() for row in rows[1:]]
+    returns = np.empty(steps)
+    g = returns[-1] = gamma * reward
+    for j in range(steps - 2, -1, -1):
+        g = returns[j] = gamma * ((1 - lam) * next_max[j] + lam * g)
+    for row, idx, target in zip(rows, actions, returns):
+        row[idx] += alpha * (target - row[idx])
+
+
+def pick_batch(q_table, keys: np.array, counts: np.array, eps) -> np.array:
+    """
+    eps-greedy picks for many positions in one call: position i has key keys[i] and counts[i] successors,
+    eps is one share of random picks or one per position. Rows missing from q_table start at zero.
+    """
+    rows = []
+    for key, count in zip(keys.tolist(), counts.tolist()):
+        row = q_table.get(key)
+        if row is None:
+            row = q_table[key] = np.zeros(count, dtype=np.float64)
+        rows.append(row)
+    if not rows:
+        return np.zeros(0, dtype=np.intp)
+    values = np.full((len(rows), counts.max()), -np.inf)
+    values[np.arange(values.shape[1]) < counts[:, np.newaxis]] = np.concatenate(rows)
+    picks = values.argmax(axis=1)
+    explore = np.random.random(len(rows)) < eps
+    picks[explore] = (np.random.random(explore.sum()) * counts[explore]).astype(np.intp)
+    return picks
 
-    def __init__(self, alpha: float = 0.5, gamma: float = 1.0, eps: float = 0.8):
-        super().__init__()
+
+class QSheep(Sheep):
+    """
+    Q-learning with eps-Greedy approach.
+    With symmetric=True states are keyed by their canonical image (see symmetry.py), so the
+    8 rotations/reflections of a board share one q_table entry.
+    q_table is a dict by default, pass a MappedQTable (see qtable.py) to keep it in a file instead.
+    lam is the trace decay of the TD(lambda) update at the end of an episode, see backward_update.
+    move_cache holds the successors of the boards seen, see Sheep.
+    """
+
+    def __init__(self, alpha: float = 0.5, gamma: float = 1.0, eps: float = 0.8, symmetric: bool = False,
+                 q_table=None, lam: float = 0.0, move_cache=None):
+        super().__init__(move_cache)
         self.alpha = alpha
         self.gamma = gamma
         self.eps = eps
-        print(self.alpha)
-        print(self.gamma)
-        print(self.eps)
+        self.symmetric = symmetric
+        self.lam = lam
 
-        self.q_table = np.load("C:\\Users\\dhung\\OneDrive\\Desktop\AIFinal\\AI-plays-Baagchal\\Qlearning\\q-sheep1.npy",allow_pickle=True)
-        # self.q_table = {}
+        self.q_table = {} if q_table is None else q_table
 
         self.trajectory = []
 
@@ -42,25 +120,34 @@ class QSheep(Sheep):
         # print(action_idx)
         return action_idx
 
+    def pick_batch(self, keys: np.array, counts: np.array, epochs) -> np.array:
+        """pick_state (pick_state_trained after epoch 75000) for many positions, see BatchBaghChal"""
+        if self.symmetric:
+            raise ValueError("batched play keys the boards as they are, it does not support symmetric=True")
+        return pick_batch(self.q_table, keys, counts, np.where(np.asarray(epochs) > 75000, 1 - self.eps, self.eps))
+
     def make_turn(self, epoch, current_state: np.array) -> Union[np.array, None]:
 
         if (current_state > 0).sum() + self.in_reserve < 16:
             # Sheep agent lose
             return None
 
-        state_hash = hash(current_state.tobytes()) + self.in_reserve
-        # print(state_hash)
+        transform = 0
+        if self.symmetric:
+            current_state, transform = canonical_array(current_state)
+        state_key = sheep_key(current_state, self.in_reserve)
+        # print(state_key)
 
-        _states = self.get_states(current_state)
+        _states = self.get_states(current_state, state_key)
         # print(_states)
 
         if len(_states) == 0:
             # workaround for case when all sheep are blocked by wolves
             return []
 
-        if state_hash not in self.q_table:
-            self.q_table[()][state_hash] = np.zeros(len(_states), dtype=np.float64)
-        q_values = self.q_table[()][state_hash]
+        if state_key not in self.q_table:
+            self.q_table[state_key] = np.zeros(len(_states), dtype=np.float64)
+        q_values = self.q_table[state_key]
         # print(q_values)
         if(epoch > 75000):
             next_state_idx = self.pick_state_trained(q_values)
@@ -75,9 +162,11 @@ class QSheep(Sheep):
             print(len(_states))
             print(q_values, len(q_values))
             raise e
-        self.trajectory.append((state_hash, next_state_idx))
+        self.trajectory.append((state_key, next_state_idx))
         # print(self.trajectory)
         # print(new_state)
+        if transform:
+            new_state = transform_array(new_state, INVERSE[transform])
         return new_state
 
     def make_turn_updated(self, current_state: np.array) -> Union[np.array, None]:
@@ -86,21 +175,24 @@ class QSheep(Sheep):
             # Sheep agent lose
             return None
 
-        state_hash = hash(current_state.tobytes()) + self.in_reserve
-        # print(state_hash)
+        transform = 0
+        if self.symmetric:
+            current_state, transform = canonical_array(current_state)
+        state_key = sheep_key(current_state, self.in_reserve)
+        # print(state_key)
 
-        _states = self.get_states(current_state)
+        _states = self.get_states(current_state, state_key)
         # print(_states)
 
         if len(_states) == 0:
             # workaround for case when all sheep are blocked by wolves
             return []
 
-        if state_hash not in self.q_table:
-            self.q_table[()][state_hash] = np.zeros(len(_states), dtype=np.float64)
-        q_values = self.q_table[()][state_hash]
+        if state_key not in self.q_table:
+            self.q_table[state_key] = np.zeros(len(_states), dtype=np.float64)
+        q_values = self.q_table[state_key]
         # print(q_values)
-        # new_state = np.max(q_values[state_hash])
+        # new_state = np.max(q_values[state_key])
         print(np.argmax(q_values))
         # next_state_idx = np.argmax(q_values)
         next_state_idx = self.pick_state(q_values)
@@ -113,43 +205,37 @@ class QSheep(Sheep):
             print(len(_states))
             print(q_values, len(q_values))
             raise e
-        self.trajectory.append((state_hash, next_state_idx))
+        self.trajectory.append((state_key, next_state_idx))
         # print(self.trajectory)
         # print(new_state)
+        if transform:
+            new_state = transform_array(new_state, INVERSE[transform])
         return new_state
 
     def update_q_from_trajectory(self, reward):
-
-        # TODO: revert for speed up the training (and the same for sheep agent!)
-        # print(self.trajectory)
-        for j in range(len(self.trajectory)):
-            q_s, idx = self.trajectory[j]
-            try:
-                q_sp, _ = self.trajectory[j+1]
-                # print(self.q_table[q_sp])
-                # print(self.alpha*(self.gamma * np.max(self.q_table[q_sp])) - self.q_table[q_s][idx])
-                self.q_table[()][q_s][idx] += self.alpha*(self.gamma * np.max(self.q_table[()][q_sp]) - self.q_table[()][q_s][idx])
-            except IndexError:
-                self.q_table[()][q_s][idx] += self.alpha*(self.gamma * reward - self.q_table[()][q_s][idx])
+        backward_update(self.q_table, self.trajectory, reward, self.alpha, self.gamma, self.lam)
         self.trajectory = []
 
     def save(self, path, filename="sheep"):
-        np.save(os.path.join(path, f"{filename}.npy"), self.q_table)
+        save_q_table(self.q_table, path, filename)
 
     def load(self, filepath):
-        self.q_table = np.load(filepath)
+        self.q_table = load_q_table(filepath)
 
 
 class QWolves(Wolves):
-    """Q-learning with eps-Greedy approach"""
+    """Q-learning with eps-Greedy approach, see QSheep for symmetric, q_table, lam and move_cache"""
 
-    def __init__(self, alpha: float = 0.5, gamma: float = 1.0, eps: float = 0.8):
-        super().__init__()
+    def __init__(self, alpha: float = 0.5, gamma: float = 1.0, eps: float = 0.8, symmetric: bool = False,
+                 q_table=None, lam: float = 0.0, move_cache=None):
+        super().__init__(move_cache)
         self.alpha = alpha
         self.gamma = gamma
         self.eps = eps
+        self.symmetric = symmetric
+        self.lam = lam
 
-        self.q_table = {}
+        self.q_table = {} if q_table is None else q_table
 
         self.trajectory = []
 
@@ -161,38 +247,41 @@ class QWolves(Wolves):
             action_idx = np.argmax(q_states)
         return action_idx
 
+    def pick_batch(self, keys: np.array, counts: np.array) -> np.array:
+        """pick_state for many positions, see BatchBaghChal"""
+        if self.symmetric:
+            raise ValueError("batched play keys the boards as they are, it does not support symmetric=True")
+        return pick_batch(self.q_table, keys, counts, self.eps)
+
     def make_turn(self, current_state: np.array) -> Union[np.array, None]:
-        state_hash = hash(current_state.tobytes())
-        _states = self.get_states(current_state)
-        if not _states:
+        transform = 0
+        if self.symmetric:
+            current_state, transform = canonical_array(current_state)
+        state_key = wolves_key(current_state, self.captured_sheep)
+        _states = self.get_states(current_state, state_key)
+        if len(_states) == 0:
             return None
 
-        if state_hash not in self.q_table:
-            self.q_table[state_hash] = np.zeros(len(_states), dtype=np.float64)
-        q_values = self.q_table[state_hash]
+        if state_key not in self.q_table:
+            self.q_table[state_key] = np.zeros(len(_states), dtype=np.float64)
+        q_values = self.q_table[state_key]
 
         next_state_idx = self.pick_state(q_values)
         new_state = _states[next_state_idx]
         if (current_state - new_state).sum() > 0:
             self.captured_sheep += 1
 
-        self.trajectory.append((state_hash, next_state_idx))
+        self.trajectory.append((state_key, next_state_idx))
+        if transform:
+            new_state = transform_array(new_state, INVERSE[transform])
         return new_state
 
     def update_q_from_trajectory(self, reward):
-
-        for j in range(len(self.trajectory)):
-            q_s, idx = self.trajectory[j]
-            try:
-                q_sp, _ = self.trajectory[j+1]
-                self.q_table[q_s][idx] += self.alpha*(self.gamma * np.max(self.q_table[q_sp]) - self.q_table[q_s][idx])
-            except IndexError:
-                self.q_table[q_s][idx] += self.alpha*(self.gamma * reward - self.q_table[q_s][idx])
-
+        backward_update(self.q_table, self.trajectory, reward, self.alpha, self.gamma, self.lam)
         self.trajectory = []
 
     def save(self, path, filename="wolves"):
-        np.save(os.path.join(path, f"{filename}.npy"), self.q_table)
+        save_q_table(self.q_table, path, filename)
 
     def load(self, filepath):
-        self.q_table = np.load(filepath)
+        self.q_table = load_q_table(filepath)
@@ -3,18 +3,111 @@ from typing import List, Tuple, Union
 
 import numpy as np
 
+from utils.engine import DIRECTION_JUMPS, DIRECTION_NEIGHBOURS, MoveCache
+from utils.keys import sheep_key, wolves_key
+
+# Points are numbered x * 5 + y. The 8 directions are in the order the 3x3 window around a point
+# was always scanned in, so successors keep their order (and index into existing q_table rows).
+DIRECTIONS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if (dx, dy) != (0, 0)]
+
+
+# NEIGHBOURS[p, k]: point one step from p in direction k, JUMPS[p, k]: the landing point of a capture over
+# it, -1 where the step leaves the board or p has no such diagonal. The engine's rules (utilities.py) build
+# them, DIRECTIONS is their direction order.
+NEIGHBOURS = np.array(DIRECTION_NEIGHBOURS, dtype=np.intp)
+JUMPS = np.array(DIRECTION_JUMPS, dtype=np.intp)
+
+# Successors by Q-table key (sheep_key, wolves_key), shared by every Sheep or Wolves of the process that
+# is not given its own cache. The cached arrays are read-only, about 1.2 kB a position.
+STATES_CACHE_SIZE = 1 << 14
+SHEEP_STATES = MoveCache(STATES_CACHE_SIZE)
+WOLVES_STATES = MoveCache(STATES_CACHE_SIZE)
+
+
+def _read_only(states: np.array) -> np.array:
+    states.flags.writeable = False
+    return states
+
+
+def _successors(flat: np.array, start: np.array, target: np.array, piece: int, prey: np.array = None) -> np.array:
+    """
+    Stack of the boards reached by moving piece from start[i] to target[i] (start -1 for a placement,
+    prey[i] >= 0 for a captured sheep), one (N,5,5) array built at once
+    """
+    boards = np.repeat(flat[np.newaxis], len(target), axis=0)
+    rows = np.arange(len(target))
+    moved = start >= 0
+    boards[rows[moved], start[moved]] = 0
+    if prey is not None:
+        captured = prey >= 0
+        boards[rows[captured], prey[captured]] = 0
+    boards[rows, target] = piece
+    return boards.reshape(-1, 5, 5)
+
+
+def _batch_successors(flat: np.array, games: np.array, start: np.array, target: np.array, piece: int,
+                      prey: np.array = None) -> np.array:
+    """_successors over many boards, the i-th move is played on flat[games[i]]"""
+    boards = flat[games]
+    rows = np.arange(len(games))
+    moved = start >= 0
+    boards[rows[moved], start[moved]] = 0
+    if prey is not None:
+        captured = prey >= 0
+        boards[rows[captured], prey[captured]] = 0
+    boards[rows, target] = piece
+    return boards.reshape(-1, 5, 5)
+
+
+def sheep_successors(boards: np.array, placing: np.array, moving: np.array):
+    """
+    Successors of a (B,5,5) stack of boards with sheep to move, for the games where moving is set;
+    placing[b] when game b still has sheep in reserve. Returns (states (M,5,5), games (M,)): the
+    successors of every game one after the other, each game's in Sheep.get_states order.
+    """
+    flat = boards.reshape(len(boards), 25)
+    # A placement on point p takes the first direction slot of p, so it sorts like Sheep._generate_states
+    moves = np.zeros((len(boards), 25, len(DIRECTIONS)), dtype=bool)
+    moves[:, :, 0] = (flat == 0) & (placing & moving)[:, np.newaxis]
+    steps = (flat > 0)[:, :, np.newaxis] & (NEIGHBOURS >= 0) & (flat[:, NEIGHBOURS] == 0)
+    moves |= steps & (~placing & moving)[:, np.newaxis, np.newaxis]
+    games, points, directions = np.nonzero(moves)
+    placed = placing[games]
+    start = np.where(placed, -1, points)
+    target = np.where(placed, points, NEIGHBOURS[points, directions])
+    return _batch_successors(flat, games, start, target, 1), games
+
+
+def wolves_successors(boards: np.array, moving: np.array):
+    """
+    Successors of a (B,5,5) stack of boards with wolves to move, for the games where moving is set.
+    Returns (states (M,5,5), games (M,), captures (M,) bool) in Wolves.get_states order per game.
+    """
+    flat = boards.reshape(len(boards), 25)
+    wolves = (flat < 0)[:, :, np.newaxis] & moving[:, np.newaxis, np.newaxis]
+    step_to = flat[:, NEIGHBOURS]
+    free = (NEIGHBOURS >= 0) & (step_to == 0)
+    capture = (JUMPS >= 0) & (step_to > 0) & (flat[:, JUMPS] == 0)
+    games, points, directions = np.nonzero(wolves & (free | capture))
+    captured = capture[games, points, directions]
+    over = NEIGHBOURS[points, directions]
+    target = np.where(captured, JUMPS[points, directions], over)
+    states = _batch_successors(flat, games, points, target, -1, np.where(captured, over, -1))
+    return states, games, captured
+
 
 class Player:
     # self.__class__.__bases__.__name__ --> 'Player'
 
     @abstractmethod
-    def get_states(self, current_state: np.array) -> List[np.array]:
+    def get_states(self, current_state: np.array, key: int = None) -> List[np.array]:
         """
         Return tuple of available moves.
         0 - empty field
         1 - field occupied with sheep
        -1 - field occupied with wolf
-        :return: list of next possible states (state0, state1, ...) - states are numpy arrays (5x5)
+        :param key: Q-table key of current_state, the successors are cached under it
+        :return: next possible states stacked in one (N,5,5) array
         """
 
     @abstractmethod
@@ -38,25 +131,29 @@ class Player:
 
 
 class Sheep(Player):
-    """figures are marked with 1 in board array"""
+    """figures are marked with 1 in board array, successors come from move_cache (SHEEP_STATES by default)"""
 
-    def __init__(self):
+    def __init__(self, move_cache: MoveCache = None):
         self.in_reserve = 20
         self.color = "white"
+        self.move_cache = SHEEP_STATES if move_cache is None else move_cache
 
-    def get_states(self, current_state: np.array):
+    def get_states(self, current_state: np.array, key: int = None):
         """
         Generate all possible next board states
-        :return: list of states -  List[array(5x5)]
+        :param key: sheep_key of the position if the caller has it already
+        :return: states - array(N, 5, 5), read-only
         """
-        if self.in_reserve > 0:
-            _positions = self._get_empty_fields(current_state)
-            _available_states = self._generate_states(current_state, _positions, add_new=True)
+        if key is None:
+            key = sheep_key(current_state, self.in_reserve)
+        add_new = self.in_reserve > 0
+        if add_new:
             self.in_reserve -= 1
-        else:
-            _positions = self._extract_pieces_position(current_state)
-            _available_states = self._generate_states(current_state, _positions)
-        return _available_states
+        return self.move_cache.get(key, self._cached_states, current_state, add_new)
+
+    @staticmethod
+    def _cached_states(state: np.array, add_new: bool) -> np.array:
+        return _read_only(Sheep._generate_states(state, add_new))
 
     def pick_state(self, states: List[np.array]) -> np.array:
         """picks randomly next state (turn)"""
@@ -74,69 +171,44 @@ class Sheep(Player):
     def _extract_pieces_position(state: np.array) -> np.array:
         return np.array(np.where(state > 0)).T
 
-    def _generate_states(self, state: np.array, positions: np.array, add_new: bool = False) -> np.array:
-        _states = []
-        if add_new:
-            for pos in positions:
-                _states.append(self._create_state(state, None, pos))
-        else:
-            for pos in positions:
-                available_tiles = self._get_available_actions(state, *pos)
-                for target in available_tiles:
-                    _states.append(self._create_state(state, pos, target))
-        return _states
-
-    @staticmethod
-    def _create_state(state: np.array, start_tile, target_tile):
-        board = np.copy(state)
-        if start_tile is not None:
-            x0, y0 = start_tile
-            board[x0][y0] = 0
-        x, y = target_tile
-        board[x][y] = 1
-        return board
-
     @staticmethod
-    def _get_empty_fields(state: np.array) -> np.array:
-        return np.array(np.where(state == 0)).T
+    def _generate_states(state: np.array, add_new: bool = False) -> np.array:
+        flat = state.reshape(-1)
+        if add_new:
+            target = np.flatnonzero(flat == 0)
+            return _successors(flat, np.full(len(target), -1), target, 1)
+        start, target = Sheep._get_available_actions(flat)
+        return _successors(flat, start, target, 1)
 
     @staticmethod
-    def _get_available_actions(state: np.array, x0: int, y0: int):
-        tiles = []
-
-        for x in range(x0 - 1, x0 + 2):
-            if not 4 >= x >= 0:
-                # out of board size
-                continue
-            for y in range(y0 - 1, y0 + 2):
-                if not 4 >= y >= 0:
-                    # out of board size
-                    continue
-                if (x0, y0) == (x, y):
-                    continue
-                if (x0 + y0) % 2 == 0:
-                    if state[x][y] == 0:
-                        tiles.append([x, y])
-                else:
-                    if x == x0 or y == y0:
-                        if state[x][y] == 0:
-                            tiles.append([x, y])
-        return tiles
+    def _get_available_actions(flat: np.array):
+        """(start, target) point arrays of every sheep step, in board then direction order"""
+        sheep = np.flatnonzero(flat > 0)
+        targets = NEIGHBOURS[sheep]
+        free = (targets >= 0) & (flat[targets] == 0)
+        rows, directions = np.nonzero(free)
+        return sheep[rows], targets[rows, directions]
 
 
 class Wolves(Player):
-    """figures are marked with -1 in board array"""
+    """figures are marked with -1 in board array, successors come from move_cache (WOLVES_STATES by default)"""
 
-    def __init__(self):
+    def __init__(self, move_cache: MoveCache = None):
         self.captured_sheep = 0
         self.color = "black"
+        self.move_cache = WOLVES_STATES if move_cache is None else move_cache
 
         # Place wolves in the corner of the game board:
 
-    def get_states(self, current_states: np.array):
-        _positions = self._extract_pieces_position(current_states)
-        _states = self._generate_states(current_states, _positions)
-        return _states
+    def get_states(self, current_states: np.array, key: int = None):
+        """key: wolves_key of the position if the caller has it already"""
+        if key is None:
+            key = wolves_key(current_states, self.captured_sheep)
+        return self.move_cache.get(key, self._cached_states, current_states)
+
+    @staticmethod
+    def _cached_states(state: np.array) -> np.array:
+        return _read_only(Wolves._generate_states(state))
 
     def pick_state(self, states: List[np.array]) -> np.array:
         """picks randomly next state (turn)"""
@@ -145,7 +217,7 @@ class Wolves(Player):
     def make_turn(self, current_state: np.array) -> Union[None, np.array]:
 
         _states = self.get_states(current_state)
-        if not _states:
+        if len(_states) == 0:
             # Wolves agent lose
             return None
         new_state = self.pick_state(_states)
@@ -160,61 +232,26 @@ class Wolves(Player):
     def _extract_pieces_position(state: np.array) -> np.array:
         return np.array(np.where(state < 0)).T
 
-    def _generate_states(self, current_state: np.array, positions: np.array):
-        _states = []
-        for pos in positions:
-            available_tiles = self._get_available_actions(current_state, *pos)
-            for target, prey in available_tiles:
-                _states.append(self._create_state(current_state, pos, target, prey))
-        return _states
-
     @staticmethod
-    def _get_available_actions(state: np.array, x0: int, y0: int):
-        tiles = []
-
-        for x in range(x0 - 1, x0 + 2):
-            if not 4 >= x >= 0:
-                # out of board size
-                continue
-            for y in range(y0 - 1, y0 + 2):
-                if not 4 >= y >= 0:
-                    # out of board size
-                    continue
-                if x0 == x and y0 == y:
-                    # init tile
-                    continue
-                if (x0 + y0) % 2 == 0:
-                    if state[x][y] == 0:
-                        tiles.append(([x, y], None))
-                    elif state[x][y] == 1:  # with sheep figure
-                        # check tile behind sheep
-                        xp = x + (x - x0)
-                        yp = y + (y - y0)
-                        if all([4 >= z >= 0 for z in (xp, yp)]) and state[xp][yp] == 0:
-                            tiles.append(([xp, yp], [x, y]))
-                else:
-                    #
-                    if x != x0 and y != y0:
-                        # exclude diagonal direction
-                        continue
-                    if state[x][y] == 0:
-                        tiles.append(([x, y], None))
-                    elif state[x][y] == 1:  # with sheep figure
-                        # check tile behind sheep
-                        xp = x + (x - x0)
-                        yp = y + (y - y0)
-                        if all([4 >= z >= 0 for z in (xp, yp)]) and state[xp][yp] == 0:
-                            tiles.append(([xp, yp], [x, y]))
-        return tiles
+    def _generate_states(current_state: np.array):
+        flat = current_state.reshape(-1)
+        start, target, prey = Wolves._get_available_actions(flat)
+        return _successors(flat, start, target, -1, prey)
 
     @staticmethod
-    def _create_state(current_state: np.array, start_tile, target_tile, prey_tile):
-        board = np.copy(current_state)
-        if prey_tile:
-            xp, yp = prey_tile
-            board[xp][yp] = 0
-        x0, y0 = start_tile
-        board[x0][y0] = 0
-        x, y = target_tile
-        board[x][y] = -1
-        return board
+    def _get_available_actions(flat: np.array):
+        """
+        (start, target, prey) point arrays of every wolf step or capture in board then direction order,
+        prey is -1 for a step
+        """
+        wolves = np.flatnonzero(flat < 0)
+        steps, jumps = NEIGHBOURS[wolves], JUMPS[wolves]
+        # -1 indexes the last point, only read where the table entry exists
+        step_to = flat[steps]
+        free = (steps >= 0) & (step_to == 0)
+        capture = (jumps >= 0) & (step_to > 0) & (flat[jumps] == 0)
+        rows, directions = np.nonzero(free | capture)
+        captured = capture[rows, directions]
+        over = steps[rows, directions]
+        target = np.where(captured, jumps[rows, directions], over)
+        return wolves[rows], target, np.where(captured, over, -1)
@@ -6,6 +6,13 @@ from utils.agents import (
     QSheep,
     QWolves,
 )
+from utils.agents.base import sheep_successors, wolves_successors
+from utils.keys import SHEEP, state_keys
+
+SHEEP_WON = "sheep"
+WOLVES_WON = "wolves"
+# Captured sheep that end the game
+CAPTURES_TO_WIN = 5
 
 
 class BaghChal:
@@ -39,6 +46,87 @@ class BaghChal:
         self.wolves.captured_sheep = 0
 
 
+class BatchBaghChal:
+    """
+    batch_size games played side by side: the boards are one (B,5,5) int8 array, the counts of each game
+    are (B,) arrays, and every ply generates the successors of all games with one set of numpy calls.
+    Sheep and wolves take turns in every game at once. A game that ends is restarted by step(); when it
+    ended on a sheep ply it sits out the wolves ply that follows, so it starts with the sheep again.
+    Games where active is cleared are left alone, e.g. once enough games were started.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.boards = np.repeat(BaghChal._create_board()[np.newaxis].astype(np.int8), batch_size, axis=0)
+        self.in_reserve = np.full(batch_size, SHEEP, dtype=np.int8)
+        self.captured = np.zeros(batch_size, dtype=np.int8)
+        # Sheep turns of the current game, 0 for a game that has not moved since it (re)started
+        self.turns = np.zeros(batch_size, dtype=np.int32)
+        self.active = np.ones(batch_size, dtype=bool)
+        self.sheep_to_move = True
+        self._states = self._games = self._captures = self._counts = None
+
+    def restart(self, games: np.array = None):
+        """Start the games again, every game if games is None"""
+        if games is None:
+            games = slice(None)
+        self.boards[games] = BaghChal._create_board()
+        self.in_reserve[games] = SHEEP
+        self.captured[games] = 0
+        self.turns[games] = 0
+
+    def keys(self) -> np.array:
+        """Q-table keys of every board, the same as the agents' sheep_key and wolves_key"""
+        return state_keys(self.boards, self.in_reserve, self.captured)
+
+    def get_states(self):
+        """
+        Successors of every game for the side to move: (states (M,5,5), counts (B,)), the counts[b]
+        successors of game b follow those of the games before it. 0 for a game that does not move,
+        because it is over, inactive, sits out the ply or has no move.
+        """
+        if self.sheep_to_move:
+            moving = self.active & (self.captured < CAPTURES_TO_WIN)
+            self._states, self._games = sheep_successors(self.boards, self.in_reserve > 0, moving)
+            self._captures = None
+        else:
+            moving = self.active & (self.turns > 0)
+            self._states, self._games, self._captures = wolves_successors(self.boards, moving)
+        self._counts = np.bincount(self._games, minlength=self.batch_size)
+        return self._states, self._counts
+
+    def step(self, picks: np.array):
+        """
+        Play successor picks[b] of the last get_states in every game that has one, then restart the
+        games that ended. Returns (game, winner, turns, captured) of each of them, winner is None when
+        the sheep could not move.
+        """
+        counts = self._counts
+        moving = counts > 0
+        offsets = np.cumsum(counts) - counts
+        chosen = offsets[moving] + picks[moving]
+        self.boards[moving] = self._states[chosen]
+
+        if self.sheep_to_move:
+            playing = self.active.copy()
+            self.turns[playing] += 1
+            self.in_reserve[moving & (self.in_reserve > 0)] -= 1
+            lost = playing & (self.captured >= CAPTURES_TO_WIN)
+            over = playing & ~moving
+            winners = np.where(lost, WOLVES_WON, None)
+        else:
+            playing = self.active & (self.turns > 0)
+            self.captured[moving] += self._captures[chosen]
+            over = playing & ~moving
+            winners = np.full(self.batch_size, SHEEP_WON, dtype=object)
+
+        games = np.flatnonzero(over)
+        finished = [(game, winners[game], int(self.turns[game]), int(self.captured[game])) for game in games.tolist()]
+        self.restart(games)
+        self.sheep_to_move = not self.sheep_to_move
+        return finished
+
+
 if __name__ == "__main__":
     env = BaghChal(QSheep, QWolves)
 
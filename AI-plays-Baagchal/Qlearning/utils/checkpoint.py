@@ -0,0 +1,105 @@
+"""
+Checkpoints of a dict Q-table: a snapshot saved by save_q_table (path/filename.npy) and an append-only
+log (path/filename.log) of the rows that changed since the snapshot.
+
+A checkpoint appends one block holding only the rows used since the last checkpoint, so its cost grows
+with the rows the episodes touched and not with the table. Compaction folds the log into a new snapshot
+and starts an empty log. load() reads the snapshot and replays the blocks over it in order, a block cut
+short by a crash is dropped.
+
+Every block holds the current values of its rows. A compaction appends a block before it replaces the
+snapshot, so the last logged value of every row equals the snapshot until the new log replaces the old,
+and a crash at any point between the two leaves a snapshot and a log that replay to the same table.
+"""
+import os
+import struct
+
+import numpy as np
+
+from utils.agents.agents_hub import save_q_table
+
+MAGIC = b"QLOG"
+# magic, episodes trained when written, rows, values
+BLOCK = struct.Struct("<4sQQQ")
+
+
+class TrackedTable(dict):
+    """dict Q-table that remembers the keys used since the last checkpoint"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = set()
+
+    def __getitem__(self, key):
+        # Agents update rows in place, every row handed out may change
+        self.changed.add(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, row):
+        self.changed.add(key)
+        dict.__setitem__(self, key, row)
+
+
+def _block(q_table, keys, episodes):
+    rows = [dict.__getitem__(q_table, key) for key in keys]
+    lengths = np.fromiter((len(row) for row in rows), dtype=np.uint8, count=len(rows))
+    values = np.concatenate(rows) if rows else np.zeros(0)
+    return b"".join((BLOCK.pack(MAGIC, episodes, len(keys), len(values)),
+                     np.asarray(keys, dtype=np.int64).tobytes(), lengths.tobytes(),
+                     values.astype("<f8", copy=False).tobytes()))
+
+
+class QTableLog(object):
+    def __init__(self, path, filename):
+        self.path = path
+        self.filename = filename
+        self.snapshot_path = os.path.join(path, f"{filename}.npy")
+        self.log_path = os.path.join(path, f"{filename}.log")
+
+    def load(self):
+        """(TrackedTable, episodes trained) of the snapshot with the log replayed over it"""
+        q_table = TrackedTable()
+        if os.path.exists(self.snapshot_path):
+            dict.update(q_table, np.load(self.snapshot_path, allow_pickle=True)[()])
+        episodes = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                data = f.read()
+            offset = 0
+            while offset + BLOCK.size <= len(data):
+                magic, block_episodes, rows, count = BLOCK.unpack_from(data, offset)
+                end = offset + BLOCK.size + 9 * rows + 8 * count
+                if magic != MAGIC or end > len(data):
+                    break
+                offset += BLOCK.size
+                keys = np.frombuffer(data, dtype=np.int64, count=rows, offset=offset)
+                offset += 8 * rows
+                lengths = np.frombuffer(data, dtype=np.uint8, count=rows, offset=offset)
+                offset += rows
+                values = np.frombuffer(data, dtype="<f8", count=count, offset=offset).astype(np.float64)
+                offset = end
+                for key, row in zip(keys.tolist(), np.split(values, np.cumsum(lengths[:-1], dtype=np.intp))):
+                    dict.__setitem__(q_table, key, row)
+                episodes = block_episodes
+        return q_table, episodes
+
+    def append(self, q_table: TrackedTable, episodes: int):
+        """Log the rows used since the last checkpoint, returns how many were written"""
+        keys = list(q_table.changed)
+        with open(self.log_path, "ab") as f:
+            f.write(_block(q_table, keys, episodes))
+            f.flush()
+            os.fsync(f.fileno())
+        q_table.changed = set()
+        return len(keys)
+
+    def compact(self, q_table: TrackedTable, episodes: int):
+        """Save the whole table as the snapshot and start a log that only holds the episode count"""
+        self.append(q_table, episodes)
+        save_q_table(dict(q_table), self.path, f"{self.filename}.tmp")
+        os.replace(os.path.join(self.path, f"{self.filename}.tmp.npy"), self.snapshot_path)
+        with open(self.log_path + ".tmp", "wb") as f:
+            f.write(_block(q_table, [], episodes))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.log_path + ".tmp", self.log_path)
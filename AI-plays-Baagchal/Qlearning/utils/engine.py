@@ -0,0 +1,34 @@
+"""
+Gives the training code access to the engine modules that live next to gui.py
+(bitboard, symmetry, the rules in utilities, movecache, ...), so both sides share one implementation, and
+converts between the engine's 'T'/'G'/'_' grid and the training boards.
+"""
+import os
+import sys
+
+ENGINE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+if ENGINE_PATH not in sys.path:
+    sys.path.append(ENGINE_PATH)
+
+import numpy as np  # noqa: E402
+
+from movecache import MoveCache  # noqa: E402
+from symmetry import INVERSE, canonical_array, transform_array  # noqa: E402
+from utilities import DIRECTION_JUMPS, DIRECTION_NEIGHBOURS  # noqa: E402
+
+__all__ = ["INVERSE", "canonical_array", "transform_array", "grid_to_array", "array_to_grid",
+           "DIRECTION_NEIGHBOURS", "DIRECTION_JUMPS", "MoveCache"]
+
+# Cell of the engine's grid (agent.py, game.py) -> point of a training board: 1 sheep (goat), -1 wolf (tiger)
+POINT_VALUES = {"G": 1, "T": -1, "_": 0}
+CELLS = {1: "G", -1: "T", 0: "_"}
+
+
+def grid_to_array(grid, dtype=np.int32) -> np.array:
+    """(5,5) training board of a 'T'/'G'/'_' grid"""
+    return np.array([[POINT_VALUES[cell] for cell in row] for row in grid], dtype=dtype)
+
+
+def array_to_grid(state: np.array):
+    """'T'/'G'/'_' grid (a list of 5 lists) of a training board"""
+    return [[CELLS[point] for point in row] for row in np.asarray(state).tolist()]
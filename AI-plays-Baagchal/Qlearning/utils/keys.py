@@ -0,0 +1,62 @@
+"""
+Deterministic integer keys of Q-learning positions.
+
+The 25 points are read as base 3 digits (0 empty, 1 sheep, 2 wolf, the board value mod 3), which takes
+40 bits; the sheep in reserve and the captured sheep follow in 5 bits each. Every position gets its own
+key, and unlike hash(state.tobytes()) the key is the same in every process and on every machine, so a
+saved table can be used by a later run.
+"""
+import sys
+
+import numpy as np
+
+SHEEP = 20
+POWERS = 3 ** np.arange(25, dtype=np.int64)
+RESERVE_SHIFT = 40
+CAPTURED_SHIFT = 45
+COUNT_MASK = 31
+# Low byte of each board value (0, 1 or 0xff) -> its base 3 digit
+DIGITS = bytes.maketrans(b"\x00\x01\xff", b"012")
+LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def _points(state: np.array) -> bytes:
+    """Low byte of every point, a single board is keyed several times a move and numpy calls cost more"""
+    return state.tobytes()[0 if LITTLE_ENDIAN else state.itemsize - 1::state.itemsize]
+
+
+def _board(points: bytes) -> int:
+    # int() reads the most significant digit first, point 24 is the highest
+    return int(points.translate(DIGITS)[::-1], 3)
+
+
+def state_key(state: np.array, in_reserve: int, captured: int) -> int:
+    """Key of one (5,5) board"""
+    return _board(_points(state)) | in_reserve << RESERVE_SHIFT | captured << CAPTURED_SHIFT
+
+
+def state_keys(states: np.array, in_reserve: np.array, captured: np.array) -> np.array:
+    """int64 keys of a (B,5,5) stack of boards, in_reserve and captured hold one count per board"""
+    digits = states.reshape(-1, 25).astype(np.int64) % 3
+    return digits @ POWERS | np.asarray(in_reserve, dtype=np.int64) << RESERVE_SHIFT | \
+        np.asarray(captured, dtype=np.int64) << CAPTURED_SHIFT
+
+
+def sheep_key(state: np.array, in_reserve: int) -> int:
+    """Key of a position where the captured sheep are the ones neither on the board nor in reserve"""
+    points = _points(state)
+    return _board(points) | in_reserve << RESERVE_SHIFT | (SHEEP - in_reserve - points.count(1)) << CAPTURED_SHIFT
+
+
+def wolves_key(state: np.array, captured: int) -> int:
+    """Key of a position where the sheep in reserve are the ones neither on the board nor captured"""
+    points = _points(state)
+    return _board(points) | (SHEEP - captured - points.count(1)) << RESERVE_SHIFT | captured << CAPTURED_SHIFT
+
+
+def unpack_key(key: int):
+    """(state, in_reserve, captured) of a key"""
+    board = key & ((1 << RESERVE_SHIFT) - 1)
+    digits = np.array([board // 3 ** point % 3 for point in range(25)], dtype=np.int32)
+    state = np.where(digits == 2, -1, digits).reshape(5, 5)
+    return state, key >> RESERVE_SHIFT & COUNT_MASK, key >> CAPTURED_SHIFT & COUNT_MASK
@@ -0,0 +1,105 @@
+"""
+Training metrics kept in constant memory: the results of the last window episodes sit in fixed size ring
+buffers, and every few episodes one row of rolling aggregates is appended to a CSV (.csv) or JSON lines
+(any other extension) file. plot.py draws the file, during or after the run.
+"""
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from utils.board import SHEEP_WON, WOLVES_WON
+
+FIELDS = ["episode", "seconds", "episodes_per_s", "sheep_win_rate", "wolves_win_rate", "blocked_rate",
+          "captured_mean", "turns_mean", "sheep_states", "wolves_states", "rss_mb"]
+# Winner codes in the ring buffer
+BLOCKED, SHEEP, WOLVES = 0, 1, 2
+WINNERS = {None: BLOCKED, SHEEP_WON: SHEEP, WOLVES_WON: WOLVES}
+
+
+def rss_mb():
+    """Resident memory of this process in MB, the peak where the current value is not available, else None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10, 1)
+
+
+class TrainingMetrics(object):
+    def __init__(self, path, window: int = 1000, append: bool = False):
+        """Stream rows to path, with append the rows go after those of an earlier run"""
+        self.window = window
+        self.winners = np.zeros(window, dtype=np.int8)
+        self.turns = np.zeros(window, dtype=np.int32)
+        self.captured = np.zeros(window, dtype=np.int8)
+        self.count = 0
+
+        self.started = self.written = time.time()
+        self.written_count = 0
+        self.csv = path.endswith(".csv")
+        write_header = not (append and os.path.exists(path) and os.path.getsize(path))
+        self._file = open(path, "a" if append else "w", newline="")
+        if self.csv:
+            self._writer = csv.DictWriter(self._file, FIELDS)
+            if write_header:
+                self._writer.writeheader()
+
+    def record(self, winner, turns: int, captured: int):
+        slot = self.count % self.window
+        self.winners[slot] = WINNERS[winner]
+        self.turns[slot] = turns
+        self.captured[slot] = captured
+        self.count += 1
+
+    def write(self, episode: int, sheep_states: int, wolves_states: int):
+        """Append the aggregates of the last window episodes, returns the row"""
+        now = time.time()
+        filled = min(self.count, self.window)
+        winners = self.winners[:filled]
+        row = {
+            "episode": episode,
+            "seconds": round(now - self.started, 3),
+            "episodes_per_s": round((self.count - self.written_count) / max(now - self.written, 1e-9), 2),
+            "sheep_win_rate": float(np.mean(winners == SHEEP)) if filled else 0.0,
+            "wolves_win_rate": float(np.mean(winners == WOLVES)) if filled else 0.0,
+            "blocked_rate": float(np.mean(winners == BLOCKED)) if filled else 0.0,
+            "captured_mean": float(np.mean(self.captured[:filled])) if filled else 0.0,
+            "turns_mean": float(np.mean(self.turns[:filled])) if filled else 0.0,
+            "sheep_states": sheep_states,
+            "wolves_states": wolves_states,
+            "rss_mb": rss_mb(),
+        }
+        self.written, self.written_count = now, self.count
+        if self.csv:
+            self._writer.writerow(row)
+        else:
+            self._file.write(json.dumps(row) + "\n")
+        # Flushed at once so the file can be read while the run goes on
+        self._file.flush()
+        return row
+
+    def close(self):
+        self._file.close()
+
+
+def read_metrics(path):
+    """Rows of a metrics file as {field: list of values}, empty values are None"""
+    columns = {field: [] for field in FIELDS}
+    with open(path, newline="") as f:
+        rows = csv.DictReader(f) if path.endswith(".csv") else (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            for field in FIELDS:
+                value = row.get(field)
+                columns[field].append(float(value) if value not in (None, "") else None)
+    return columns
@@ -0,0 +1,141 @@
+"""
+Q-table stored in a memory-mapped file.
+
+An open-addressing hash table (linear probing) of fixed width slots: the state key (see keys.py) plus
+one, so that the zeros of a new sparse file are empty slots, the number of actions and a row of
+MAX_ACTIONS values. Opening a table maps the file without reading it, pages come in as they are
+touched, so startup is immediate and the table can be larger than RAM.
+
+MappedQTable is used like the dict the agents keep: `key in table`, `table[key]` (a view into the map,
+updating it in place updates the file) and `table[key] = values`.
+"""
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"BGQT1\0\0\0"
+# magic, capacity, entries, values per slot, padded so the arrays start 8 byte aligned
+HEADER = struct.Struct("<8sQQQ32x")
+# Most successors a position has: 21 placements, 32 wolf moves, 8 steps into each of 5 empty points
+MAX_ACTIONS = 40
+# Share of the slots in use before the table doubles
+MAX_LOAD = 0.7
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+
+class MappedQTable(object):
+    def __init__(self, path, capacity=1 << 20, max_actions=MAX_ACTIONS):
+        """Open the table at path, or create it with capacity slots (rounded up to a power of two)"""
+        self.path = path
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                magic, capacity, self.count, max_actions = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a Q-table")
+        else:
+            capacity = 1 << max(capacity - 1, 1).bit_length()
+            self.count = 0
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, capacity, 0, max_actions))
+                # Sparse, nothing is written for the slots until they are used
+                f.truncate(HEADER.size + capacity * (9 + 8 * max_actions))
+        self.capacity = capacity
+        self.max_actions = max_actions
+        self.shift = 64 - (capacity.bit_length() - 1)
+        self._map()
+
+    def _map(self):
+        capacity, offset = self.capacity, HEADER.size
+        keys = np.memmap(self.path, dtype=np.int64, mode="r+", offset=offset, shape=(capacity,))
+        offset += 8 * capacity
+        values = np.memmap(self.path, dtype=np.float64, mode="r+", offset=offset, shape=(capacity, self.max_actions))
+        offset += 8 * capacity * self.max_actions
+        lengths = np.memmap(self.path, dtype=np.uint8, mode="r+", offset=offset, shape=(capacity,))
+        self._maps = keys, values, lengths
+        # Plain array views of the same memory, indexing a memmap costs three times as much
+        self.keys, self.values, self.lengths = (array.view(np.ndarray) for array in self._maps)
+
+    def _slot(self, key):
+        """(slot, found): the slot holding key, or the empty slot where it goes"""
+        stored = key + 1
+        keys = self.keys
+        mask = self.capacity - 1
+        slot = (int(key) * HASH_MULTIPLIER & MASK64) >> self.shift
+        while True:
+            found = keys[slot]
+            if found == stored:
+                return slot, True
+            if found == 0:
+                return slot, False
+            slot = (slot + 1) & mask
+
+    def __contains__(self, key):
+        return self._slot(key)[1]
+
+    def __getitem__(self, key):
+        slot, found = self._slot(key)
+        if not found:
+            raise KeyError(key)
+        return self.values[slot, :self.lengths[slot]]
+
+    def get(self, key, default=None):
+        slot, found = self._slot(key)
+        return self.values[slot, :self.lengths[slot]] if found else default
+
+    def __setitem__(self, key, q_values):
+        if len(q_values) > self.max_actions:
+            raise ValueError(f"{len(q_values)} actions, the table holds at most {self.max_actions}")
+        slot, found = self._slot(key)
+        if not found:
+            if self.count + 1 > MAX_LOAD * self.capacity:
+                self._grow()
+                slot, _ = self._slot(key)
+            self.keys[slot] = key + 1
+            self.count += 1
+        self.lengths[slot] = len(q_values)
+        self.values[slot, :len(q_values)] = q_values
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        for slot in np.flatnonzero(self.keys):
+            yield int(self.keys[slot]) - 1, self.values[slot, :self.lengths[slot]]
+
+    def update(self, entries):
+        """Copy every (key, values) of a dict or another table, e.g. a table saved as a pickled dict"""
+        for key, q_values in entries.items():
+            self[key] = q_values
+
+    def _grow(self):
+        """Move every entry into a table twice the size, written next to this one and renamed over it"""
+        grown_path = self.path + ".grow"
+        if os.path.exists(grown_path):
+            os.remove(grown_path)
+        grown = MappedQTable(grown_path, self.capacity * 2, self.max_actions)
+        grown.update(self)
+        grown.close()
+        self.close()
+        os.replace(grown_path, self.path)
+        self.__init__(self.path)
+
+    def flush(self):
+        for array in self._maps:
+            array.flush()
+        with open(self.path, "r+b") as f:
+            f.write(HEADER.pack(MAGIC, self.capacity, self.count, self.max_actions))
+
+    def close(self):
+        if self.keys is None:
+            return
+        self.flush()
+        self.keys = self.values = self.lengths = self._maps = None
+
+
+def load_q_table(path):
+    """A table saved by the agents' save: a pickled dict in a .npy file, or a MappedQTable file"""
+    if path.endswith(".npy"):
+        return np.load(path, allow_pickle=True)[()]
+    return MappedQTable(path)
@@ -0,0 +1,257 @@
+"""
+Self-play training: one episode of QSheep against QWolves, and ParallelTrainer that plays episodes in
+worker processes.
+
+Every worker keeps a copy of both Q-tables and plays sync_every episodes per round with its own seed.
+At the end of a round it sends, for every row it touched, the change since the round started. The
+master adds the mean change of the workers that touched a row to its own tables (the tables that get
+saved) and sends the merged rows back to every worker. What goes over the pipes grows with the rows
+touched in a round, not with the size of the tables.
+"""
+import multiprocessing
+import os
+import random
+
+import numpy as np
+
+from utils.agents import QSheep, QWolves
+from utils.agents.agents_hub import backward_update
+from utils.board import SHEEP_WON, WOLVES_WON, BaghChal, BatchBaghChal
+
+
+def play_episode(env: BaghChal, epoch: int):
+    """
+    Play one game from env's current state and learn from it, then restart env. Returns
+    (winner, turns, captured), winner is None when the game ended with every sheep blocked.
+    """
+    turns = 0
+    while True:
+        turns += 1
+        # Sheep turn:
+        new_state = env.sheep.make_turn(epoch, env.get_state())
+        if new_state is None:
+            env.sheep.update_q_from_trajectory(-1)
+            winner = WOLVES_WON
+            break
+        elif len(new_state) == 0:
+            # all sheep are blocked
+            env.sheep.update_q_from_trajectory(-1)
+            winner = None
+            break
+        env.step(new_state)
+
+        # Wolves turn
+        new_state = env.wolves.make_turn(env.get_state())
+        if new_state is None:
+            env.sheep.update_q_from_trajectory(1)
+            winner = SHEEP_WON
+            break
+        env.step(new_state)
+
+    captured = env.wolves.captured_sheep
+    # The wolves do not learn, drop their moves so a long run does not keep every one of them
+    env.wolves.trajectory = []
+    env.restart()
+    return winner, turns, captured
+
+
+def play_batch(env: BatchBaghChal, sheep: QSheep, wolves: QWolves, episodes: int, first_epoch: int = 1):
+    """
+    play_episode for episodes games over env's boards: sheep and wolves pick the moves of all games in
+    one call per ply and the sheep learn from every game as it ends. Yields (winner, turns, captured)
+    of each game.
+    """
+    trajectories = [[] for _ in range(env.batch_size)]
+    epochs = np.arange(first_epoch, first_epoch + env.batch_size)
+    started = min(env.batch_size, episodes)
+    env.restart()
+    env.active[:] = np.arange(env.batch_size) < started
+    env.sheep_to_move = True
+    done = 0
+    while done < episodes:
+        keys = env.keys()
+        states, counts = env.get_states()
+        moving = np.flatnonzero(counts)
+        picks = np.zeros(env.batch_size, dtype=np.intp)
+        if env.sheep_to_move:
+            picks[moving] = sheep.pick_batch(keys[moving], counts[moving], epochs[moving])
+            for game, key, pick in zip(moving.tolist(), keys[moving].tolist(), picks[moving].tolist()):
+                trajectories[game].append((key, pick))
+        else:
+            picks[moving] = wolves.pick_batch(keys[moving], counts[moving])
+
+        for game, winner, turns, captured in env.step(picks):
+            backward_update(sheep.q_table, trajectories[game], 1 if winner == SHEEP_WON else -1, sheep.alpha,
+                            sheep.gamma, sheep.lam)
+            trajectories[game] = []
+            done += 1
+            if started < episodes:
+                epochs[game] = first_epoch + started
+                started += 1
+            else:
+                env.active[game] = False
+            yield winner, turns, captured
+
+
+class _RoundTable(dict):
+    """Q-table of a worker, remembers every row as it was when the round first used it"""
+
+    def __init__(self):
+        super().__init__()
+        self.start = {}
+
+    def __getitem__(self, key):
+        row = dict.__getitem__(self, key)
+        if key not in self.start:
+            self.start[key] = row.copy()
+        return row
+
+    def __setitem__(self, key, row):
+        if key not in self.start and key not in self:
+            # New rows start at zero (see make_turn), the whole row is the change
+            self.start[key] = None
+        dict.__setitem__(self, key, row)
+
+    def changes(self):
+        """{key: change of the row this round}, and starts the next round"""
+        changes = {}
+        for key, start in self.start.items():
+            row = dict.__getitem__(self, key)
+            changes[key] = row.copy() if start is None else row - start
+        self.start = {}
+        return changes
+
+    def merge(self, rows):
+        """Take the master's rows as they are"""
+        for key, row in rows.items():
+            dict.__setitem__(self, key, row)
+
+
+def _worker(connection, seed, sheep_kwargs, wolves_kwargs, batch_size):
+    """Process loop: (sheep rows, wolves rows, first epoch, episodes) in, (changes, results) out"""
+    random.seed(seed)
+    np.random.seed(seed)
+    env = BaghChal(lambda: QSheep(q_table=_RoundTable(), **sheep_kwargs),
+                   lambda: QWolves(q_table=_RoundTable(), **wolves_kwargs))
+    batch_env = BatchBaghChal(batch_size) if batch_size else None
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        sheep_rows, wolves_rows, first_epoch, episodes = task
+        env.sheep.q_table.merge(sheep_rows)
+        env.wolves.q_table.merge(wolves_rows)
+        if batch_env is not None:
+            results = list(play_batch(batch_env, env.sheep, env.wolves, episodes, first_epoch))
+        else:
+            results = [play_episode(env, epoch) for epoch in range(first_epoch, first_epoch + episodes)]
+        connection.send((env.sheep.q_table.changes(), env.wolves.q_table.changes(), results))
+    connection.close()
+
+
+def _merge(q_table, changes):
+    """Add the mean change of every row to q_table, returns the merged rows"""
+    merged = {}
+    counts = {}
+    for worker_changes in changes:
+        for key, change in worker_changes.items():
+            if key in merged:
+                merged[key] += change
+                counts[key] += 1
+            else:
+                merged[key] = change
+                counts[key] = 1
+    for key, change in merged.items():
+        if counts[key] > 1:
+            change /= counts[key]
+        if key in q_table:
+            row = q_table[key]
+            row += change
+            # A MappedQTable row is a view of the file, a dict row the array itself: write back either way
+            q_table[key] = row
+        else:
+            q_table[key] = change
+        merged[key] = np.array(q_table[key])
+    return merged
+
+
+class ParallelTrainer(object):
+    """
+    Trains self.env's QSheep and QWolves with self-play in workers processes (all cores by default).
+    sheep_kwargs and wolves_kwargs go to the agents of every worker; q_table in them is only used by
+    the master, pass a MappedQTable there to keep the merged table in a file. With batch_size the
+    workers play that many games at once with play_batch.
+    """
+
+    def __init__(self, workers: int = 0, sync_every: int = 100, seed: int = 0, sheep_kwargs: dict = None,
+                 wolves_kwargs: dict = None, batch_size: int = 0):
+        sheep_kwargs = sheep_kwargs or {}
+        wolves_kwargs = wolves_kwargs or {}
+        self.env = BaghChal(lambda: QSheep(**sheep_kwargs), lambda: QWolves(**wolves_kwargs))
+        sheep_kwargs = {name: value for name, value in sheep_kwargs.items() if name != "q_table"}
+        wolves_kwargs = {name: value for name, value in wolves_kwargs.items() if name != "q_table"}
+
+        self.workers = workers or os.cpu_count()
+        self.sync_every = sync_every
+        self.episodes = 0
+        self._connections = []
+        self._processes = []
+        for child_seed in np.random.SeedSequence(seed).spawn(self.workers):
+            connection, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, daemon=True,
+                                              args=(child, int(child_seed.generate_state(1)[0]), sheep_kwargs,
+                                                    wolves_kwargs, batch_size))
+            process.start()
+            child.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+        # Workers start from the master's tables, e.g. ones loaded to continue training
+        self._sheep_rows = dict(self.env.sheep.q_table.items())
+        self._wolves_rows = dict(self.env.wolves.q_table.items())
+
+    def train(self, episodes: int):
+        """Play episodes more episodes, yields (winner, turns, captured) of each as its round ends"""
+        while episodes > 0:
+            per_worker = -(-min(episodes, self.sync_every * self.workers) // self.workers)
+            tasks = []
+            for connection in self._connections:
+                count = min(per_worker, episodes)
+                if count <= 0:
+                    break
+                connection.send((self._sheep_rows, self._wolves_rows, self.episodes + 1, count))
+                tasks.append(connection)
+                self.episodes += count
+                episodes -= count
+
+            replies = [connection.recv() for connection in tasks]
+            self._sheep_rows = _merge(self.env.sheep.q_table, [reply[0] for reply in replies])
+            self._wolves_rows = _merge(self.env.wolves.q_table, [reply[1] for reply in replies])
+            # Workers that sat out the (last, short) round still need its rows before the next one
+            idle = self._connections[len(tasks):]
+            if idle:
+                for connection in idle:
+                    connection.send((self._sheep_rows, self._wolves_rows, self.episodes + 1, 0))
+                for connection in idle:
+                    connection.recv()
+            for reply in replies:
+                yield from reply[2]
+
+    def save(self, path, sheep_filename="sheep", wolves_filename="wolves"):
+        """Checkpoint the merged tables through the agents' save"""
+        self.env.sheep.save(path, sheep_filename)
+        self.env.wolves.save(path, wolves_filename)
+
+    def close(self):
+        for connection in self._connections:
+            connection.send(None)
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
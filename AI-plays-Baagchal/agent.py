@@ -1,18 +1,67 @@
-
 """
 This file contains implementation of AI agent that uses minimax algorithm to find the best possible move
 """
 from collections import namedtuple
-from utilities import x_not_equals_y_operations, x_equals_y_operations, is_inside_board, is_game_over
+from bitboard import BIT, FULL, POINTS, NEIGHBOUR_MASKS, INFLUENCE_MASKS, index, coordinates, from_grid, \
+    write_grid, points, popcount
 import random
-from datetime import datetime
-from copy import deepcopy
-
+import time
+from transposition import TranspositionTable, zobrist, TIGER_KEYS, GOAT_KEYS, IN_HAND_KEYS, DEAD_KEYS, \
+    TIGER_TO_MOVE, EXACT, LOWER, UPPER
+from symmetry import INVERSE, SYMMETRIC_TIGER_KEYS, SYMMETRIC_GOAT_KEYS, transform_move, symmetric_keys
+from tablebase import DRAW, GOAT_WINS, DISTANCE_MASK
+from utilities import CAPTURES_TO_WIN, capture_mask, captures, placements, steps
+from stats import SearchStats
+
+# Moves returned to the caller use (row, col) coordinates
 Move = namedtuple("Move", "type frm to inter")
+# get_best_move(with_stats=True) returns the move with the SearchStats of the search that found it
+SearchResult = namedtuple("SearchResult", "move stats")
 INF = float("inf")
+# Deepest iteration tried when searching with a time or node budget
+MAX_DEPTH = 20
+# Spreads the position key over the tie-break noise, see evaluate
+NOISE_MULTIPLIER = 0x9E3779B97F4A7C15
+NOISE_MASK = (1 << 32) - 1
+NOISE_SCALE = 1.0 / (1 << 32)
+# Value of a position the tablebase says is won, less the plies to the next capture or the end
+TABLEBASE_WIN = 10000
+# Added for every goat captured (tiger wins) or still alive (goat wins). It is more than any stored distance,
+# which only counts plies within one slice, so the winner never scores postponing a capture higher
+TABLEBASE_PROGRESS = 256
+
+
+class SearchTimeout(Exception):
+    """Raised inside minimax when the time or node budget runs out"""
+
+
+def to_move(move):
+    """Convert an internal (type, frm, to, inter) tuple of point indices to a Move"""
+    move_type, frm, to, inter = move
+    return Move(move_type,
+                coordinates(frm) if frm is not None else None,
+                coordinates(to),
+                coordinates(inter) if inter is not None else None)
+
+
+def from_move(move):
+    """Convert a Move with (row, col) coordinates to the internal tuple of point indices"""
+    move_type, frm, to, inter = move
+    return (move_type,
+            index(*frm) if frm is not None else None,
+            index(*to),
+            index(*inter) if inter is not None else None)
+
 
 class Agent(object):
-    def __init__(self, board, turn,goats_in_hand,  dead_goats, depth=5):
+    """
+    The position is kept as two bitboards (self.tigers, self.goats), see bitboard.py.
+    Moves inside the search are plain (type, frm, to, inter) tuples of point indices.
+    Pass the same table to successive Agents to keep what was learnt on earlier moves.
+    With a MoveCache (see movecache.py) as move_cache the move lists of positions seen before are reused.
+    """
+    def __init__(self, board, turn,goats_in_hand,  dead_goats, depth=5, table=None, time_limit=None, node_limit=None,
+                 workers=1, seed=None, book=None, tablebase=None, stats=None, stop=None, move_cache=None):
         self.board = board
         self.depth = depth
         self.best_move = None
@@ -20,243 +69,492 @@ class Agent(object):
         self.turn = turn
         self.goats_in_hand = goats_in_hand
         self.dead_goats = dead_goats
+        self.tigers, self.goats = from_grid(board)
+        # Zobrist key of the position, the side to move is mixed in by minimax
+        self.key = zobrist(self.tigers, self.goats, goats_in_hand, dead_goats)
+        # Symmetry that maps the board onto the position the key stands for, always 0 here, see SymmetricAgent
+        self.transform = 0
+        self.table = table if table is not None else TranspositionTable()
+        # Within one search few positions generate moves twice (the table answers most repeats), so
+        # searches run without a cache unless one is passed
+        self.move_cache = move_cache
+
+        # Evaluation terms, updated by make_move and restored from the undo stack by revert_move.
+        # mobile has a bit set for every tiger with a free neighbour, tiger_captures holds the
+        # goats each tiger point can jump
+        self.mobile = 0
+        self.tiger_captures = [0] * POINTS
+        self.movable_tigers = 0
+        self.capturable_goats = 0
+        self.empty_points = popcount(FULL ^ self.tigers ^ self.goats)
+        self.refresh_tigers(self.tigers)
+        self.undo = []
+        # Tie-break noise is a hash of the position with a seed drawn once per search
+        self.rng = random.Random(seed)
+        self.noise_seed = 0
+
+        # Budget for iterative deepening, time_limit is in milliseconds
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.deadline = None
+        self.limited = False
+        # Anything with is_set(): the search gives up once it is set. With workers != 1 it is pickled
+        # to the worker processes as well, see background._Stop
+        self.stop = stop
+        self.nodes = 0
+        self.completed_depth = 0
+        # More than one worker splits the root moves across processes, see parallel.py
+        self.workers = workers
+        # Opening book consulted before searching, see book.py
+        self.book = book
+        # Exact values of the movement phase, see tablebase.py
+        self.tablebase = tablebase
+        # Position key -> move on the best line of the previous iteration
+        self.pv_moves = {}
+        # Move ordering heuristics, see ordered_moves
+        self.killers = None
+        self.history = None
+        self.clear_heuristics()
+        # Optional SearchStats, it wraps some methods of this instance so that nothing is counted without it
+        self.stats = None
+        if stats is not None:
+            stats.attach(self)
 
     def is_vacant(self, i, j):
-        return self.board[i][j] == '_'
+        return not (self.tigers | self.goats) & BIT[index(i, j)]
+
+    def refresh_tigers(self, mask):
+        """Recompute the terms of the tigers standing on the points in mask, then the totals"""
+        tigers, goats = self.tigers, self.goats
+        empty = FULL ^ tigers ^ goats
+        tiger_captures = self.tiger_captures
+        mobile = self.mobile & ~mask
+        for square in points(mask & tigers):
+            if NEIGHBOUR_MASKS[square] & empty:
+                mobile |= BIT[square]
+            tiger_captures[square] = capture_mask(square, goats, empty)
+        captures = 0
+        for square in points(tigers):
+            captures |= tiger_captures[square]
+        self.mobile = mobile
+        self.movable_tigers = popcount(mobile)
+        self.capturable_goats = popcount(captures)
 
     def number_of_movable_tigers(self):
-        cnt = 0
-        for i in range(5):
-            for j in range(5):
-                operations = x_not_equals_y_operations
-                if i % 2 == j % 2:
-                    operations = x_equals_y_operations
-                if self.board[i][j] == 'T':
-                    for offset_x, offset_y in operations:
-                        next_i, next_j = i + offset_x, j + offset_y
-                        if is_inside_board(next_i, next_j) and self.is_vacant(next_i, next_j):
-                            cnt += 1
-                            break
-        assert(cnt <= 4)
-        return cnt
+        return self.movable_tigers
 
+    def number_of_closed_spaces(self):
+        return self.empty_points
 
+    def tigers_can_move(self):
+        return self.movable_tigers > 0 or self.capturable_goats > 0
 
-    def number_of_closed_spaces(self):
-        cnt = 0
-        for i in range(5):
-            for j in range(5):
-                if self.board[i][j] == '_':
-                    cnt += 1
-        return cnt
-
-    def evaluate(self, depth=0):
-        winner = is_game_over(self.board, self.dead_goats)
-        if not winner[0]:
-             random.seed(datetime.now())
-             return 5 * self.number_of_movable_tigers() + 50 * self.dead_goats + 15 * self.number_of_goats_that_can_be_captured() - random.random()
-            # return depth
-
-        if winner[1] == "Goat":
-            return -INF
-        elif winner[1] == "Tiger":
+    def evaluate(self, depth=0, is_max=None):
+        if self.dead_goats >= 5:
             return INF
+        if not self.movable_tigers and not self.capturable_goats:
+            return -INF
+        if is_max is not None and self.tablebase is not None and not self.goats_in_hand:
+            value = self.tablebase_value(is_max)
+            if value is not None:
+                return value
+        return self.heuristic()
+
+    def heuristic(self):
+        noise = ((self.key ^ self.noise_seed) * NOISE_MULTIPLIER >> 32 & NOISE_MASK) * NOISE_SCALE
+        return 5 * self.movable_tigers + 50 * self.dead_goats + 15 * self.capturable_goats - noise
+
+    def tablebase_value(self, is_max):
+        """Exact value of a movement phase position or None when its slice is not loaded"""
+        result = self.tablebase.probe(self.tigers, self.goats, self.dead_goats, is_max)
+        if result is None:
+            return None
+        if result == DRAW:
+            # On the evaluation's scale, so a draw still compares fairly with leaves of missing slices
+            return self.heuristic()
+        distance = result & DISTANCE_MASK
+        if result & GOAT_WINS:
+            return -(TABLEBASE_WIN + TABLEBASE_PROGRESS * (CAPTURES_TO_WIN - self.dead_goats) - distance)
+        return TABLEBASE_WIN + TABLEBASE_PROGRESS * self.dead_goats - distance
 
     def place_goats(self):
-        moves = []
-        for i in range(5):
-            for j in range(5):
-                if self.is_vacant(i, j):
-                    moves.append(Move("p", None, (i, j), None))
-        return moves
-
+        return placements(FULL ^ self.tigers ^ self.goats)
 
     def number_of_goats_that_can_be_captured(self):
-        cnt = 0
-        board = deepcopy(self.board)
-        for i in range(5):
-            for j in range(5):
-                if board[i][j] == 'T':
-                    operations = x_not_equals_y_operations
-                    if i % 2 == j % 2:
-                        operations = x_equals_y_operations
-
-                    for offset_x, offset_y in operations:
-                        next_i, next_j = i + offset_x, j + offset_y
-                        if is_inside_board(next_i, next_j) and board[next_i][next_j] == 'G':
-                            next_next_i, next_next_j = i + 2 * offset_x, j + 2 * offset_y
-                            if is_inside_board(next_next_i, next_next_j) and \
-                                    board[next_next_i][next_next_j] == '_':
-                                board[next_i][next_j] = '_'
-                                cnt += 1
-
-        return cnt
+        return self.capturable_goats
 
     def move_goats(self):
-        moves = []
-        for i in range(5):
-            for j in range(5):
-                if self.board[i][j] == 'G':
-                    operations = x_not_equals_y_operations
-                    if i % 2 == j % 2:
-                        operations = x_equals_y_operations
-
-                    for offset_x, offset_y in operations:
-                        next_i, next_j = i + offset_x, j + offset_y
-                        if is_inside_board(next_i, next_j) and self.is_vacant(next_i, next_j):
-                            moves.append(Move("m", (i, j), (next_i, next_j), None))
-        return moves
+        return steps(self.goats, FULL ^ self.tigers ^ self.goats)
 
     def move_tigers(self):
-        moves = []
-        for i in range(5):
-            for j in range(5):
-                if self.board[i][j] == 'T':
-                    operations = x_not_equals_y_operations
-                    if i % 2 == j % 2:
-                        operations = x_equals_y_operations
-
-                    for offset_x, offset_y in operations:
-                        next_i, next_j = i + offset_x, j + offset_y
-                        if is_inside_board(next_i, next_j) and self.is_vacant(next_i, next_j):
-                            moves.append(Move("m", (i, j), (next_i, next_j), None))
-        return moves
+        return steps(self.tigers, FULL ^ self.tigers ^ self.goats, points)
 
     def eat_goats(self):
-        moves = []
-        for i in range(5):
-            for j in range(5):
-                if self.board[i][j] == 'T':
-                    operations = x_not_equals_y_operations
-                    if i % 2 == j % 2:
-                        operations = x_equals_y_operations
-
-                    for offset_x, offset_y in operations:
-                        next_i, next_j = i + offset_x, j + offset_y
-                        if is_inside_board(next_i, next_j) and self.board[next_i][next_j] == 'G':
-                            next_next_i, next_next_j = i + 2 * offset_x, j + 2 * offset_y
-                            if is_inside_board(next_next_i, next_next_j) and self.board[next_next_i][next_next_j] == '_':
-                                moves.append(Move('e', (i, j), (next_next_i, next_next_j), (next_i, next_j)))
-        return  moves
-
-
-
-    def generate_move_list(self, is_max):
-        move_list = []
+        return captures(self.tigers, self.goats, FULL ^ self.tigers ^ self.goats)
 
+    def generate_stages(self, is_max):
+        """(captures, quiet moves) of the side to play"""
         # Goat is minimizing
         if not is_max:
             if self.goats_in_hand > 0:
-                move_list.extend(self.place_goats())
-            else:
-                move_list.extend(self.move_goats())
+                return [], self.place_goats()
+            return [], self.move_goats()
         # Tiger is maximizing
+        return self.eat_goats(), self.move_tigers()
+
+    def move_stages(self, is_max):
+        """
+        generate_stages through the move cache, keyed by the bitboards, the side and the phase. The lists
+        may be cached, callers copy them before changing them.
+        """
+        if self.move_cache is None:
+            return self.generate_stages(is_max)
+        key = self.tigers | self.goats << 25 | is_max << 50 | (self.goats_in_hand > 0) << 51
+        return self.move_cache.get(key, self.generate_stages, is_max)
+
+    def generate_move_list(self, is_max):
+        captures, quiet_moves = self.move_stages(is_max)
+        return captures + quiet_moves
+
+    def is_legal(self, move, is_max):
+        """Check a move taken from another position (killer, hash or pv move) against this one"""
+        move_type, frm, to, inter = move
+        empty = FULL ^ self.tigers ^ self.goats
+        if not empty & BIT[to]:
+            return False
+        if move_type == "p":
+            return not is_max and self.goats_in_hand > 0
+        if is_max:
+            if not self.tigers & BIT[frm]:
+                return False
+            return move_type == "m" or bool(self.goats & BIT[inter])
+        return move_type == "m" and self.goats_in_hand == 0 and bool(self.goats & BIT[frm])
+
+    def clear_heuristics(self):
+        self.killers = [[None, None] for _ in range(MAX_DEPTH + 1)]
+        # Cutoff score per move, one table per side
+        self.history = ({}, {})
+
+    def ordered_moves(self, is_max, depth, first=None):
+        """
+        Yield the moves of the side to play in stages: the hash/pv move, captures, the killer moves of this
+        depth, then the remaining quiet moves by history score. Without a move cache a stage is only
+        generated once it is reached so nothing is built for the stages after a cutoff, with one both come
+        from the cache.
+        """
+        if first is not None and self.is_legal(first, is_max):
+            yield first
+
+        if self.move_cache is not None:
+            captures, quiet_moves = self.move_stages(is_max)
         else:
-            move_list.extend(self.eat_goats())
-            move_list.extend(self.move_tigers())
-        return move_list
+            captures, quiet_moves = self.eat_goats() if is_max else (), None
+        for move in captures:
+            if move != first:
+                yield move
+
+        killers = self.killers[depth]
+        for killer in killers:
+            if killer is not None and killer != first and self.is_legal(killer, is_max):
+                yield killer
+
+        if quiet_moves is None:
+            if not is_max:
+                quiet_moves = self.place_goats() if self.goats_in_hand > 0 else self.move_goats()
+            else:
+                quiet_moves = self.move_tigers()
+        history = self.history[is_max]
+        if history:
+            quiet_moves = sorted(quiet_moves, key=lambda move: history.get(move, 0), reverse=True)
+        for move in quiet_moves:
+            if move != first and move != killers[0] and move != killers[1]:
+                yield move
+
+    def record_cutoff(self, move, is_max, depth, remaining):
+        # Captures are already tried early, only quiet moves are remembered
+        if move[0] == "e":
+            return
+        killers = self.killers[depth]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        history = self.history[is_max]
+        history[move] = history.get(move, 0) + remaining * remaining
 
     def make_move(self, move, is_max):
-        object_to_be_placed = 'T' if is_max else 'G'
-        _, frm, to, inter = move
-        if move.type == "p":
-            row, col = to
-            self.board[row][col] = object_to_be_placed
+        move_type, frm, to, inter = move
+        self.undo.append((self.mobile, self.movable_tigers, self.capturable_goats, self.tiger_captures[:]))
+        if move_type == "p":
+            self.goats |= BIT[to]
+            self.key ^= GOAT_KEYS[to] ^ IN_HAND_KEYS[self.goats_in_hand] ^ IN_HAND_KEYS[self.goats_in_hand - 1]
             self.goats_in_hand -= 1
-        elif move.type == "m":
-            row1, col1 = frm
-            row2, col2 = to
-
-            self.board[row1][col1] = '_'
-            self.board[row2][col2] = object_to_be_placed
-        elif move.type == "e":
-            row1, col1 = frm
-            goat_x, goat_y = inter
-            row2, col2 = to
-            self.dead_goats += 1
-            self.board[row1][col1] = '_'
-            self.board[goat_x][goat_y] = '_'
-            self.board[row2][col2] = object_to_be_placed
-
-
+            self.empty_points -= 1
+            if INFLUENCE_MASKS[to] & self.tigers:
+                self.refresh_tigers(INFLUENCE_MASKS[to])
+            return
+        changed = BIT[frm] | BIT[to]
+        influence = INFLUENCE_MASKS[frm] | INFLUENCE_MASKS[to]
+        if is_max:
+            self.tigers ^= changed
+            self.key ^= TIGER_KEYS[frm] ^ TIGER_KEYS[to]
+            if move_type == "e":
+                self.goats ^= BIT[inter]
+                self.key ^= GOAT_KEYS[inter] ^ DEAD_KEYS[self.dead_goats] ^ DEAD_KEYS[self.dead_goats + 1]
+                self.dead_goats += 1
+                self.empty_points += 1
+                influence |= INFLUENCE_MASKS[inter]
+        else:
+            self.goats ^= changed
+            self.key ^= GOAT_KEYS[frm] ^ GOAT_KEYS[to]
+        self.refresh_tigers(influence)
 
     def revert_move(self, move,  is_max):
-        object_to_be_placed = 'T' if is_max else 'G'
-        _, frm, to, inter = move
-        if move.type == "p":
-            row, col = to
-            self.board[row][col] = '_'
+        move_type, frm, to, inter = move
+        self.mobile, self.movable_tigers, self.capturable_goats, self.tiger_captures = self.undo.pop()
+        if move_type == "p":
+            self.goats ^= BIT[to]
+            self.key ^= GOAT_KEYS[to] ^ IN_HAND_KEYS[self.goats_in_hand] ^ IN_HAND_KEYS[self.goats_in_hand + 1]
             self.goats_in_hand += 1
-        elif move.type == "m":
-            row1, col1 = frm
-            row2, col2 = to
-
-            self.board[row1][col1] = object_to_be_placed
-            self.board[row2][col2] = '_'
-        elif move.type == "e":
-            row1, col1 = frm
-            goat_x, goat_y = inter
-            row2, col2 = to
-            self.dead_goats -= 1
-            self.board[row1][col1] = object_to_be_placed
-            self.board[goat_x][goat_y] = 'G'
-            self.board[row2][col2] = '_'
+            self.empty_points += 1
+        elif is_max:
+            self.tigers ^= BIT[frm] | BIT[to]
+            self.key ^= TIGER_KEYS[frm] ^ TIGER_KEYS[to]
+            if move_type == "e":
+                self.goats ^= BIT[inter]
+                self.key ^= GOAT_KEYS[inter] ^ DEAD_KEYS[self.dead_goats] ^ DEAD_KEYS[self.dead_goats - 1]
+                self.dead_goats -= 1
+                self.empty_points -= 1
+        else:
+            self.goats ^= BIT[frm] | BIT[to]
+            self.key ^= GOAT_KEYS[frm] ^ GOAT_KEYS[to]
 
     def minimax(self, is_max=True, depth=0, alpha=-INF, beta=INF):
-        score = self.evaluate(depth)
-
-        if depth == self.depth or abs(score) == INF:
-            return score
-
+        self.nodes += 1
+        if self.limited and not self.nodes & 1023 and self.out_of_budget():
+            raise SearchTimeout()
+
+        if depth == self.depth:
+            return self.evaluate(depth, is_max)
+        # Game over before the horizon
+        if self.dead_goats >= 5:
+            return INF
+        if not self.movable_tigers and not self.capturable_goats:
+            return -INF
+        # The tablebase knows the outcome, the root still searches so that best_move gets set
+        if depth and self.tablebase is not None and not self.goats_in_hand:
+            value = self.tablebase_value(is_max)
+            if value is not None:
+                return value
+
+        remaining = self.depth - depth
+        key = self.key ^ TIGER_TO_MOVE if is_max else self.key
+        entry = self.table.probe(key)
+        tt_move = None
+        if entry is not None:
+            _, entry_depth, bound, entry_value, tt_move, _ = entry
+            # The root always searches so that best_move gets set
+            if depth > 0 and entry_depth >= remaining:
+                if bound == EXACT:
+                    return entry_value
+                if bound == LOWER and entry_value >= beta:
+                    return entry_value
+                if bound == UPPER and entry_value <= alpha:
+                    return entry_value
+
+        alpha_orig, beta_orig = alpha, beta
+        # Try the previous iteration's best line, then the move stored for this position
+        first = self.pv_moves.get(key, tt_move)
+        if first is not None and self.transform:
+            first = transform_move(first, INVERSE[self.transform])
+        move_list = self.ordered_moves(is_max, depth, first)
+        best = None
 
         if not is_max:
             value = INF
 
-            for move in self.generate_move_list(is_max):
+            for move in move_list:
                 self.make_move(move, is_max)
                 current_value = self.minimax(True, depth + 1, alpha, beta)
                 beta = min(beta, current_value)
 
-                if current_value == value and depth == 0:
-                    self.best_move = move
                 if current_value < value:
 
                     value = current_value
                     beta = min(beta, value)
+                    best = move
                     if depth == 0:
                         self.best_move = move
+                elif depth == 0 and self.best_move is None:
+                    # Every move of a lost position scores the initial value, play the first one tried
+                    self.best_move = move
 
                 self.revert_move(move, is_max)
                 if alpha >= beta:
+                    self.record_cutoff(move, is_max, depth, remaining)
                     break
-            return value
 
         else:
             value = -INF
-            for move in self.generate_move_list(is_max):
+            for move in move_list:
                 self.make_move(move, is_max)
                 current_value = self.minimax(False, depth + 1, alpha, beta)
                 alpha = max(alpha, value)
-                if current_value == value and depth == 0:
-                    self.best_move = move
                 if current_value > value:
 
                     value = current_value
                     alpha = max(alpha, value)
+                    best = move
                     if depth == 0:
                         self.best_move = move
+                elif depth == 0 and self.best_move is None:
+                    # Every move of a lost position scores the initial value, play the first one tried
+                    self.best_move = move
                 self.revert_move(move, is_max)
 
                 if alpha >= beta:
+                    self.record_cutoff(move, is_max, depth, remaining)
                     break
-            return value
+
+        if value <= alpha_orig:
+            bound = UPPER
+        elif value >= beta_orig:
+            bound = LOWER
+        else:
+            bound = EXACT
+        if best is not None and self.transform:
+            best = transform_move(best, self.transform)
+        self.table.store(key, remaining, bound, value, best)
+        return value
+
+    def search(self, is_max):
+        if self.workers != 1:
+            from parallel import search_root, worker_count
+            return search_root(self, is_max, worker_count(self.workers))
+        self.best_move = None
+        self.table.new_search()
+        return self.minimax(is_max)
+
+    def save_position(self):
+        return (self.tigers, self.goats, self.key, self.goats_in_hand, self.dead_goats, self.empty_points, self.mobile,
+                self.movable_tigers, self.capturable_goats, self.tiger_captures[:])
+
+    def restore_position(self, position):
+        (self.tigers, self.goats, self.key, self.goats_in_hand, self.dead_goats, self.empty_points, self.mobile,
+         self.movable_tigers, self.capturable_goats, self.tiger_captures) = position
+        self.undo = []
+
+    def out_of_budget(self):
+        if self.stop is not None and self.stop.is_set():
+            return True
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            return True
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    def board_move(self, stored):
+        """Map a move kept in the table or pv (stored for the key's position) onto the board"""
+        if stored is not None and self.transform:
+            return transform_move(stored, INVERSE[self.transform])
+        return stored
+
+    def principal_variation(self, is_max):
+        """
+        Follow the stored best moves from the current position. Returns (key, stored move, board move, is_max)
+        for every ply of the line.
+        """
+        line = []
+        seen = set()
+        for _ in range(self.depth):
+            key = self.key ^ TIGER_TO_MOVE if is_max else self.key
+            entry = self.table.probe(key)
+            if entry is None or entry[4] is None or key in seen:
+                break
+            seen.add(key)
+            move = self.board_move(entry[4])
+            line.append((key, entry[4], move, is_max))
+            self.make_move(move, is_max)
+            is_max = not is_max
+        for _, _, move, side in reversed(line):
+            self.revert_move(move, side)
+        return line
+
+    def iterative_deepening(self, is_max, max_depth=MAX_DEPTH):
+        """
+        Search depth 1, 2, ... until the time or node budget runs out and keep the best move of the deepest
+        completed iteration. Depth 1 always completes so there is always a move to play.
+        """
+        self.nodes = 0
+        self.deadline = None
+        if self.time_limit is not None:
+            self.deadline = time.perf_counter() + self.time_limit / 1000.0
+        self.pv_moves = {}
+        self.completed_depth = 0
+        position = self.save_position()
+        best_move = None
+        value = None
+
+        for depth in range(1, max_depth + 1):
+            self.depth = depth
+            self.limited = depth > 1
+            try:
+                iteration_value = self.search(is_max)
+            except SearchTimeout:
+                # Undo the moves left on the board by the interrupted iteration
+                self.restore_position(position)
+                break
+            value = iteration_value
+            best_move = self.best_move
+            self.completed_depth = depth
+            self.pv_moves = {key: stored for key, stored, _, _ in self.principal_variation(is_max)}
+            # Forced result, searching deeper won't change it
+            if abs(value) == INF or self.out_of_budget():
+                break
+
+        self.limited = False
+        self.best_move = best_move
+        return value
+
+    def think(self, is_max):
+        if self.stats is not None:
+            self.stats.begin()
+        self.clear_heuristics()
+        self.noise_seed = self.rng.getrandbits(64)
+        if self.time_limit is None and self.node_limit is None:
+            # Only a stop can interrupt a fixed depth search, SearchTimeout then reaches the caller
+            self.limited = self.stop is not None
+            try:
+                value = self.search(is_max)
+            finally:
+                self.limited = False
+        else:
+            value = self.iterative_deepening(is_max, self.depth)
+        if self.stats is not None:
+            self.stats.end(value, to_move(self.best_move) if self.best_move is not None else None)
+        return value
+
+    def book_move(self, is_max):
+        """
+        Legal move stored in the opening book for this position or None. A book built deeper than this
+        Agent searches would make it play above its depth (e.g. Easy as strong as Hard), it is skipped.
+        """
+        if self.book is None or self.goats_in_hand == 0 or self.depth < self.book.depth:
+            return None
+        move = self.book.probe(self.tigers, self.goats, self.goats_in_hand, self.dead_goats, is_max)
+        if move is None or not self.is_legal(move, is_max):
+            return None
+        if self.stats is not None:
+            self.stats.book_move(to_move(move))
+        return move
 
     def best_tiger_move(self):
-        self.minimax()
+        self.best_move = self.book_move(True)
+        if self.best_move is None:
+            self.think(True)
         return self.best_move
 
     def best_goat_move(self):
-        self.minimax(is_max=False)
+        self.best_move = self.book_move(False)
+        if self.best_move is None:
+            self.think(False)
         return self.best_move
 
     def make_best_move(self):
@@ -269,14 +567,85 @@ class Agent(object):
         else:
             is_max = True
         self.make_move(move, is_max)
+        # Keep the caller's grid in sync with the bitboards
+        write_grid(self.board, self.tigers, self.goats)
+
+
+    def get_best_move(self, with_stats=False):
+        # A collector attached only for this call is detached again so later calls run unwrapped
+        attached = None
+        if with_stats:
+            if self.stats is None:
+                attached = SearchStats()
+                attached.attach(self)
+            self.stats.reset()
+        stats = self.stats
+        try:
+            if self.turn == "Goat":
+                move = self.best_goat_move()
+            else:
+                move = self.best_tiger_move()
+        finally:
+            if attached is not None:
+                attached.detach()
+
+        move = to_move(move) if move is not None else None
+        if with_stats:
+            return SearchResult(move, stats)
+        return move
 
+class SymmetricAgent(Agent):
+    """
+    Agent whose transposition table is keyed by the canonical position, see symmetry.py: the 8 symmetric
+    images of a position share one entry. The Zobrist keys of all 8 images are kept up to date, self.key
+    is the smallest of them and self.transform the image it belongs to. Moves in the table are stored
+    for that image.
+    """
+    def __init__(self, board, turn, goats_in_hand, dead_goats, depth=5, **kwargs):
+        Agent.__init__(self, board, turn, goats_in_hand, dead_goats, depth, **kwargs)
+        extra = IN_HAND_KEYS[goats_in_hand] ^ DEAD_KEYS[dead_goats]
+        self.symmetric_keys = [key ^ extra for key in symmetric_keys(self.tigers, self.goats)]
+        self.symmetric_undo = []
+        self.set_canonical_key()
+
+    def set_canonical_key(self):
+        self.key = min(self.symmetric_keys)
+        self.transform = self.symmetric_keys.index(self.key)
 
-    def get_best_move(self):
-        if self.turn == "Goat":
-            move = self.best_goat_move()
+    def make_move(self, move, is_max):
+        goats_in_hand, dead_goats = self.goats_in_hand, self.dead_goats
+        Agent.make_move(self, move, is_max)
+        self.symmetric_undo.append((self.symmetric_keys, self.transform))
+
+        move_type, frm, to, inter = move
+        extra = IN_HAND_KEYS[goats_in_hand] ^ IN_HAND_KEYS[self.goats_in_hand] ^ \
+            DEAD_KEYS[dead_goats] ^ DEAD_KEYS[self.dead_goats]
+        if move_type == "p":
+            changed = SYMMETRIC_GOAT_KEYS[to]
+            keys = [key ^ changed[t] ^ extra for t, key in enumerate(self.symmetric_keys)]
         else:
-            move = self.best_tiger_move()
-
-        return move
-
-# The heuristic value for the tiger piece was calculated based on the number of goats in the board, mobility of the piece and number of possible captures.
\ No newline at end of file
+            piece_keys = SYMMETRIC_TIGER_KEYS if is_max else SYMMETRIC_GOAT_KEYS
+            old, new = piece_keys[frm], piece_keys[to]
+            keys = [key ^ old[t] ^ new[t] ^ extra for t, key in enumerate(self.symmetric_keys)]
+            if move_type == "e":
+                eaten = SYMMETRIC_GOAT_KEYS[inter]
+                keys = [key ^ eaten[t] for t, key in enumerate(keys)]
+        self.symmetric_keys = keys
+        self.set_canonical_key()
+
+    def revert_move(self, move, is_max):
+        Agent.revert_move(self, move, is_max)
+        self.symmetric_keys, self.transform = self.symmetric_undo.pop()
+        self.key = self.symmetric_keys[self.transform]
+
+    def save_position(self):
+        return Agent.save_position(self), self.symmetric_keys, self.transform
+
+    def restore_position(self, position):
+        position, self.symmetric_keys, self.transform = position
+        Agent.restore_position(self, position)
+        self.key = self.symmetric_keys[self.transform]
+        self.symmetric_undo = []
+
+
+# The heuristic value for the tiger piece was calculated based on the number of goats in the board, mobility of the piece and number of possible captures.
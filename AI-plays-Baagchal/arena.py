@@ -0,0 +1,286 @@
+"""
+Arena: engine against engine matches without the GUI, to measure strength and speed.
+
+Every pair of players meets in --games games, half of them with each side. A player is one of
+
+    agent:4        the minimax Agent searching 4 moves ahead
+    agent:200ms    the Agent with iterative deepening under 200 ms per move
+    q              QSheep/QWolves greedy on q-sheep1.npy/q-wolves1.npy in the Qlearning directory
+    q:DIR          the same with the tables in DIR (needs numpy)
+    random         a uniformly random legal move
+
+The first --random-plies plies of every game are random so that deterministic players do not replay
+one game. The tiger wins by capturing 5 goats or when the goats cannot move, the goats by shutting the
+tigers in, and a game still going after --max-plies plies is a draw. Games run in a process pool.
+
+For every pair the arena reports wins, draws and losses, the Elo difference with its 95% confidence
+interval, and for every player the average time per move and the nodes (positions the Agent searched,
+successors considered by the others) per second.
+
+    python arena.py agent:3 agent:4 random --games 200
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+from agent import MAX_DEPTH, Agent
+from bitboard import BIT, from_grid, write_grid
+from transposition import TranspositionTable
+from utilities import goat_moves, tiger_moves, winner
+
+QLEARNING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Qlearning")
+
+GOAT_WINS, TIGER_WINS, DRAW = "Goat", "Tiger", "Draw"
+
+
+def start_grid():
+    grid = [["_" for _ in range(5)] for _ in range(5)]
+    grid[0][0] = grid[0][4] = grid[4][0] = grid[4][4] = "T"
+    return grid
+
+
+class EnginePlayer(object):
+    def __init__(self, depth=None, time_limit=None):
+        self.depth = depth
+        self.time_limit = time_limit
+        self.table = None
+
+    def new_game(self):
+        self.table = TranspositionTable()
+
+    def move(self, grid, turn, goats_in_hand, dead_goats, rng):
+        """Play on grid, returns (goats_in_hand, dead_goats, nodes)"""
+        # A time budget deepens up to MAX_DEPTH, as in the GUI
+        agent = Agent(grid, turn, goats_in_hand, dead_goats, self.depth or MAX_DEPTH, table=self.table,
+                      time_limit=self.time_limit, seed=rng.getrandbits(32))
+        agent.make_best_move()
+        return agent.goats_in_hand, agent.dead_goats, agent.nodes
+
+
+class RandomPlayer(object):
+    def new_game(self):
+        pass
+
+    def move(self, grid, turn, goats_in_hand, dead_goats, rng):
+        tigers, goats = from_grid(grid)
+        moves = tiger_moves(tigers, goats) if turn == "Tiger" else goat_moves(tigers, goats, goats_in_hand)
+        move_type, frm, to, inter = rng.choice(moves)
+        if turn == "Tiger":
+            tigers ^= BIT[frm] | BIT[to]
+            if move_type == "e":
+                goats ^= BIT[inter]
+                dead_goats += 1
+        else:
+            goats ^= (BIT[frm] if frm is not None else 0) | BIT[to]
+            if move_type == "p":
+                goats_in_hand -= 1
+        write_grid(grid, tigers, goats)
+        return goats_in_hand, dead_goats, len(moves)
+
+
+# Q-tables of this process by directory, every game of a worker shares them
+_q_tables = {}
+
+
+class QPlayer(object):
+    """Greedy on the trained table, the first successor in a position the table never saw"""
+    def __init__(self, path):
+        if QLEARNING_PATH not in sys.path:
+            sys.path.append(QLEARNING_PATH)
+        from utils.agents.base import Sheep, Wolves
+        from utils.qtable import load_q_table
+        if path not in _q_tables:
+            _q_tables[path] = (load_q_table(os.path.join(path, "q-sheep1.npy")),
+                               load_q_table(os.path.join(path, "q-wolves1.npy")))
+        self.sheep_table, self.wolves_table = _q_tables[path]
+        self.sheep, self.wolves = Sheep(), Wolves()
+
+    def new_game(self):
+        pass
+
+    def move(self, grid, turn, goats_in_hand, dead_goats, rng):
+        import numpy as np
+        from utils.engine import array_to_grid, grid_to_array
+        from utils.keys import sheep_key, wolves_key
+        state = grid_to_array(grid)
+        if turn == "Goat":
+            key = sheep_key(state, goats_in_hand)
+            self.sheep.in_reserve = goats_in_hand
+            states = self.sheep.get_states(state, key)
+            row = self.sheep_table.get(key)
+        else:
+            key = wolves_key(state, dead_goats)
+            states = self.wolves.get_states(state, key)
+            row = self.wolves_table.get(key)
+        new_state = states[int(np.argmax(row)) if row is not None else 0]
+        grid[:] = array_to_grid(new_state)
+        if turn == "Goat":
+            return (goats_in_hand - 1 if goats_in_hand else 0), dead_goats, len(states)
+        # A capture leaves one goat fewer on the board
+        return goats_in_hand, dead_goats + int((state > 0).sum() - (new_state > 0).sum()), len(states)
+
+
+def make_player(spec):
+    """Player of a spec, see the module docstring"""
+    kind, _, argument = spec.partition(":")
+    if kind == "agent":
+        if argument.endswith("ms"):
+            return EnginePlayer(time_limit=int(argument[:-2]))
+        return EnginePlayer(depth=int(argument or 3))
+    if kind == "q":
+        return QPlayer(argument or QLEARNING_PATH)
+    if kind == "random":
+        return RandomPlayer()
+    raise ValueError(f"unknown player {spec!r}, expected agent:DEPTH, agent:MSms, q[:DIR] or random")
+
+
+def play_game(goat, tiger, seed, random_plies, max_plies):
+    """
+    Play one game between two players, returns (result, goat (seconds, moves, nodes), tiger (...)),
+    the random opening plies are not counted
+    """
+    rng = random.Random(seed)
+    grid, goats_in_hand, dead_goats, turn = start_grid(), 20, 0, "Goat"
+    opening = RandomPlayer()
+    usage = {"Goat": [0.0, 0, 0], "Tiger": [0.0, 0, 0]}
+    goat.new_game()
+    tiger.new_game()
+    for ply in range(max_plies):
+        tigers, goats = from_grid(grid)
+        result = winner(tigers, goats, dead_goats)
+        if result is None and turn == "Goat" and not goat_moves(tigers, goats, goats_in_hand):
+            result = TIGER_WINS
+        if result is not None:
+            return result, usage["Goat"], usage["Tiger"]
+
+        player = opening if ply < random_plies else goat if turn == "Goat" else tiger
+        started = time.perf_counter()
+        goats_in_hand, dead_goats, nodes = player.move(grid, turn, goats_in_hand, dead_goats, rng)
+        if player is not opening:
+            used = usage[turn]
+            used[0] += time.perf_counter() - started
+            used[1] += 1
+            used[2] += nodes
+        turn = "Tiger" if turn == "Goat" else "Goat"
+    return DRAW, usage["Goat"], usage["Tiger"]
+
+
+def _play_games(first, second, seeds, random_plies, max_plies):
+    """Worker task: games of first against second, first takes the goats in the even ones"""
+    players = make_player(first), make_player(second)
+    records = []
+    for number, seed in seeds:
+        first_is_goat = number % 2 == 0
+        goat, tiger = players if first_is_goat else players[::-1]
+        result, goat_usage, tiger_usage = play_game(goat, tiger, seed, random_plies, max_plies)
+        records.append((first_is_goat, result, goat_usage, tiger_usage))
+    return records
+
+
+def expected_to_elo(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+
+def elo(wins, draws, losses, z=1.96):
+    """
+    (Elo difference, low, high) of a score, a draw counts half. The interval is the Wilson interval of
+    the score, it stays finite on the side away from a clean sweep.
+    """
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    spread = z * z / games
+    centre = (score + spread / 2) / (1 + spread)
+    margin = z * math.sqrt(score * (1 - score) / games + spread / (4 * games)) / (1 + spread)
+    low = expected_to_elo(centre - margin) if score > 0 else -math.inf
+    high = expected_to_elo(centre + margin) if score < 1 else math.inf
+    return expected_to_elo(score), low, high
+
+
+class Tally(object):
+    def __init__(self):
+        self.results = {"Goat": [0, 0, 0], "Tiger": [0, 0, 0]}
+
+    def add(self, side, result):
+        """result of a game where the player had side, as win/draw/loss"""
+        self.results[side][0 if result == side else 1 if result == DRAW else 2] += 1
+
+    def total(self):
+        return [goat + tiger for goat, tiger in zip(self.results["Goat"], self.results["Tiger"])]
+
+
+def run(players, games, workers, seed, random_plies, max_plies, chunk=10, log=print):
+    """Play every pair, returns {(first, second): Tally of first} and {player: [seconds, moves, nodes]}"""
+    pairs = list(combinations(players, 2))
+    tallies = {pair: Tally() for pair in pairs}
+    usage = {player: [0.0, 0, 0] for player in players}
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or None) as executor:
+        futures = []
+        for pair in pairs:
+            seeds = [(number, rng.getrandbits(32)) for number in range(games)]
+            for start in range(0, games, chunk):
+                futures.append((pair, executor.submit(_play_games, *pair, seeds[start:start + chunk], random_plies,
+                                                      max_plies)))
+        for pair, future in futures:
+            first, second = pair
+            for first_is_goat, result, goat_usage, tiger_usage in future.result():
+                tallies[pair].add("Goat" if first_is_goat else "Tiger", result)
+                first_usage, second_usage = (goat_usage, tiger_usage) if first_is_goat else (tiger_usage, goat_usage)
+                for player, used in ((first, first_usage), (second, second_usage)):
+                    usage[player] = [total + value for total, value in zip(usage[player], used)]
+    log(f"{len(pairs) * games} games in {time.perf_counter() - started:.1f} s")
+    return tallies, usage
+
+
+def signed(value):
+    # + 0.0 turns -0.0 into 0.0, printed +0
+    return f"{value + 0.0:+.0f}" if math.isfinite(value) else ("+inf" if value > 0 else "-inf")
+
+
+def report(tallies, usage, log=print):
+    for (first, second), tally in tallies.items():
+        wins, draws, losses = tally.total()
+        difference, low, high = elo(wins, draws, losses)
+        log(f"{first} vs {second}: +{wins} ={draws} -{losses}  Elo {signed(difference)} "
+            f"[{signed(low)}, {signed(high)}]")
+        for side in ("Goat", "Tiger"):
+            side_wins, side_draws, side_losses = tally.results[side]
+            log(f"    {first} as {side}: +{side_wins} ={side_draws} -{side_losses}")
+    for player, (seconds, moves, nodes) in usage.items():
+        if moves:
+            log(f"{player}: {1000 * seconds / moves:.2f} ms/move, {nodes / max(seconds, 1e-9):.0f} nodes/s")
+
+
+def main():
+    arguments = argparse.ArgumentParser(description="Engine against engine matches with Elo")
+    arguments.add_argument("players", nargs="+", help="agent:DEPTH, agent:MSms, q[:DIR] or random, two or more")
+    arguments.add_argument("--games", type=int, default=100, help="games of every pair")
+    arguments.add_argument("--workers", type=int, default=0, help="processes, 0 uses every core")
+    arguments.add_argument("--seed", type=int, default=0)
+    arguments.add_argument("--random-plies", type=int, default=2)
+    arguments.add_argument("--max-plies", type=int, default=200)
+    args = arguments.parse_args()
+    if len(args.players) < 2:
+        arguments.error("needs two players or more")
+    for player in args.players:
+        try:
+            make_player(player)
+        except (ValueError, OSError) as error:
+            arguments.error(str(error))
+
+    report(*run(args.players, args.games, args.workers, args.seed, args.random_plies, args.max_plies))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
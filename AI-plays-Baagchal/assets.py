@@ -18,6 +18,8 @@ class Assets(object):
         self.tiger_image_path = "images/tigers/tiger_64x64.png"
         self.goat_image_path = "images/goats/goat_64x64.png"
         self.configuration_path = "settings.conf"
+        self.book_path = "opening.book"
+        self.tablebase_path = "tablebase"
 
         # self.blank_image_path = resource_path("blank_64x64.png")
         # self.tiger_image_path = resource_path("tiger_64x64.png")
@@ -0,0 +1,200 @@
+"""
+Runs the AI's search in a separate process so the Tk event loop keeps running while it thinks.
+
+The GUI submits the position and polls the returned future from master.after. One worker process
+does every search of the session and keeps its transposition table between moves. Every submit
+gets a new search id kept in shared memory; a search stops (through Agent.stop) as soon as the id
+moves on, so cancel() and a newer submit() both end the search running in the worker.
+
+While the human thinks, ponder() searches the AI's answer to the likeliest human replies in the same
+worker. The answers go to a cache of prepared moves and the searches fill the shared table: a fixed
+depth search of a pondered position is answered from the cache at once, a timed one starts from the
+filled table and gets deeper in the same time. The human's move submits the real search, which stops
+the pondering like any other search.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import parallel
+from agent import Agent, SearchTimeout
+from bitboard import to_grid
+from book import OpeningBook
+from tablebase import Tablebase
+from transposition import TranspositionTable
+
+_executor = None
+# Id of the search that may run, shared with the worker
+_current = None
+
+# Per worker process state
+_table = None
+_book = None
+_tablebase = None
+# Answers found while pondering, position_key -> result of _think
+_prepared = {}
+
+
+class _Stop(object):
+    """
+    Agent.stop of one search: set once a newer search was submitted or it was cancelled. Only the id
+    is pickled; with workers != 1 parallel.py starts the root move workers with worker_initializer, so
+    they read the same shared id and stop as well.
+    """
+    def __init__(self, search_id):
+        self.search_id = search_id
+
+    def is_set(self):
+        return _current is not None and _current.value != self.search_id
+
+    @property
+    def worker_initializer(self):
+        return _init_worker, (_current,)
+
+
+def _init_worker(current):
+    global _current
+    _current = current
+
+
+def position_key(grid, turn, goats_in_hand, dead_goats, depth, time_limit):
+    return "".join("".join(row) for row in grid), turn, goats_in_hand, dead_goats, depth, time_limit
+
+
+def _load(book_path, tablebase_path):
+    """(book, tablebase) of the worker, opened on first use"""
+    global _table, _book, _tablebase
+    if _table is None:
+        _table = TranspositionTable()
+    if book_path is not None and (_book is None or _book.path != book_path):
+        _book = OpeningBook(book_path)
+    if tablebase_path is not None and (_tablebase is None or _tablebase.path != tablebase_path):
+        _tablebase = Tablebase(tablebase_path)
+    return _book if book_path is not None else None, _tablebase if tablebase_path is not None else None
+
+
+def _search(stop, grid, turn, goats_in_hand, dead_goats, depth, time_limit, workers, book_path, tablebase_path):
+    """Play the best move on grid, returns (grid, goats_in_hand, dead_goats) or None when stopped"""
+    book, tablebase = _load(book_path, tablebase_path)
+    agent = Agent(grid, turn, goats_in_hand, dead_goats, depth, table=_table, time_limit=time_limit, workers=workers,
+                  book=book, tablebase=tablebase, stop=stop)
+    try:
+        agent.make_best_move()
+    except SearchTimeout:
+        return None
+    # Iterative deepening returns the move of the last completed depth when stopped, drop it all the same
+    if stop.is_set():
+        return None
+    return grid, agent.goats_in_hand, agent.dead_goats
+
+
+def _think(search_id, grid, turn, goats_in_hand, dead_goats, depth, time_limit, workers, book_path, tablebase_path):
+    """
+    Runs in the worker: search the position and play the best move on grid. Returns
+    (grid, goats_in_hand, dead_goats) after the move, or None when the search was stopped.
+    """
+    stop = _Stop(search_id)
+    if stop.is_set():
+        return None
+    # A timed search always runs, it reaches deeper than the pondering did from the table it left behind
+    if time_limit is None:
+        prepared = _prepared.get(position_key(grid, turn, goats_in_hand, dead_goats, depth, time_limit))
+        if prepared is not None:
+            return prepared
+    return _search(stop, grid, turn, goats_in_hand, dead_goats, depth, time_limit, workers, book_path,
+                   tablebase_path)
+
+
+def _ponder(search_id, grid, turn, goats_in_hand, dead_goats, depth, time_limit, workers, book_path, tablebase_path):
+    """
+    Runs in the worker while turn (the human) is to move: search the AI's answer to every reply,
+    the one a depth - 1 search expects first, then in the search's move order. Returns the number
+    of answers prepared before it was stopped.
+    """
+    _prepared.clear()
+    stop = _Stop(search_id)
+    if stop.is_set():
+        return 0
+    _load(book_path, tablebase_path)
+    is_max = turn == "Tiger"
+    ai_turn = "Goat" if is_max else "Tiger"
+    agent = Agent([row[:] for row in grid], turn, goats_in_hand, dead_goats, max(depth - 1, 1), table=_table,
+                  stop=stop)
+    try:
+        agent.think(is_max)
+    except SearchTimeout:
+        return 0
+    expected = agent.best_move
+    agent = Agent([row[:] for row in grid], turn, goats_in_hand, dead_goats, 1, table=_table)
+    replies = list(agent.ordered_moves(is_max, 0, expected))
+
+    for move in replies:
+        agent.make_move(move, is_max)
+        reply = (to_grid(agent.tigers, agent.goats), ai_turn, agent.goats_in_hand, agent.dead_goats)
+        over = agent.dead_goats >= 5 or (not agent.movable_tigers and not agent.capturable_goats) or \
+            not agent.generate_move_list(not is_max)
+        agent.revert_move(move, is_max)
+        if over:
+            continue
+        result = _search(stop, [row[:] for row in reply[0]], *reply[1:], depth, time_limit, workers, book_path,
+                         tablebase_path)
+        if result is None:
+            break
+        _prepared[position_key(*reply, depth, time_limit)] = result
+    return len(_prepared)
+
+
+def get_executor():
+    global _executor, _current
+    if _executor is None:
+        _current = multiprocessing.Value("q", 0)
+        _executor = ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=(_current,))
+    return _executor
+
+
+def submit(grid, turn, goats_in_hand, dead_goats, depth, time_limit=None, workers=1, book_path=None,
+           tablebase_path=None):
+    """
+    Start searching the position, stopping any search still running. Returns a Future of
+    (grid, goats_in_hand, dead_goats) after the AI's move, or None if the search was cancelled.
+    """
+    executor = get_executor()
+    with _current.get_lock():
+        _current.value += 1
+        search_id = _current.value
+    return executor.submit(_think, search_id, [row[:] for row in grid], turn, goats_in_hand, dead_goats, depth,
+                           time_limit, workers, book_path, tablebase_path)
+
+
+def ponder(grid, turn, goats_in_hand, dead_goats, depth, time_limit=None, workers=1, book_path=None,
+           tablebase_path=None):
+    """
+    Start pondering while turn, the human, is to move: the same arguments as the submit() the human's
+    move will lead to, with the human's position. Returns a Future of the number of answers prepared.
+    """
+    executor = get_executor()
+    with _current.get_lock():
+        _current.value += 1
+        search_id = _current.value
+    return executor.submit(_ponder, search_id, [row[:] for row in grid], turn, goats_in_hand, dead_goats, depth,
+                           time_limit, workers, book_path, tablebase_path)
+
+
+def cancel(future=None):
+    """Stop the running search, future is dropped if it has not started yet"""
+    if _current is not None:
+        with _current.get_lock():
+            _current.value += 1
+    if future is not None:
+        future.cancel()
+
+
+def shutdown():
+    global _executor, _current
+    cancel()
+    if _executor is not None:
+        # With workers != 1 the worker owns a pool of its own, it has to be shut down from inside a task
+        # or the worker never exits. Searches still queued see the new id and return at once.
+        _executor.submit(parallel.shutdown)
+        _executor.shutdown(wait=False)
+    _executor = None
+    _current = None
@@ -0,0 +1,124 @@
+"""
+Bitboard representation of the Baagchal board.
+
+Point (row, col) is stored in bit ``row * 5 + col`` of a 25 bit integer, so a position is
+described by two integers: one holding the tigers and one holding the goats. The empty
+points are whatever is left of FULL. Neighbour and jump tables are precomputed once.
+"""
+from functools import lru_cache
+
+SIZE = 5
+POINTS = SIZE * SIZE
+FULL = (1 << POINTS) - 1
+
+# Odd parity points are only joined to their orthogonal neighbours, even parity
+# points (row + col even) are joined diagonally as well
+ORTHOGONAL_OFFSETS = ((-1, 0), (0, -1), (0, 1), (1, 0))
+ALL_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+BIT = tuple(1 << square for square in range(POINTS))
+
+
+def index(row, col):
+    return row * SIZE + col
+
+
+def coordinates(square):
+    return divmod(square, SIZE)
+
+
+def is_inside(row, col):
+    return 0 <= row < SIZE and 0 <= col < SIZE
+
+
+def offsets(row, col):
+    if (row + col) % 2 == 0:
+        return ALL_OFFSETS
+    return ORTHOGONAL_OFFSETS
+
+
+def _build_tables():
+    neighbours, jumps = [], []
+    for square in range(POINTS):
+        row, col = coordinates(square)
+        adjacent, jump = [], []
+        for offset_x, offset_y in offsets(row, col):
+            next_row, next_col = row + offset_x, col + offset_y
+            if not is_inside(next_row, next_col):
+                continue
+            adjacent.append(index(next_row, next_col))
+            landing_row, landing_col = row + 2 * offset_x, col + 2 * offset_y
+            if is_inside(landing_row, landing_col):
+                # (point jumped over, landing point)
+                jump.append((index(next_row, next_col), index(landing_row, landing_col)))
+        neighbours.append(tuple(adjacent))
+        jumps.append(tuple(jump))
+    return tuple(neighbours), tuple(jumps)
+
+
+NEIGHBOURS, JUMPS = _build_tables()
+NEIGHBOUR_MASKS = tuple(sum(BIT[n] for n in adjacent) for adjacent in NEIGHBOURS)
+JUMP_MASKS = tuple(sum(BIT[land] for _, land in jump) for jump in JUMPS)
+JUMP_OVER_MASKS = tuple(sum(BIT[over] for over, _ in jump) for jump in JUMPS)
+
+
+def _build_influence():
+    # Tiger points whose moves and captures depend on what stands on a point
+    influence = [BIT[square] for square in range(POINTS)]
+    for tiger in range(POINTS):
+        for square in NEIGHBOURS[tiger]:
+            influence[square] |= BIT[tiger]
+        for _, land in JUMPS[tiger]:
+            influence[land] |= BIT[tiger]
+    return tuple(influence)
+
+
+INFLUENCE_MASKS = _build_influence()
+
+
+def squares(board):
+    """Yield the index of every set bit, lowest first"""
+    while board:
+        low = board & -board
+        yield low.bit_length() - 1
+        board ^= low
+
+
+@lru_cache(maxsize=1 << 16)
+def points(board):
+    """Cached tuple of the set bits, meant for sparse boards such as the four tigers"""
+    return tuple(squares(board))
+
+
+def popcount(board):
+    return bin(board).count("1")
+
+
+def from_grid(grid):
+    """Convert a 5x5 'T'/'G'/'_' grid to (tigers, goats) bitboards"""
+    tigers = goats = 0
+    for row in range(SIZE):
+        for col in range(SIZE):
+            if grid[row][col] == 'T':
+                tigers |= BIT[index(row, col)]
+            elif grid[row][col] == 'G':
+                goats |= BIT[index(row, col)]
+    return tigers, goats
+
+
+def write_grid(grid, tigers, goats):
+    """Write the bitboards back into an existing 5x5 grid in place"""
+    for row in range(SIZE):
+        for col in range(SIZE):
+            bit = BIT[index(row, col)]
+            if tigers & bit:
+                grid[row][col] = 'T'
+            elif goats & bit:
+                grid[row][col] = 'G'
+            else:
+                grid[row][col] = '_'
+    return grid
+
+
+def to_grid(tigers, goats):
+    return write_grid([['_'] * SIZE for _ in range(SIZE)], tigers, goats)
@@ -0,0 +1,175 @@
+"""
+Opening book for the placement phase.
+
+The book is a sorted array of fixed size records (canonical position key, packed move) after a small
+header, so it can be memory-mapped and searched with a binary search without loading it. Positions are
+canonical (see symmetry.py): a move is stored for the canonical image and mapped back on lookup. The
+header holds the search depth the moves were found at, an Agent searching less deep does not use them.
+
+Build it offline with
+    python book.py --plies 8 --depth 6 --out opening.book
+For each side the builder follows the book move of that side and every reply of the other side, so the
+book covers all positions an AI playing from the book can meet during the first plies.
+"""
+import argparse
+import mmap
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bitboard import to_grid
+from symmetry import INVERSE, canonical, transform_move
+
+MAGIC = b"BGBOOK2\0"
+# magic, records, search depth
+HEADER = struct.Struct("<8sII")
+RECORD = struct.Struct("<QH")
+MOVE_TYPES = ("p", "m", "e")
+# frm of a placement
+NO_POINT = 31
+
+
+def book_key(tigers, goats, goats_in_hand, dead_goats, is_max):
+    """Return (key, t): key of the canonical position and the transform that produced it"""
+    tigers, goats, t = canonical(tigers, goats)
+    key = tigers << 25 | goats | goats_in_hand << 50 | dead_goats << 55 | int(is_max) << 58
+    return key, t
+
+
+def pack_move(move):
+    move_type, frm, to, _ = move
+    return MOVE_TYPES.index(move_type) << 10 | (NO_POINT if frm is None else frm) << 5 | to
+
+
+def unpack_move(packed):
+    move_type = MOVE_TYPES[packed >> 10]
+    frm, to = packed >> 5 & 31, packed & 31
+    if move_type == "p":
+        return move_type, None, to, None
+    # The captured goat sits halfway between the two points
+    return move_type, frm, to, (frm + to) // 2 if move_type == "e" else None
+
+
+class OpeningBook(object):
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.depth = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an opening book of this version, rebuild it with book.py")
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, key):
+        """Packed move stored for key or None"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_key, packed = RECORD.unpack_from(self.data, HEADER.size + middle * RECORD.size)
+            if record_key < key:
+                low = middle + 1
+            elif record_key > key:
+                high = middle
+            else:
+                return packed
+        return None
+
+    def probe(self, tigers, goats, goats_in_hand, dead_goats, is_max):
+        """Book move for the position as an Agent (type, frm, to, inter) tuple, or None"""
+        key, t = book_key(tigers, goats, goats_in_hand, dead_goats, is_max)
+        packed = self.lookup(key)
+        if packed is None:
+            return None
+        return transform_move(unpack_move(packed), INVERSE[t])
+
+
+def write_book(path, entries, depth):
+    """entries maps canonical key -> packed move found by a search of depth"""
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries), depth))
+        for key in sorted(entries):
+            f.write(RECORD.pack(key, entries[key]))
+
+
+def _search_position(args):
+    from agent import SymmetricAgent
+    tigers, goats, goats_in_hand, dead_goats, is_max, depth, time_limit = args
+    agent = SymmetricAgent(to_grid(tigers, goats), "Tiger" if is_max else "Goat", goats_in_hand, dead_goats, depth,
+                           time_limit=time_limit, seed=0)
+    agent.think(is_max)
+    return agent.best_move
+
+
+def build(plies, depth, time_limit=None, workers=None, log=print):
+    """
+    Search every book position of the first plies and return {key: packed move}. Positions are searched
+    on the canonical board so that the move needs no mapping before it is stored.
+    """
+    from agent import Agent
+    start = Agent(to_grid(0, 0), "Goat", 20, 0, 1)
+    start_tigers = sum(1 << square for square in (0, 4, 20, 24))
+    entries = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for book_side in (False, True):
+            # Canonical (tigers, goats, goats_in_hand, dead_goats) of the current ply
+            level = {canonical(start_tigers, 0)[:2] + (20, 0)}
+            is_max = False
+            for ply in range(plies):
+                started = time.perf_counter()
+                positions = sorted(level)
+                if is_max == book_side:
+                    jobs = [position + (is_max, depth, time_limit) for position in positions]
+                    moves = list(executor.map(_search_position, jobs, chunksize=4))
+                else:
+                    moves = [None] * len(positions)
+
+                next_level = set()
+                for (tigers, goats, goats_in_hand, dead_goats), book_move in zip(positions, moves):
+                    start.tigers, start.goats = tigers, goats
+                    start.goats_in_hand, start.dead_goats = goats_in_hand, dead_goats
+                    if book_move is not None:
+                        key, _ = book_key(tigers, goats, goats_in_hand, dead_goats, is_max)
+                        entries[key] = pack_move(book_move)
+                        replies = [book_move]
+                    elif is_max == book_side:
+                        # Game over, nothing to store or expand
+                        continue
+                    else:
+                        replies = start.generate_move_list(is_max)
+                    for move in replies:
+                        start.make_move(move, is_max)
+                        next_level.add(canonical(start.tigers, start.goats)[:2] +
+                                       (start.goats_in_hand, start.dead_goats))
+                        start.revert_move(move, is_max)
+
+                log(f"{'Tiger' if book_side else 'Goat'} book ply {ply}: {len(positions)} positions, "
+                    f"{len(entries)} entries, {time.perf_counter() - started:.1f}s")
+                level = next_level
+                is_max = not is_max
+    return entries
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Build the opening book")
+    arguments.add_argument("--plies", type=int, default=8, help="number of plies covered")
+    arguments.add_argument("--depth", type=int, default=6, help="search depth per position")
+    arguments.add_argument("--time", type=int, default=None,
+                           help="milliseconds per position instead of a fixed depth, the book is then only used "
+                                "by Agents searching as deep as they can")
+    arguments.add_argument("--workers", type=int, default=None, help="processes, one per core by default")
+    arguments.add_argument("--out", default="opening.book")
+    args = arguments.parse_args()
+
+    from agent import MAX_DEPTH
+    book_depth = args.depth if args.time is None else MAX_DEPTH
+    book_entries = build(args.plies, book_depth, args.time, args.workers)
+    write_book(args.out, book_entries, book_depth)
+    print(f"Wrote {len(book_entries)} positions to {args.out}")
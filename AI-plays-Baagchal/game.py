@@ -2,10 +2,13 @@
 '''
 Has board config, goats_in_hand, goats_killed, current_turn
 '''
-from utilities import can_move
+from utilities import grid_winner
 from collections import namedtuple
 from configparser import  ConfigParser
 from assets import Assets
+from book import OpeningBook
+from tablebase import Tablebase
+import os
 
 parser = ConfigParser()
 
@@ -14,6 +17,52 @@ Player = namedtuple("Player", "role type")
 
 INF = float("inf")
 
+# Opened on first use and shared by every Game of the process, New Game builds a new Game each time
+_books = {}
+_tablebases = {}
+
+
+def opening_book(path):
+    """The book at path, or None when it was not built"""
+    if path not in _books:
+        _books[path] = OpeningBook(path) if os.path.exists(path) else None
+    return _books[path]
+
+
+def write_settings(path, values):
+    """
+    Set the keys of values in the [settings] section of the file at path. Only those lines are rewritten,
+    the comments and the layout of the file stay, keys the file lacks are added at the end of the section.
+    """
+    with open(path) as f:
+        lines = f.read().splitlines()
+    remaining = dict(values)
+    section = None
+    end = len(lines)
+    for number, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith("["):
+            if section == "settings":
+                end = number
+            section = stripped.strip("[]").strip()
+        elif section == "settings" and "=" in stripped and not stripped.startswith((";", "#")):
+            key = stripped.split("=", 1)[0].strip().lower()
+            if key in remaining:
+                lines[number] = f"{key} = {remaining.pop(key)}"
+    while end > 0 and not lines[end - 1].strip():
+        end -= 1
+    lines[end:end] = [f"{key} = {value}" for key, value in remaining.items()]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def endgame_tablebase(path):
+    """The tablebase in the directory path, or None when it was not built"""
+    if path not in _tablebases:
+        _tablebases[path] = Tablebase(path) if os.path.isdir(path) else None
+    return _tablebases[path]
+
+
 class Game(object):
     def __init__(self):
         self.asset = Assets()
@@ -28,6 +77,10 @@ class Game(object):
 
         self.depth = 4
         self.set_difficulty()
+        # Built offline with book.py, the AI searches every move when it is missing
+        self.book = opening_book(self.asset.book_path)
+        # Movement phase slices built with retrograde.py
+        self.tablebase = endgame_tablebase(self.asset.tablebase_path)
 
         self.ai = None
         self.role = dict()
@@ -50,6 +103,12 @@ class Game(object):
             self.depth = 5
         else:
             self.depth = 3
+        # Milliseconds per AI move, when set the depth above is replaced by iterative deepening under this budget
+        self.move_time = parser.getint("settings", "move_time", fallback=0)
+        # Processes searching the root moves, 0 uses every core
+        self.workers = parser.getint("settings", "workers", fallback=1)
+        # Search the AI's answers to the likely human moves while the human thinks
+        self.ponder = parser.getboolean("settings", "ponder", fallback=False)
 
     def reload_config(self):
         self.player_1 = Player("Goat", parser.get("settings", "goat"))
@@ -77,17 +136,10 @@ class Game(object):
             self.current_turn = 'Goat'
 
     def is_game_over(self):
-        if self.goats_killed >= 5:
-            self.winner = "Tiger"
-            return True
-
-        for i in range(5):
-            for j in range(5):
-                if self.grid[i][j] == 'T':
-                    if can_move(self.grid, i, j):
-                        return False
-
-        self.winner = "Goat"
+        winner = grid_winner(self.grid, self.goats_killed)
+        if winner is None:
+            return False
+        self.winner = winner
         return True
 
     def __repr__(self):
@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 
+import time
+
+import background
 from assets import Assets
 from collections import namedtuple
-from game import Game, Player
-from agent import Agent
+from game import Game, Player, write_settings
+from agent import MAX_DEPTH
 from tkinter import Tk, Label, Button, LabelFrame, Canvas, PhotoImage, NW, messagebox, Menu, Toplevel, ttk
 
 from utilities import *
@@ -15,6 +18,9 @@ parser = ConfigParser()
 
 Move = namedtuple("Move", "x y")
 
+# Milliseconds between two looks at a running AI search
+AI_POLL_INTERVAL = 50
+
 
 class UI(object):
     def __init__(self, master):
@@ -31,6 +37,12 @@ class UI(object):
         self.game = Game()
         self.ai_turn = True
         self.ai_enabled = False
+        # Search running in the background process, see start_ai_move
+        self.ai_future = None
+        self.ai_poll_job = None
+        self.ai_started = None
+        # Pondering on the human's turn, see start_pondering
+        self.ponder_future = None
         self.graphic_board = None
         self.RECTANGLE_HEIGHT = self.RECTANGLE_WIDTH = None
         self.BOARD_HEIGHT = self.BOARD_WIDTH = None
@@ -45,9 +57,10 @@ class UI(object):
         self.board_frame = LabelFrame(master, text="Baagchal")
         self.board_frame.grid(row=1, column=0, padx=10, pady=10)
         self.canv = None
+        self.point_items = self.point_contents = None
         self.board_frame_init()
 
-        self.turn_label = self.goats_killed_label = self.goats_in_hand_label = self.role = None
+        self.turn_label = self.goats_killed_label = self.goats_in_hand_label = self.role = self.thinking_label = None
         self.details_frame = LabelFrame(master, text="Details: ")
         self.details_frame.grid(row=1, column=1)
         self.details_frame_init()
@@ -60,6 +73,8 @@ class UI(object):
 
 
     def new_game(self):
+        # A search of the previous game must not play its move on the new board
+        self.cancel_ai_move()
         self.__init__(root)
         self.game.board_init()
         self.game.reload_config()
@@ -92,7 +107,7 @@ class UI(object):
 
         self.canv.delete(self.selected)
         self.reset_move_from_to()
-        self.master.after(100, self.draw_board(self.game.grid))
+        self.draw_board(self.game.grid)
 
     def update_detail_labels(self):
         self.turn_label.configure(text=f"Turn: {self.game.current_turn}")
@@ -224,89 +239,141 @@ class UI(object):
             [(20, 600), (170, 600), (320, 600), (470, 600), (620, 600)],
         ]
 
-    def make_ai_move(self):
-        ag = Agent(self.game.grid, self.game.current_turn, self.game.goats_in_hand, self.game.goats_killed, self.game.depth)
-        # move = ag.get_best_move()
-        ag.make_best_move()
-        self.game.goats_killed = ag.dead_goats
-        self.game.goats_in_hand = ag.goats_in_hand
-        self.game.board = ag.board
+    def ai_search_arguments(self):
+        """Arguments of background.submit and ponder for the current position"""
+        depth, time_limit = self.game.depth, None
+        if self.game.move_time > 0:
+            depth, time_limit = MAX_DEPTH, self.game.move_time
+        return dict(grid=self.game.grid, turn=self.game.current_turn, goats_in_hand=self.game.goats_in_hand,
+                    dead_goats=self.game.goats_killed, depth=depth, time_limit=time_limit,
+                    workers=self.game.workers,
+                    book_path=self.game.book.path if self.game.book is not None else None,
+                    tablebase_path=self.game.tablebase.path if self.game.tablebase is not None else None)
+
+    def start_ai_move(self):
+        """
+        Hand the position to the background search and poll it from the event loop, the board stays
+        responsive (clicks are ignored on the AI's turn) until poll_ai_move plays the move
+        """
+        # Submitting stops the pondering, its answers stay in the worker
+        self.ponder_future = None
+        self.ai_future = background.submit(**self.ai_search_arguments())
+        self.ai_started = time.perf_counter()
+        self.thinking_label.configure(text=f"{self.game.current_turn} is thinking...")
+        self.ai_poll_job = self.master.after(AI_POLL_INTERVAL, self.poll_ai_move)
+
+    def poll_ai_move(self):
+        self.ai_poll_job = None
+        if not self.ai_future.done():
+            elapsed = time.perf_counter() - self.ai_started
+            self.thinking_label.configure(text=f"{self.game.current_turn} is thinking... {elapsed:.1f}s")
+            self.ai_poll_job = self.master.after(AI_POLL_INTERVAL, self.poll_ai_move)
+            return
+        future, self.ai_future = self.ai_future, None
+        self.thinking_label.configure(text="")
+        result = future.result()
+        if result is None:
+            return
+        self.make_ai_move(*result)
+
+    def start_pondering(self):
+        """Let the background worker prepare answers to the human's likely moves"""
+        self.ponder_future = background.ponder(**self.ai_search_arguments())
+
+    def cancel_ai_move(self):
+        if self.ponder_future is not None:
+            background.cancel(self.ponder_future)
+            self.ponder_future = None
+        if self.ai_poll_job is not None:
+            self.master.after_cancel(self.ai_poll_job)
+            self.ai_poll_job = None
+        if self.ai_future is not None:
+            background.cancel(self.ai_future)
+            self.ai_future = None
+
+    def make_ai_move(self, grid, goats_in_hand, goats_killed):
+        """Play the move found by the background search, on the Tk thread"""
+        self.game.grid = grid
+        self.game.goats_killed = goats_killed
+        self.game.goats_in_hand = goats_in_hand
+        self.game.switch_turn()
         self.update_detail_labels()
+        self.ai_turn = not self.ai_turn
+        self.refresh_board()
 
-    def draw_board(self, board):
-        def draw_lines():
-            line_coordinates = [[(x, y), (x + self.BOARD_WIDTH, y + self.BOARD_HEIGHT)],
-                                [(x + self.BOARD_WIDTH // 2, y),
-                                 (x + self.BOARD_WIDTH, y + self.BOARD_HEIGHT // 2)],
-                                [(x, y + self.BOARD_HEIGHT), (x + self.BOARD_WIDTH, y)],
-                                [(x, y + self.BOARD_HEIGHT // 2), (x + self.BOARD_WIDTH // 2, y)],
-                                [(x, y + self.BOARD_HEIGHT // 2),
-                                 (x + self.BOARD_WIDTH // 2, y + self.BOARD_HEIGHT)],
-                                [(x + self.BOARD_WIDTH // 2, y + self.BOARD_WIDTH),
-                                 (x + self.BOARD_WIDTH, y + self.BOARD_HEIGHT // 2)],
-                                ]
-            # Draw Lines
-            for (x1, y1), (x2, y2) in line_coordinates:
-                self.canv.create_line((x1, y1), (x2, y2), width=8)
-
-        def draw_boxes():
-            for i in range(4):
-                for j in range(4):
-                    bottom_corner_coordinates = (x + i * self.RECTANGLE_WIDTH, y + j * self.RECTANGLE_HEIGHT)
-                    top_corner_coordinates = (
-                        x + (i + 1) * self.RECTANGLE_WIDTH, y + (j + 1) * self.RECTANGLE_HEIGHT)
-                    self.canv.create_rectangle(bottom_corner_coordinates, top_corner_coordinates,
-                                          width=8)
-
-        def place_objects():
-            tiger_cnt, goat_cnt, blank_cnt = 0, 0, 0
-            for i in range(5):
-                for j in range(5):
-                    x1, y1 = self.graphic_board[i][j]
-                    if board[i][j] == 'T':
-                        tiger = self.canv.create_image(x1, y1, image=self.tiger_img, anchor=NW,
-                                                  tag="tiger_" + str(tiger_cnt))
-                        self.canv.tag_bind(tiger, '<Button-1>', self.onObjectClick)
-                        tiger_cnt += 1
-
-                    elif board[i][j] == 'G':
-                        goat = self.canv.create_image(x1, y1, image=self.goat_img, anchor=NW,
-                                                 tag="goat_" + str(goat_cnt))
-                        self.canv.tag_bind(goat, '<Button-1>', self.onObjectClick)
-                        goat_cnt += 1
-                    else:
-                        blank = self.canv.create_image(x1, y1, image=self.blank_img, anchor=NW,
-                                                  tag="blank_" + str(blank_cnt))
-                        self.canv.tag_bind(blank, '<Button-1>', self.onObjectClick)
-
-                        blank_cnt += 1
-
-        if self.ai_enabled and self.ai_turn:
-            self.make_ai_move()
-            self.game.switch_turn()
-            self.update_detail_labels()
-            self.ai_turn = not self.ai_turn
-
-            # CLear the canvas first
-        self.canv.delete("all")
+    def draw_static_board(self):
+        """Lines and boxes, drawn once per canvas below the point images"""
         x = y = 50
+        line_coordinates = [[(x, y), (x + self.BOARD_WIDTH, y + self.BOARD_HEIGHT)],
+                            [(x + self.BOARD_WIDTH // 2, y),
+                             (x + self.BOARD_WIDTH, y + self.BOARD_HEIGHT // 2)],
+                            [(x, y + self.BOARD_HEIGHT), (x + self.BOARD_WIDTH, y)],
+                            [(x, y + self.BOARD_HEIGHT // 2), (x + self.BOARD_WIDTH // 2, y)],
+                            [(x, y + self.BOARD_HEIGHT // 2),
+                             (x + self.BOARD_WIDTH // 2, y + self.BOARD_HEIGHT)],
+                            [(x + self.BOARD_WIDTH // 2, y + self.BOARD_WIDTH),
+                             (x + self.BOARD_WIDTH, y + self.BOARD_HEIGHT // 2)],
+                            ]
+        # Draw Lines
+        for (x1, y1), (x2, y2) in line_coordinates:
+            self.canv.create_line((x1, y1), (x2, y2), width=8)
+
+        for i in range(4):
+            for j in range(4):
+                bottom_corner_coordinates = (x + i * self.RECTANGLE_WIDTH, y + j * self.RECTANGLE_HEIGHT)
+                top_corner_coordinates = (
+                    x + (i + 1) * self.RECTANGLE_WIDTH, y + (j + 1) * self.RECTANGLE_HEIGHT)
+                self.canv.create_rectangle(bottom_corner_coordinates, top_corner_coordinates,
+                                           width=8)
+
+    def place_points(self):
+        """
+        One image item per point, all sharing the "point" tag and its click handler. The first tag
+        names the piece on the point (tiger_, goat_ or blank_ and the point number), the move handlers
+        read it back.
+        """
+        self.point_items = []
+        self.point_contents = []
+        for i in range(5):
+            for j in range(5):
+                x1, y1 = self.graphic_board[i][j]
+                item = self.canv.create_image(x1, y1, image=self.blank_img, anchor=NW,
+                                              tags=(f"blank_{i * 5 + j}", "point"))
+                self.point_items.append(item)
+                self.point_contents.append('_')
+        self.canv.tag_bind("point", '<Button-1>', self.onObjectClick)
 
-        draw_lines()
-        draw_boxes()
-        place_objects()
+    def draw_board(self, board):
+        """Swap the image of the points whose contents changed since the last call"""
+        pieces = {'T': ("tiger", self.tiger_img), 'G': ("goat", self.goat_img)}
+        for i in range(5):
+            for j in range(5):
+                point = i * 5 + j
+                cell = board[i][j]
+                if cell == self.point_contents[point]:
+                    continue
+                name, image = pieces.get(cell, ("blank", self.blank_img))
+                self.canv.itemconfigure(self.point_items[point], image=image, tags=(f"{name}_{point}", "point"))
+                self.point_contents[point] = cell
 
         if self.game.is_game_over():
             messagebox.showinfo("Game Over", f"{self.game.winner} wins the game")
             self.master.destroy()
+        elif self.ai_enabled and self.ai_turn and self.ai_future is None:
+            self.start_ai_move()
+        elif self.ai_enabled and not self.ai_turn and self.game.ponder and self.ponder_future is None:
+            self.start_pondering()
 
     def board_frame_init(self):
         self.canv = Canvas(self.board_frame, width=700, height=700, bg='#87ceeb')
         self.canv.grid(row=0)
+        self.draw_static_board()
+        self.place_points()
 
     def settings(self):
         setting_window = Toplevel(self.master)
         setting_window.title("Settings")
-        setting_window.geometry("300x300")
+        setting_window.geometry("300x400")
 
         setting_window.transient(self.master)
         setting_window.grab_set()
@@ -352,16 +419,50 @@ class UI(object):
         selected = dict(difficulty_options)['values'].index(difficulty_current)
         difficulty_options.current(selected)
 
-        okay = Button(setting_window, text="Save", command=lambda:self.save_settings(options_1, options_2, difficulty_options))
-        okay.grid(row=3, column=0)
-
-    def save_settings(self,options_1, options_2, difficulty_options):
-        parser["settings"]["goat"] = options_1.get()
-        parser["settings"]["tiger"] = options_2.get()
-        parser["settings"]["difficulty"] = difficulty_options.get()
-
-        with open(self.assets.configuration_path, "w") as f:
-            parser.write(f)
+        # Milliseconds per AI move, 0 searches to the fixed depth of the difficulty
+        move_time_label = Label(setting_window, text="Move time (ms)")
+        move_time_label.grid(row=3, column=0, pady=10, padx=10)
+        move_time = ttk.Spinbox(setting_window, from_=0, to=60000, increment=100, width=8)
+        move_time.grid(row=3, column=1)
+        move_time.set(parser.getint("settings", "move_time", fallback=0))
+
+        # Processes used by the AI search, 0 uses every core
+        workers_label = Label(setting_window, text="Workers")
+        workers_label.grid(row=4, column=0, pady=10, padx=10)
+        workers = ttk.Spinbox(setting_window, from_=0, to=64, increment=1, width=8)
+        workers.grid(row=4, column=1)
+        workers.set(parser.getint("settings", "workers", fallback=1))
+
+        # Search answers to likely human moves during the human turn
+        ponder_label = Label(setting_window, text="Ponder")
+        ponder_label.grid(row=5, column=0, pady=10, padx=10)
+        ponder = ttk.Combobox(setting_window, state="readonly", values=["Off", "On"])
+        ponder.grid(row=5, column=1)
+        ponder.current(int(parser.getboolean("settings", "ponder", fallback=False)))
+
+        okay = Button(setting_window, text="Save",
+                      command=lambda: self.save_settings(options_1, options_2, difficulty_options, move_time, workers,
+                                                         ponder))
+        okay.grid(row=6, column=0)
+
+    def save_settings(self, options_1, options_2, difficulty_options, move_time, workers, ponder):
+        try:
+            numbers = {"move_time": max(int(move_time.get()), 0), "workers": max(int(workers.get()), 0)}
+        except ValueError:
+            messagebox.showerror("Settings", "Move time and workers must be whole numbers")
+            return
+        values = {
+            "goat": options_1.get(),
+            "tiger": options_2.get(),
+            "difficulty": difficulty_options.get(),
+            "ponder": int(ponder.get() == "On"),
+        }
+        values.update(numbers)
+        for key, value in values.items():
+            parser["settings"][key] = str(value)
+
+        # Only the changed lines are written, the comments of the file stay
+        write_settings(self.assets.configuration_path, values)
         messagebox.showinfo("Settings saved. ", "Settings updated. Restart to apply the changes")
 
     def menu_init(self):
@@ -395,6 +496,10 @@ class UI(object):
                                     font=("Helvetica", 16))
         self.goats_in_hand_label.grid(row=3, column=0)
 
+        # Shown while the AI searches
+        self.thinking_label = Label(self.details_frame, text="", font=("Helvetica", 16), fg="blue")
+        self.thinking_label.grid(row=4, column=0)
+
     def ui_init(self):
         """
         Set windows title and sizes, icons
@@ -406,7 +511,10 @@ class UI(object):
         Label(self.master, text="Baagchal").grid(row=0, column=0)
 
 
-root = Tk()
-my_gui = UI(root)
-my_gui.new_game()
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    root = Tk()
+    my_gui = UI(root)
+    my_gui.new_game()
+    root.mainloop()
+    # Stop a search still running so that exiting does not wait for it
+    background.shutdown()
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""
+Bounded LRU cache of the moves of a position, for the minimax Agent and the Q-learning Sheep/Wolves.
+
+The legal moves of a position only depend on the position, so a search meets the same lists again in
+sibling subtrees and in every iteration of iterative deepening, and self-play meets them again in the
+openings its episodes share. A MoveCache keeps the most recently used size lists under an integer key
+of the position and counts its hits and misses. Values are handed out as they are stored, callers keep
+them as tuples or read-only arrays and copy before changing them.
+"""
+from collections import OrderedDict
+
+
+class MoveCache(object):
+    """
+    get(key, generate, *args) returns the cached value of key, or stores and returns generate(*args).
+    Holds at most size entries and drops the least recently used one past that, size 0 caches nothing.
+    """
+    def __init__(self, size=1 << 16):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generate, *args):
+        entries = self.entries
+        value = entries.get(key)
+        if value is not None:
+            entries.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = generate(*args)
+        if self.size:
+            entries[key] = value
+            if len(entries) > self.size:
+                entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """Drop the entries and zero the counts"""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"size": self.size, "entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate()}
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,158 @@
+"""
+Root parallel search for the minimax Agent.
+
+The first root move is searched on its own to get a bound, then every other root move is searched
+in a pool of worker processes with that bound. Results are combined in root move order with the same
+rule as the serial search, so with a deterministic evaluation both return the same best move.
+Each worker keeps its own transposition table between calls. An Agent.stop whose is_set() reads state of
+its process offers worker_initializer, (initializer, initargs) that set that state up in the workers
+whatever the start method, see background._Stop.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from agent import Agent, SymmetricAgent, SearchTimeout, INF
+from bitboard import to_grid
+from transposition import TranspositionTable, TIGER_TO_MOVE, EXACT
+from symmetry import transform_move
+from tablebase import Tablebase
+
+_executor = None
+# (workers, initializer, initargs) the executor was started with
+_executor_setup = None
+# Seconds between two checks of Agent.stop while waiting for the workers
+STOP_POLL = 0.05
+
+# Per worker process state
+_table = None
+_root = None
+_tablebase = None
+
+
+def worker_count(workers):
+    """0 or less means one worker per core"""
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def get_executor(workers, initializer=None, initargs=()):
+    """Pool of workers processes, each runs initializer(*initargs) when it starts"""
+    global _executor, _executor_setup
+    setup = (workers, initializer, initargs)
+    if _executor is None or _executor_setup != setup:
+        shutdown()
+        _executor = ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+        _executor_setup = setup
+    return _executor
+
+
+def shutdown():
+    global _executor, _executor_setup
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    _executor_setup = None
+
+
+def _search_move(tigers, goats, goats_in_hand, dead_goats, is_max, depth, noise_seed, symmetric, tablebase_path, move,
+                 alpha, beta, deadline, stop):
+    """
+    Runs in a worker: play one root move and search the reply. Returns (value, nodes),
+    value is None when the deadline (a time.time() value) passed or stop was set first.
+    """
+    global _table, _root, _tablebase
+    if _table is None:
+        _table = TranspositionTable()
+    if tablebase_path is not None and (_tablebase is None or _tablebase.path != tablebase_path):
+        _tablebase = Tablebase(tablebase_path)
+    agent_class = SymmetricAgent if symmetric else Agent
+    agent = agent_class(to_grid(tigers, goats), "Tiger" if is_max else "Goat", goats_in_hand, dead_goats, depth,
+                        table=_table, tablebase=_tablebase if tablebase_path is not None else None)
+    agent.noise_seed = noise_seed
+    # Entries from earlier moves of the game become replaceable
+    if _root != (agent.key, depth):
+        _root = (agent.key, depth)
+        _table.new_search()
+    if deadline is not None:
+        agent.deadline = time.perf_counter() + (deadline - time.time())
+        agent.limited = True
+    if stop is not None:
+        if stop.is_set():
+            return None, 0
+        agent.stop = stop
+        agent.limited = True
+
+    agent.make_move(move, is_max)
+    try:
+        value = agent.minimax(not is_max, 1, alpha, beta)
+    except SearchTimeout:
+        value = None
+    return value, agent.nodes
+
+
+def _results(agent, futures):
+    """
+    Results of futures in order. Raises SearchTimeout as soon as agent.stop is set, the futures that
+    have not started are cancelled and the running ones see the stop themselves.
+    """
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, timeout=STOP_POLL)
+        if pending and agent.stop is not None and agent.stop.is_set():
+            for future in pending:
+                future.cancel()
+            raise SearchTimeout()
+    return [future.result() for future in futures]
+
+
+def search_root(agent, is_max, workers):
+    """
+    Parallel version of Agent.search for the agent's current position and depth. Sets agent.best_move
+    and returns the root value, raises SearchTimeout when the agent's deadline passes or its stop is
+    set first.
+    """
+    if agent.stop is not None and agent.stop.is_set():
+        raise SearchTimeout()
+    executor = get_executor(workers, *getattr(agent.stop, "worker_initializer", (None, ())))
+    agent.best_move = None
+    agent.table.new_search()
+    key = agent.key ^ TIGER_TO_MOVE if is_max else agent.key
+    entry = agent.table.probe(key)
+    first = agent.board_move(agent.pv_moves.get(key, entry[4] if entry is not None else None))
+    moves = list(agent.ordered_moves(is_max, 0, first))
+    if not moves:
+        return -INF if is_max else INF
+
+    deadline = None
+    if agent.deadline is not None and agent.limited:
+        deadline = time.time() + (agent.deadline - time.perf_counter())
+    position = (agent.tigers, agent.goats, agent.goats_in_hand, agent.dead_goats, is_max, agent.depth, agent.noise_seed,
+                isinstance(agent, SymmetricAgent), agent.tablebase.path if agent.tablebase is not None else None)
+
+    # The first move gives the bound for all the others
+    [(value, nodes)] = _results(agent, [executor.submit(_search_move, *position, moves[0], -INF, INF, deadline,
+                                                        agent.stop)])
+    agent.nodes += nodes
+    if value is None:
+        raise SearchTimeout()
+    best_move, best_value = moves[0], value
+
+    alpha, beta = (value, INF) if is_max else (-INF, value)
+    futures = [executor.submit(_search_move, *position, move, alpha, beta, deadline, agent.stop) for move in moves[1:]]
+    results = _results(agent, futures)
+    agent.nodes += sum(nodes for _, nodes in results)
+    if any(value is None for value, _ in results):
+        raise SearchTimeout()
+
+    # Same rule as the serial root: only a strictly better value replaces the best move, an equal
+    # value of a later move is just a bound from the narrower window
+    for move, (value, _) in zip(moves[1:], results):
+        if (value > best_value) if is_max else (value < best_value):
+            best_move, best_value = move, value
+
+    agent.best_move = best_move
+    stored = transform_move(best_move, agent.transform) if agent.transform else best_move
+    agent.table.store(key, agent.depth, EXACT, best_value, stored)
+    return best_value
@@ -0,0 +1,212 @@
+"""
+Perft: counts the leaves of the move tree to a fixed depth, to check and time the move generators.
+
+Agent.generate_move_list (agent.py) and Sheep/Wolves.get_states (Qlearning/utils/agents/base.py) are
+written independently, --cross-check walks the tree with both and compares the positions they reach
+at every node. Reference counts are kept in perft.json, a plain run checks Agent against them and
+reports nodes per second, --update rewrites them after a deliberate change of the rules. The generators
+run uncached, --move-cache SIZE gives both a MoveCache (movecache.py) and reports its hits and misses.
+
+A position that is over (5 goats captured or the tigers shut in, as in Agent.minimax) has no moves.
+
+    python perft.py
+    python perft.py --depth 6 --cross-check 3
+    python perft.py --move-cache 65536
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from agent import Agent
+from bitboard import BIT, POINTS
+from movecache import MoveCache
+
+REFERENCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perft.json")
+QLEARNING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Qlearning")
+
+# Rows from the top separated by '/', goats in hand, dead goats and the side to move
+POSITIONS = {
+    "start": "T___T/_____/_____/_____/T___T 20 0 goat",
+    "placement": "T_G_T/_GG__/__G__/_G___/T___T 15 0 tiger",
+    "captures": "TG__T/GG_G_/__G__/_____/T_G_T 13 1 tiger",
+    "movement": "TGGGT/GG_GG/GGTGG/G_GGG/GG_TG 0 2 goat",
+    "endgame": "T_GGT/GGGG_/G_GGG/GG_GG/TGG_T 0 4 tiger",
+    "trapped": "TGGGT/GGGGG/GGTGG/GGGG_/GGGGT 0 0 goat",
+}
+
+
+def parse(position):
+    """(grid, goats_in_hand, dead_goats, is_max) of a position string"""
+    rows, goats_in_hand, dead_goats, side = position.split()
+    grid = [list(row) for row in rows.split("/")]
+    return grid, int(goats_in_hand), int(dead_goats), side == "tiger"
+
+
+def game_over(agent):
+    return agent.dead_goats >= 5 or (not agent.movable_tigers and not agent.capturable_goats)
+
+
+def perft(agent, is_max, depth):
+    if depth == 0:
+        return 1
+    if game_over(agent):
+        return 0
+    moves = agent.generate_move_list(is_max)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        agent.make_move(move, is_max)
+        nodes += perft(agent, not is_max, depth - 1)
+        agent.revert_move(move, is_max)
+    return nodes
+
+
+def _players(sheep_cache, wolves_cache):
+    # The Q-learning package needs numpy, it is only imported for the cross check
+    if QLEARNING_PATH not in sys.path:
+        sys.path.append(QLEARNING_PATH)
+    import numpy as np
+    from utils.agents.base import Sheep, Wolves
+    return np, Sheep(sheep_cache), Wolves(wolves_cache)
+
+
+def to_state(np, grid):
+    """The Q-learning board: 1 for a goat, -1 for a tiger"""
+    return np.array([[{"G": 1, "T": -1}.get(cell, 0) for cell in row] for row in grid], dtype=np.int32)
+
+
+def agent_successors(agent, is_max):
+    """Boards reached by every move, as flat tuples in the Q-learning encoding"""
+    boards = []
+    for move in agent.generate_move_list(is_max):
+        agent.make_move(move, is_max)
+        boards.append(tuple(-1 if agent.tigers & BIT[square] else 1 if agent.goats & BIT[square] else 0
+                            for square in range(POINTS)))
+        agent.revert_move(move, is_max)
+    return boards
+
+
+def cross_check(np, sheep, wolves, agent, state, is_max, depth, path=()):
+    """
+    Walk the tree with both generators, raising AssertionError with the moves that lead to the first
+    position where they disagree. Returns the perft count.
+    """
+    if depth == 0:
+        return 1
+    wolf_states = wolves.get_states(state)
+    if game_over(agent) or len(wolf_states) == 0:
+        assert game_over(agent) and (agent.dead_goats >= 5 or len(wolf_states) == 0), f"game over differs after {path}"
+        return 0
+    if is_max:
+        states = wolf_states
+    else:
+        sheep.in_reserve = agent.goats_in_hand
+        states = sheep.get_states(state)
+    expected = sorted(agent_successors(agent, is_max))
+    found = sorted(tuple(next_state.ravel().tolist()) for next_state in states)
+    assert expected == found, f"successors differ after {path}: {len(expected)} against {len(found)}"
+
+    nodes = 0
+    by_board = {tuple(next_state.ravel().tolist()): next_state for next_state in states}
+    for move in agent.generate_move_list(is_max):
+        agent.make_move(move, is_max)
+        board = tuple(-1 if agent.tigers & BIT[square] else 1 if agent.goats & BIT[square] else 0
+                      for square in range(POINTS))
+        nodes += cross_check(np, sheep, wolves, agent, by_board[board], not is_max, depth - 1, path + (move,))
+        agent.revert_move(move, is_max)
+    return nodes
+
+
+def states_perft(np, sheep, wolves, state, goats_in_hand, is_max, depth):
+    """perft with Sheep/Wolves.get_states alone, captures are read off the goat count"""
+    if depth == 0:
+        return 1
+    wolf_states = wolves.get_states(state)
+    dead_goats = 20 - goats_in_hand - int((state > 0).sum())
+    if dead_goats >= 5 or len(wolf_states) == 0:
+        return 0
+    if is_max:
+        states = wolf_states
+    else:
+        sheep.in_reserve = goats_in_hand
+        states = sheep.get_states(state)
+    if depth == 1:
+        return len(states)
+    in_hand = goats_in_hand - 1 if not is_max and goats_in_hand else goats_in_hand
+    return sum(states_perft(np, sheep, wolves, next_state, in_hand, not is_max, depth - 1) for next_state in states)
+
+
+def run(name, depth, reference, cross_depth, cache_size=0, log=print):
+    grid, goats_in_hand, dead_goats, is_max = parse(POSITIONS[name])
+    counts = []
+    # One cache per generator for every depth, as a search that deepens would use it
+    caches = {"Agent": MoveCache(cache_size), "Sheep": MoveCache(cache_size), "Wolves": MoveCache(cache_size)}
+    for current in range(1, depth + 1):
+        agent = Agent([row[:] for row in grid], "Tiger" if is_max else "Goat", goats_in_hand, dead_goats, 1,
+                      move_cache=caches["Agent"] if cache_size else None)
+        started = time.perf_counter()
+        nodes = perft(agent, is_max, current)
+        elapsed = time.perf_counter() - started
+        counts.append(nodes)
+        expected = reference[current - 1] if current <= len(reference) else None
+        status = "" if expected is None else ("ok" if expected == nodes else f"MISMATCH, expected {expected}")
+        log(f"{name:10} depth {current}: {nodes:>12} nodes {nodes / max(elapsed, 1e-9):>12.0f} nodes/s {status}")
+
+    for current in range(1, cross_depth + 1):
+        np, sheep, wolves = _players(caches["Sheep"], caches["Wolves"])
+        agent = Agent([row[:] for row in grid], "Tiger" if is_max else "Goat", goats_in_hand, dead_goats, 1)
+        nodes = cross_check(np, sheep, wolves, agent, to_state(np, grid), is_max, current)
+        started = time.perf_counter()
+        states_nodes = states_perft(np, sheep, wolves, to_state(np, grid), goats_in_hand, is_max, current)
+        elapsed = time.perf_counter() - started
+        assert nodes == states_nodes, f"{name} depth {current}: get_states counts {states_nodes}, Agent {nodes}"
+        log(f"{name:10} depth {current}: generators agree, get_states {states_nodes / max(elapsed, 1e-9):.0f} nodes/s")
+    if cache_size:
+        for generator, cache in caches.items():
+            if cache.hits or cache.misses:
+                log(f"{name:10} {generator} move cache: {cache.hits} hits, {cache.misses} misses "
+                    f"({100 * cache.hit_rate():.1f}%), {len(cache)} positions")
+    return counts
+
+
+def load_reference(path=REFERENCE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    arguments = argparse.ArgumentParser(description="Count and time the move generators")
+    arguments.add_argument("--depth", type=int, default=None, help="deepest count, the stored depth by default")
+    arguments.add_argument("--positions", nargs="+", choices=sorted(POSITIONS), default=list(POSITIONS))
+    arguments.add_argument("--cross-check", type=int, default=0, metavar="DEPTH",
+                           help="compare Agent with Sheep/Wolves.get_states up to this depth (needs numpy)")
+    arguments.add_argument("--move-cache", type=int, default=0, metavar="SIZE",
+                           help="cache the move lists of up to SIZE positions per generator (0: no cache)")
+    arguments.add_argument("--update", action="store_true", help="store the counts as the new reference")
+    args = arguments.parse_args()
+
+    reference = load_reference()
+    failed = False
+    for name in args.positions:
+        stored = reference.get(name, {}).get("counts", []) if reference.get(name, {}).get("position") == \
+            POSITIONS[name] else []
+        depth = args.depth if args.depth is not None else max(len(stored), 1)
+        counts = run(name, depth, stored, args.cross_check, args.move_cache)
+        failed |= any(expected != found for expected, found in zip(stored, counts))
+        if args.update:
+            reference[name] = {"position": POSITIONS[name], "counts": counts}
+
+    if args.update:
+        with open(REFERENCE_PATH, "w") as f:
+            json.dump(reference, f, indent=2)
+            f.write("\n")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+"""
+Builds the movement phase tablebase (see tablebase.py) by retrograde analysis.
+
+Slices are solved from 4 dead goats down to 0, a capture leads into the slice above which is already solved.
+Within a slice positions are resolved in order of distance: a position lost for the side to move makes
+every predecessor a win, a position won for the side to move takes one off the count of moves left to
+try of every predecessor and a predecessor whose count reaches 0 is lost. Moves that slide a piece are
+their own inverse, so the predecessors are found by sliding the pieces of the side that just moved.
+Whatever is unresolved at the end is a draw. The distance counts plies to the next capture or the end
+of the game, so it stays within one byte.
+
+Counting the moves of every position runs in a pool of processes, one chunk of tiger placements at a
+time, each chunk is saved so an interrupted run skips it when restarted. The resolution of a slice runs
+in one process and saves its state every --checkpoint seconds.
+
+    python retrograde.py --out tablebase --workers 0
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from bitboard import POINTS, FULL, ALL_OFFSETS, NEIGHBOUR_MASKS, coordinates, index, is_inside, offsets, points
+from tablebase import HEADER, MAGIC, TIGERS, TIGER_SETS, EMPTY_SETS, CAPTURES_TO_WIN, GOAT_WINS, DISTANCE_MASK, \
+    MAX_DISTANCE, empty_count, slice_size, slice_path, tiger_wins, goat_wins
+
+GOAT, TIGER = 0, 1
+DIRECTIONS = len(ALL_OFFSETS)
+
+
+def _build_tables():
+    # Neighbour and landing point of every point in each direction, -1 where there is none
+    neighbour = np.full((POINTS, DIRECTIONS), -1, dtype=np.int64)
+    land = np.full((POINTS, DIRECTIONS), -1, dtype=np.int64)
+    for square in range(POINTS):
+        row, col = coordinates(square)
+        for direction, (offset_x, offset_y) in enumerate(ALL_OFFSETS):
+            if (offset_x, offset_y) not in offsets(row, col) or not is_inside(row + offset_x, col + offset_y):
+                continue
+            neighbour[square, direction] = index(row + offset_x, col + offset_y)
+            if is_inside(row + 2 * offset_x, col + 2 * offset_y):
+                land[square, direction] = index(row + 2 * offset_x, col + 2 * offset_y)
+    return neighbour, land
+
+
+NEIGHBOUR_TABLE, LAND_TABLE = _build_tables()
+NEIGHBOUR_MASK_TABLE = np.array(NEIGHBOUR_MASKS, dtype=np.int64)
+TIGER_BOARDS = np.array(TIGER_SETS, dtype=np.int64)
+TIGER_POINTS = np.array([points(tigers) for tigers in TIGER_SETS], dtype=np.int64)
+_TIGER_ORDER = np.argsort(TIGER_BOARDS)
+_SORTED_TIGERS = TIGER_BOARDS[_TIGER_ORDER]
+
+
+def bits(squares):
+    return np.left_shift(np.int64(1), squares)
+
+
+def has(board, squares):
+    """Whether each board holds the point, False where the point is -1"""
+    return (squares >= 0) & (board >> np.maximum(squares, 0) & 1).astype(bool)
+
+
+def tiger_rank(tigers):
+    return _TIGER_ORDER[np.searchsorted(_SORTED_TIGERS, tigers)]
+
+
+def compress(board, tiger_points):
+    for k in reversed(range(tiger_points.shape[1])):
+        tiger = tiger_points[:, k]
+        board = board & (bits(tiger) - 1) | board >> (tiger + 1) << tiger
+    return board
+
+
+def expand(mask, tiger_points):
+    for k in range(tiger_points.shape[1]):
+        tiger = tiger_points[:, k]
+        mask = mask & (bits(tiger) - 1) | mask >> tiger << (tiger + 1)
+    return mask
+
+
+@lru_cache(maxsize=None)
+def empty_masks(empty):
+    return np.array(EMPTY_SETS[empty], dtype=np.int64)
+
+
+@lru_cache(maxsize=None)
+def empty_rank_table(empty):
+    table = np.full(1 << (POINTS - TIGERS), -1, dtype=np.int64)
+    table[empty_masks(empty)] = np.arange(len(EMPTY_SETS[empty]))
+    return table
+
+
+def decode(indices, empty):
+    """(tiger ranks, tiger points, empty points) of position indices"""
+    ranks, empty_ranks = np.divmod(indices, len(EMPTY_SETS[empty]))
+    tiger_points = TIGER_POINTS[ranks]
+    return ranks, tiger_points, expand(empty_masks(empty)[empty_ranks], tiger_points)
+
+
+def encode(ranks, tiger_points, empty_board, empty):
+    return ranks * len(EMPTY_SETS[empty]) + empty_rank_table(empty)[compress(empty_board, tiger_points)]
+
+
+def lowest_point(board):
+    return np.bitwise_count((board & -board) - 1).astype(np.int64)
+
+
+def count_moves(dead_goats, first, last, directory):
+    """
+    Moves of every position whose tiger rank is in [first, last) for both sides to move, with the
+    positions decided by the end of the game or a capture already resolved. Returns a (4, n) array of
+    goat results, goat move counts, tiger results and tiger move counts.
+    """
+    empty = empty_count(dead_goats)
+    size = len(EMPTY_SETS[empty])
+    ranks, tiger_points, empty_board = decode(np.arange(first * size, last * size, dtype=np.int64), empty)
+    tigers = TIGER_BOARDS[ranks]
+    goats = FULL ^ tigers ^ empty_board
+
+    goat_moves = np.zeros(len(ranks), dtype=np.int64)
+    remaining = empty_board
+    for _ in range(empty):
+        square = lowest_point(remaining)
+        goat_moves += np.bitwise_count(NEIGHBOUR_MASK_TABLE[square] & goats)
+        remaining = remaining & (remaining - 1)
+
+    tiger_moves = np.zeros(len(ranks), dtype=np.int64)
+    captures = np.zeros(len(ranks), dtype=np.int64)
+    capture_wins = np.zeros(len(ranks), dtype=bool)
+    capture_draws = np.zeros(len(ranks), dtype=bool)
+    if dead_goats + 1 < CAPTURES_TO_WIN:
+        above = np.memmap(slice_path(directory, dead_goats + 1), dtype=np.uint8, mode="r", offset=HEADER.size,
+                          shape=(slice_size(dead_goats + 1),))
+    for k in range(TIGERS):
+        tiger = tiger_points[:, k]
+        for direction in range(DIRECTIONS):
+            over, land = NEIGHBOUR_TABLE[tiger, direction], LAND_TABLE[tiger, direction]
+            tiger_moves += has(empty_board, over)
+            jump = has(goats, over) & has(empty_board, land)
+            if not jump.any():
+                continue
+            captures += jump
+            if dead_goats + 1 == CAPTURES_TO_WIN:
+                capture_wins |= jump
+                continue
+            selected = np.flatnonzero(jump)
+            moved = bits(tiger[selected]) ^ bits(land[selected])
+            next_tigers = tigers[selected] ^ moved
+            next_ranks = tiger_rank(next_tigers)
+            next_empty = empty_board[selected] ^ moved ^ bits(over[selected])
+            result = above[encode(next_ranks, TIGER_POINTS[next_ranks], next_empty, empty + 1)]
+            capture_wins[selected[(result != 0) & (result & GOAT_WINS == 0)]] = True
+            capture_draws[selected[result == 0]] = True
+
+    trapped = (tiger_moves == 0) & (captures == 0)
+    goat_results = np.where(trapped, goat_wins(0), np.where(goat_moves == 0, tiger_wins(0), 0))
+    tiger_counts = tiger_moves + capture_draws
+    tiger_results = np.where(trapped, goat_wins(0),
+                             np.where(capture_wins, tiger_wins(1), np.where(tiger_counts == 0, goat_wins(1), 0)))
+    return np.stack([goat_results, goat_moves, tiger_results, tiger_counts]).astype(np.uint8)
+
+
+def _count_chunk(dead_goats, first, last, directory, path):
+    result = count_moves(dead_goats, first, last, directory)
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, result)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def predecessors(side, indices, empty):
+    """Positions of the other side to move that reach the given positions of side in one slide"""
+    ranks, tiger_points, empty_board = decode(indices, empty)
+    found, sources = [], []
+    if side == GOAT:
+        # A tiger slid from an empty point to where it stands
+        tigers = TIGER_BOARDS[ranks]
+        for k in range(TIGERS):
+            tiger = tiger_points[:, k]
+            for direction in range(DIRECTIONS):
+                origin = NEIGHBOUR_TABLE[tiger, direction]
+                selected = np.flatnonzero(has(empty_board, origin))
+                moved = bits(tiger[selected]) ^ bits(origin[selected])
+                previous_ranks = tiger_rank(tigers[selected] ^ moved)
+                found.append(encode(previous_ranks, TIGER_POINTS[previous_ranks], empty_board[selected] ^ moved,
+                                    empty))
+                sources.append(selected)
+    else:
+        # A goat slid from one of its neighbours to an empty point
+        goats = FULL ^ TIGER_BOARDS[ranks] ^ empty_board
+        remaining = empty_board
+        for _ in range(empty):
+            square = lowest_point(remaining)
+            remaining = remaining & (remaining - 1)
+            for direction in range(DIRECTIONS):
+                destination = NEIGHBOUR_TABLE[square, direction]
+                selected = np.flatnonzero(has(goats, destination))
+                moved = bits(square[selected]) ^ bits(destination[selected])
+                found.append(encode(ranks[selected], tiger_points[selected], empty_board[selected] ^ moved, empty))
+                sources.append(selected)
+    return np.concatenate(found), np.concatenate(sources)
+
+
+def propagate(dead_goats, results, counts, distance, batch):
+    """
+    Resolve the predecessors of the positions resolved at distance, found by scanning the results so that
+    no list of positions has to be kept. Returns how many positions were resolved at distance.
+    """
+    if distance + 1 > MAX_DISTANCE:
+        raise ValueError(f"distance above {MAX_DISTANCE} with {dead_goats} dead goats")
+    empty = empty_count(dead_goats)
+    sources = 0
+    for side in (GOAT, TIGER):
+        other = 1 - side
+        win = goat_wins(distance + 1) if other == GOAT else tiger_wins(distance + 1)
+        loss = tiger_wins(distance + 1) if other == GOAT else goat_wins(distance + 1)
+        for start in range(0, results.shape[1], batch):
+            indices = start + np.flatnonzero(results[side, start:start + batch] & DISTANCE_MASK == distance + 1)
+            if not len(indices):
+                continue
+            sources += len(indices)
+            goat_won = (results[side][indices] & GOAT_WINS) != 0
+            lost = goat_won if side == TIGER else ~goat_won
+            found, origins = predecessors(side, indices, empty)
+            open_positions = results[other][found] == 0
+            found, from_lost = found[open_positions], lost[origins[open_positions]]
+
+            results[other][found[from_lost]] = win
+
+            tried = found[~from_lost]
+            tried = tried[results[other][tried] == 0]
+            np.subtract.at(counts[other], tried, 1)
+            results[other][tried[counts[other][tried] == 0]] = loss
+    return sources
+
+
+def solve(dead_goats, directory, workers, chunk, checkpoint, log=print):
+    empty = empty_count(dead_goats)
+    size = slice_size(dead_goats)
+    per_chunk = max(1, chunk // len(EMPTY_SETS[empty]))
+    work = os.path.join(directory, "work")
+    os.makedirs(work, exist_ok=True)
+    state_path = os.path.join(work, f"dead{dead_goats}_state.npz")
+
+    chunk_paths = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for first in range(0, len(TIGER_SETS), per_chunk):
+            last = min(first + per_chunk, len(TIGER_SETS))
+            path = os.path.join(work, f"dead{dead_goats}_{first:05d}.npy")
+            chunk_paths.append(path)
+            if not os.path.exists(path) and not os.path.exists(state_path):
+                futures.append(executor.submit(_count_chunk, dead_goats, first, last, directory, path))
+        for done, future in enumerate(futures, 1):
+            future.result()
+            if done % 16 == 0 or done == len(futures):
+                log(f"{dead_goats} dead goats: counted {done}/{len(futures)} chunks, "
+                    f"{time.perf_counter() - started:.0f}s")
+
+    if os.path.exists(state_path):
+        with np.load(state_path) as state:
+            results, counts, distance = state["results"], state["counts"], int(state["distance"])
+        log(f"{dead_goats} dead goats: resumed at distance {distance}")
+    else:
+        results = np.empty((2, size), dtype=np.uint8)
+        counts = np.empty((2, size), dtype=np.uint8)
+        offset = 0
+        for path in chunk_paths:
+            part = np.load(path)
+            results[:, offset:offset + part.shape[1]] = part[0::2]
+            counts[:, offset:offset + part.shape[1]] = part[1::2]
+            offset += part.shape[1]
+        distance = 0
+
+    saved = time.perf_counter()
+    while True:
+        sources = propagate(dead_goats, results, counts, distance, chunk)
+        distance += 1
+        log(f"{dead_goats} dead goats: {sources} positions at distance {distance - 1}")
+        # count_moves resolves positions at distance 0 and 1, later ones all come from the distance before
+        if not sources and distance > 1:
+            break
+        if checkpoint is not None and time.perf_counter() - saved > checkpoint:
+            with open(state_path + ".tmp", "wb") as f:
+                np.savez(f, results=results, counts=counts, distance=distance)
+            os.replace(state_path + ".tmp", state_path)
+            saved = time.perf_counter()
+
+    path = slice_path(directory, dead_goats)
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, dead_goats, size))
+        results.tofile(f)
+    os.replace(path + ".tmp", path)
+    for path in chunk_paths + [state_path]:
+        if os.path.exists(path):
+            os.remove(path)
+    log(f"{dead_goats} dead goats: solved {2 * size} positions in {time.perf_counter() - started:.0f}s")
+
+
+def generate(directory, dead_goats=range(CAPTURES_TO_WIN), workers=None, chunk=1 << 20, checkpoint=600, log=print):
+    os.makedirs(directory, exist_ok=True)
+    for dead in sorted(dead_goats, reverse=True):
+        if os.path.exists(slice_path(directory, dead)):
+            continue
+        if dead + 1 < CAPTURES_TO_WIN and not os.path.exists(slice_path(directory, dead + 1)):
+            raise FileNotFoundError(f"solve {dead + 1} dead goats before {dead}")
+        solve(dead, directory, workers, chunk, checkpoint, log)
+
+
+if __name__ == "__main__":
+    from parallel import worker_count
+
+    arguments = argparse.ArgumentParser(description="Build the movement phase tablebase")
+    arguments.add_argument("--out", default="tablebase", help="directory of the slice files")
+    arguments.add_argument("--dead", type=int, nargs="+", default=list(range(CAPTURES_TO_WIN)),
+                           help="dead goat counts to solve, every higher count has to be solved as well")
+    arguments.add_argument("--workers", type=int, default=0, help="processes counting moves, 0 uses every core")
+    arguments.add_argument("--chunk", type=int, default=1 << 20, help="positions handled at once")
+    arguments.add_argument("--checkpoint", type=int, default=600, help="seconds between saves of a slice in progress")
+    args = arguments.parse_args()
+
+    generate(args.out, args.dead, worker_count(args.workers), args.chunk, args.checkpoint)
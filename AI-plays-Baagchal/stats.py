@@ -0,0 +1,186 @@
+"""
+Search statistics for the minimax Agent.
+
+A SearchStats collector is attached to one Agent by replacing a few of its methods on the instance
+(minimax, evaluate, ordered_moves, record_cutoff, search) and its table with counting wrappers, so an
+Agent without a collector runs the plain class methods and pays nothing. Root moves searched by
+worker processes (workers != 1) are not seen.
+"""
+import json
+import time
+from collections import Counter
+
+INF = float("inf")
+
+
+class _CountingTable(object):
+    """Counts probes and hits, everything else goes to the wrapped table"""
+    def __init__(self, table, stats):
+        self.table = table
+        self.stats = stats
+
+    def probe(self, key):
+        entry = self.table.probe(key)
+        self.stats.tt_probes += 1
+        if entry is not None:
+            self.stats.tt_hits += 1
+        return entry
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+    def __len__(self):
+        return len(self.table)
+
+
+class SearchStats(object):
+    """
+    Collects, for every think() of the agent it is attached to: nodes per depth from the root, beta
+    cutoffs per depth and the position in the move list of the move that caused them (0 is the first
+    move tried), evaluation calls, transposition table probes and hits, nodes and time of every
+    iteration and the wall time. With log_path every search is appended there as one JSON line.
+    """
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self.agent = None
+        self.reset()
+
+    def reset(self):
+        self.nodes_by_depth = []
+        self.cutoffs_by_depth = []
+        self.cutoff_positions = Counter()
+        self.evaluations = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        # (depth, nodes, seconds) of every completed Agent.search, one per iteration of iterative deepening
+        self.iterations = []
+        self.wall_time = 0.0
+        self.searches = 0
+        self.value = None
+        self.move = None
+        # "search", or "book" when the move came from the opening book and nothing was searched
+        self.source = None
+        self._started = None
+        # Moves handed out so far by the ordered_moves generator of each depth
+        self._tried = []
+
+    def grow(self, depth):
+        while len(self.nodes_by_depth) <= depth:
+            self.nodes_by_depth.append(0)
+            self.cutoffs_by_depth.append(0)
+            self._tried.append(0)
+
+    def attach(self, agent):
+        self.detach()
+        self.agent = agent
+        minimax, evaluate = agent.minimax, agent.evaluate
+        ordered_moves, record_cutoff, search = agent.ordered_moves, agent.record_cutoff, agent.search
+
+        def counting_minimax(is_max=True, depth=0, *args):
+            if depth >= len(self.nodes_by_depth):
+                self.grow(depth)
+            self.nodes_by_depth[depth] += 1
+            return minimax(is_max, depth, *args)
+
+        def counting_evaluate(*args):
+            self.evaluations += 1
+            return evaluate(*args)
+
+        def counting_ordered_moves(is_max, depth, first=None):
+            self.grow(depth)
+            tried = self._tried
+            tried[depth] = 0
+            for move in ordered_moves(is_max, depth, first):
+                tried[depth] += 1
+                yield move
+
+        def counting_record_cutoff(move, is_max, depth, remaining):
+            self.cutoffs_by_depth[depth] += 1
+            self.cutoff_positions[self._tried[depth] - 1] += 1
+            return record_cutoff(move, is_max, depth, remaining)
+
+        def timed_search(is_max):
+            # An iteration cut short by the budget is left out, its nodes are still counted per depth
+            nodes_before, started = agent.nodes, time.perf_counter()
+            value = search(is_max)
+            self.iterations.append((agent.depth, agent.nodes - nodes_before, time.perf_counter() - started))
+            return value
+
+        agent.minimax = counting_minimax
+        agent.evaluate = counting_evaluate
+        agent.ordered_moves = counting_ordered_moves
+        agent.record_cutoff = counting_record_cutoff
+        agent.search = timed_search
+        agent.table = _CountingTable(agent.table, self)
+        agent.stats = self
+
+    def detach(self):
+        agent = self.agent
+        if agent is None:
+            return
+        for name in ("minimax", "evaluate", "ordered_moves", "record_cutoff", "search"):
+            agent.__dict__.pop(name, None)
+        agent.table = agent.table.table
+        agent.stats = None
+        self.agent = None
+
+    def begin(self):
+        self._started = time.perf_counter()
+
+    def end(self, value, move, source="search"):
+        self.wall_time += time.perf_counter() - self._started
+        self.searches += 1
+        self.value, self.move, self.source = value, move, source
+        if self.log_path is not None:
+            record = self.as_dict()
+            # JSON has no infinity, a forced win or loss is logged as the string "inf" or "-inf"
+            if record["value"] in (INF, -INF):
+                record["value"] = "inf" if record["value"] > 0 else "-inf"
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record, allow_nan=False) + "\n")
+
+    def book_move(self, move):
+        """Record a move played from the opening book"""
+        self.begin()
+        self.end(None, move, source="book")
+
+    @property
+    def nodes(self):
+        return sum(self.nodes_by_depth)
+
+    @property
+    def branching_factor(self):
+        """
+        Effective branching factor: growth of the node count between the last two iterations of
+        iterative deepening, or nodes ** (1 / depth) for a single fixed depth search
+        """
+        searched = [(depth, nodes) for depth, nodes, _ in self.iterations if nodes]
+        if len(searched) >= 2 and searched[-2][1]:
+            return searched[-1][1] / searched[-2][1]
+        if searched and searched[-1][0]:
+            return searched[-1][1] ** (1.0 / searched[-1][0])
+        return None
+
+    def as_dict(self):
+        cutoffs = sum(self.cutoffs_by_depth)
+        return {
+            "move": self.move,
+            "source": self.source,
+            "value": self.value,
+            "depth": self.iterations[-1][0] if self.iterations else 0,
+            "nodes": self.nodes,
+            "nodes_by_depth": self.nodes_by_depth,
+            "cutoffs": cutoffs,
+            "cutoffs_by_depth": self.cutoffs_by_depth,
+            # Cutoffs caused by the first, second, ... move tried
+            "cutoff_positions": {position: count for position, count in sorted(self.cutoff_positions.items())},
+            "first_move_cutoffs": self.cutoff_positions[0] / cutoffs if cutoffs else None,
+            "evaluations": self.evaluations,
+            "tt_probes": self.tt_probes,
+            "tt_hits": self.tt_hits,
+            "iterations": [{"depth": depth, "nodes": nodes, "seconds": seconds}
+                           for depth, nodes, seconds in self.iterations],
+            "branching_factor": self.branching_factor,
+            "wall_time": self.wall_time,
+            "nodes_per_second": self.nodes / self.wall_time if self.wall_time else None,
+        }
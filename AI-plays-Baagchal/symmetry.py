@@ -0,0 +1,121 @@
+"""
+The 8 symmetries of the board (4 rotations and 4 reflections) and canonical positions.
+
+Transform t is a combination of three bits: t & 1 flips the rows, t & 2 flips the columns and
+t & 4 swaps rows with columns (applied first). A position is canonical when it is the smallest
+of its 8 images; canonical() also returns the transform that produced it, moves found on the
+canonical board are mapped back with INVERSE[t].
+"""
+from bitboard import SIZE, POINTS, BIT, index, coordinates
+from transposition import TIGER_KEYS, GOAT_KEYS
+
+TRANSFORMS = 8
+
+
+def transform_coordinates(row, col, t):
+    if t & 4:
+        row, col = col, row
+    if t & 1:
+        row = SIZE - 1 - row
+    if t & 2:
+        col = SIZE - 1 - col
+    return row, col
+
+
+# PERMUTATIONS[t][square] is where square ends up under transform t
+PERMUTATIONS = tuple(tuple(index(*transform_coordinates(*coordinates(square), t)) for square in range(POINTS))
+                     for t in range(TRANSFORMS))
+INVERSE = tuple(next(u for u in range(TRANSFORMS)
+                     if all(PERMUTATIONS[u][PERMUTATIONS[t][square]] == square for square in range(POINTS)))
+                for t in range(TRANSFORMS))
+# GATHER[t][square] is the point that lands on square, so new_flat = old_flat[GATHER[t]]
+GATHER = tuple(tuple(PERMUTATIONS[INVERSE[t]][square] for square in range(POINTS)) for t in range(TRANSFORMS))
+
+
+def _build_row_tables():
+    # ROW_TABLES[t][row][bits] is the image of the 5 bits of one row, a board is the OR of its 5 rows
+    tables = []
+    for t in range(TRANSFORMS):
+        rows = []
+        for row in range(SIZE):
+            images = []
+            for bits in range(1 << SIZE):
+                image = 0
+                for col in range(SIZE):
+                    if bits >> col & 1:
+                        image |= BIT[PERMUTATIONS[t][index(row, col)]]
+                images.append(image)
+            rows.append(tuple(images))
+        tables.append(tuple(rows))
+    return tuple(tables)
+
+
+ROW_TABLES = _build_row_tables()
+
+# Zobrist keys of every point under each transform, used to keep all 8 keys of a position up to date
+SYMMETRIC_TIGER_KEYS = tuple(tuple(TIGER_KEYS[PERMUTATIONS[t][square]] for t in range(TRANSFORMS))
+                             for square in range(POINTS))
+SYMMETRIC_GOAT_KEYS = tuple(tuple(GOAT_KEYS[PERMUTATIONS[t][square]] for t in range(TRANSFORMS))
+                            for square in range(POINTS))
+
+
+def transform_bitboard(board, t):
+    rows = ROW_TABLES[t]
+    return rows[0][board & 31] | rows[1][board >> 5 & 31] | rows[2][board >> 10 & 31] | \
+        rows[3][board >> 15 & 31] | rows[4][board >> 20 & 31]
+
+
+def canonical(tigers, goats):
+    """Return (tigers, goats, t) of the smallest image of the position"""
+    best = None
+    for t in range(TRANSFORMS):
+        image = transform_bitboard(tigers, t) << POINTS | transform_bitboard(goats, t)
+        if best is None or image < best[0]:
+            best = image, t
+    image, t = best
+    return image >> POINTS, image & ((1 << POINTS) - 1), t
+
+
+def transform_square(square, t):
+    return PERMUTATIONS[t][square] if square is not None else None
+
+
+def transform_move(move, t):
+    """Map an Agent (type, frm, to, inter) move of point indices through transform t"""
+    move_type, frm, to, inter = move
+    permutation = PERMUTATIONS[t]
+    return (move_type,
+            permutation[frm] if frm is not None else None,
+            permutation[to],
+            permutation[inter] if inter is not None else None)
+
+
+def symmetric_keys(tigers, goats):
+    """Zobrist piece keys of the 8 images of a position"""
+    keys = [0] * TRANSFORMS
+    for square in range(POINTS):
+        if tigers & BIT[square]:
+            piece_keys = SYMMETRIC_TIGER_KEYS[square]
+        elif goats & BIT[square]:
+            piece_keys = SYMMETRIC_GOAT_KEYS[square]
+        else:
+            continue
+        for t in range(TRANSFORMS):
+            keys[t] ^= piece_keys[t]
+    return keys
+
+
+def transform_array(state, t):
+    """Image of a 5x5 array (numpy board of the Q-learning agents) under transform t"""
+    return state.reshape(POINTS)[list(GATHER[t])].reshape(state.shape)
+
+
+def canonical_array(state):
+    """Return (canonical image, t) of a 5x5 numpy board, map results back with transform_array(.., INVERSE[t])"""
+    best = None
+    for t in range(TRANSFORMS):
+        image = transform_array(state, t)
+        data = image.tobytes()
+        if best is None or data < best[0]:
+            best = data, image, t
+    return best[1], best[2]
@@ -0,0 +1,133 @@
+"""
+Endgame tablebase of the movement phase, built offline by retrograde.py.
+
+Once every goat is placed a position is the four tigers, the empty points and the side to move, the
+goats fill the rest. There is one file per number of dead goats (0 to 4), each holding one byte per
+position for the goat to move followed by one byte per position for the tiger to move. A position's
+index is rank(tigers) * C(21, empty) + rank(empty points among the 21 points without a tiger).
+
+A byte is DRAW, or the winner and the distance in plies to the next capture or the end of the game:
+1 + distance when the tiger wins, GOAT_WINS | (1 + distance) when the goats win.
+"""
+import mmap
+import os
+import struct
+from itertools import combinations
+from math import comb
+
+from bitboard import BIT, FULL, POINTS, points
+from utilities import CAPTURES_TO_WIN
+
+MAGIC = b"BGTB1\0\0\0"
+# magic, dead goats, positions per side to move
+HEADER = struct.Struct("<8sII")
+TIGERS = 4
+GOATS = 20
+DRAW = 0
+GOAT_WINS = 0x80
+DISTANCE_MASK = GOAT_WINS - 1
+MAX_DISTANCE = 0x7E
+
+TIGER_SETS = tuple(sum(BIT[square] for square in squares) for squares in combinations(range(POINTS), TIGERS))
+TIGER_RANK = {tigers: rank for rank, tigers in enumerate(TIGER_SETS)}
+# Empty points of a slice as masks over the 21 points left by the tigers, see compress
+EMPTY_SETS = {empty: tuple(sum(1 << point for point in chosen)
+                          for chosen in combinations(range(POINTS - TIGERS), empty))
+              for empty in range(1, CAPTURES_TO_WIN + 1)}
+EMPTY_RANK = {empty: {mask: rank for rank, mask in enumerate(sets)} for empty, sets in EMPTY_SETS.items()}
+
+
+def empty_count(dead_goats):
+    return POINTS - TIGERS - GOATS + dead_goats
+
+
+def slice_size(dead_goats):
+    """Positions per side to move"""
+    return len(TIGER_SETS) * comb(POINTS - TIGERS, empty_count(dead_goats))
+
+
+def compress(board, tigers):
+    """Drop the tiger points from board, leaving a mask over the other 21 points"""
+    for tiger in reversed(points(tigers)):
+        board = board & (BIT[tiger] - 1) | board >> (tiger + 1) << tiger
+    return board
+
+
+def expand(mask, tigers):
+    """Inverse of compress, the tiger points come back empty"""
+    for tiger in points(tigers):
+        mask = mask & (BIT[tiger] - 1) | mask >> tiger << (tiger + 1)
+    return mask
+
+
+def position_index(tigers, goats, dead_goats):
+    empty = empty_count(dead_goats)
+    return TIGER_RANK[tigers] * len(EMPTY_SETS[empty]) + EMPTY_RANK[empty][compress(FULL ^ tigers ^ goats, tigers)]
+
+
+def position(index, dead_goats):
+    """(tigers, goats) of an index"""
+    sets = EMPTY_SETS[empty_count(dead_goats)]
+    rank, empty_rank = divmod(index, len(sets))
+    tigers = TIGER_SETS[rank]
+    return tigers, FULL ^ tigers ^ expand(sets[empty_rank], tigers)
+
+
+def tiger_wins(distance):
+    return 1 + distance
+
+
+def goat_wins(distance):
+    return GOAT_WINS | (1 + distance)
+
+
+def decode(result):
+    """(winner, distance) of a stored byte, winner is None for a draw"""
+    if result == DRAW:
+        return None, None
+    return ("Goat" if result & GOAT_WINS else "Tiger"), (result & DISTANCE_MASK) - 1
+
+
+def slice_path(directory, dead_goats):
+    return os.path.join(directory, f"dead{dead_goats}.tb")
+
+
+class Tablebase(object):
+    """Memory-maps every slice found in directory, probe returns None for the missing ones"""
+    def __init__(self, directory):
+        self.path = directory
+        self.files = {}
+        self.slices = {}
+        for dead_goats in range(CAPTURES_TO_WIN):
+            path = slice_path(directory, dead_goats)
+            if not os.path.exists(path):
+                continue
+            f = open(path, "rb")
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, stored_dead, size = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or stored_dead != dead_goats or size != slice_size(dead_goats):
+                data.close()
+                f.close()
+                raise ValueError(f"{path} is not a tablebase slice for {dead_goats} dead goats")
+            self.files[dead_goats] = f
+            self.slices[dead_goats] = data
+
+    def close(self):
+        for data in self.slices.values():
+            data.close()
+        for f in self.files.values():
+            f.close()
+        self.slices, self.files = {}, {}
+
+    def __contains__(self, dead_goats):
+        return dead_goats in self.slices
+
+    def probe(self, tigers, goats, dead_goats, is_max):
+        """Stored byte of a movement phase position or None when its slice is missing"""
+        data = self.slices.get(dead_goats)
+        if data is None:
+            return None
+        offset = HEADER.size + position_index(tigers, goats, dead_goats)
+        if is_max:
+            offset += slice_size(dead_goats)
+        return data[offset]
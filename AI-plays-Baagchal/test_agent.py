@@ -0,0 +1,26 @@
+"""
+Regression tests for the minimax Agent, run with python -m pytest from this directory.
+"""
+from agent import Agent
+
+# Goat to move with 6 goats in hand and 4 dead: every placement loses
+FORCED_LOSS = "GGG__/T_GG_/_GT_G/_G__G/GT__T"
+
+
+def grid(rows):
+    return [list(row) for row in rows.split("/")]
+
+
+def test_lost_position_still_has_a_move():
+    agent = Agent(grid(FORCED_LOSS), "Goat", 6, 4, 3)
+    move = agent.get_best_move()
+    assert move is not None
+    assert agent.is_legal(agent.best_move, False)
+
+
+def test_lost_position_move_can_be_played():
+    board = grid(FORCED_LOSS)
+    agent = Agent(board, "Goat", 6, 4, 3)
+    agent.make_best_move()
+    assert agent.goats_in_hand == 5
+    assert sum(row.count("G") for row in board) == 11
@@ -0,0 +1,66 @@
+"""
+Zobrist hashing and a fixed size transposition table for the minimax Agent
+"""
+import random
+from bitboard import POINTS, squares
+
+# Bound stored with a value
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Fixed seed so that keys are identical in every process
+_rng = random.Random(0xBA6C4A1)
+TIGER_KEYS = tuple(_rng.getrandbits(64) for _ in range(POINTS))
+GOAT_KEYS = tuple(_rng.getrandbits(64) for _ in range(POINTS))
+IN_HAND_KEYS = tuple(_rng.getrandbits(64) for _ in range(21))
+DEAD_KEYS = tuple(_rng.getrandbits(64) for _ in range(6))
+TIGER_TO_MOVE = _rng.getrandbits(64)
+
+
+def zobrist(tigers, goats, goats_in_hand, dead_goats):
+    """
+    Hash of a position without the side to move, xor TIGER_TO_MOVE into it when the tiger is to play.
+    """
+    key = IN_HAND_KEYS[goats_in_hand] ^ DEAD_KEYS[dead_goats]
+    for square in squares(tigers):
+        key ^= TIGER_KEYS[square]
+    for square in squares(goats):
+        key ^= GOAT_KEYS[square]
+    return key
+
+
+class TranspositionTable(object):
+    """
+    Fixed number of slots indexed by the low bits of the key, each slot holds one
+    (key, depth, bound, value, move, generation) tuple. An entry is replaced when the
+    new one is searched at least as deep or the old one is left over from an earlier search.
+    Roughly 150 bytes per filled slot.
+    """
+    def __init__(self, size=1 << 17):
+        # Round down to a power of two so that the slot is key & mask
+        size = 1 << (max(size, 1).bit_length() - 1)
+        self.size = size
+        self.mask = size - 1
+        self.entries = [None] * size
+        self.generation = 0
+
+    def new_search(self):
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.generation = 0
+
+    def probe(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, bound, value, move):
+        slot = key & self.mask
+        old = self.entries[slot]
+        if old is None or old[0] == key or old[5] != self.generation or depth >= old[1]:
+            self.entries[slot] = (key, depth, bound, value, move, self.generation)
+
+    def __len__(self):
+        return self.size - self.entries.count(None)
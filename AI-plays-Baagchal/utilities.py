@@ -0,0 +1,166 @@
+"""
+Rules of the game in one place, on top of the precomputed tables of bitboard.py.
+
+Three views of the same rules:
+    grid      'T'/'G'/'_' grids and (row, col) points, used by gui.py and game.py
+    bitboard  (tigers, goats) integers and point indices, used by the minimax Agent and the arena
+    array     -1 padded (25, 8) neighbour and jump tables by direction, turned into numpy arrays by the
+              Q-learning Sheep/Wolves (Qlearning/utils/agents/base.py)
+
+Moves are (type, frm, to, inter) tuples of point indices: ("p", None, to, None) places a goat,
+("m", frm, to, None) steps to a neighbour and ("e", frm, to, inter) jumps the goat on inter.
+"""
+from bitboard import BIT, FULL, POINTS, NEIGHBOURS, NEIGHBOUR_MASKS, JUMPS, JUMP_MASKS, JUMP_OVER_MASKS, \
+    ALL_OFFSETS, coordinates, from_grid, index, is_inside, offsets, points, squares
+
+# Captured goats that win the game for the tiger
+CAPTURES_TO_WIN = 5
+
+# (tiger point, landing point) -> point of the goat jumped
+JUMP_OVER = {(square, land): over for square in range(POINTS) for over, land in JUMPS[square]}
+
+# At most 2 ** 16 patterns for the centre point and far fewer for the others
+_captures = {}
+
+
+def capture_mask(square, goats, empty):
+    """Goats the tiger on square can jump, cached on the points its jumps look at"""
+    key = square << 50 | (goats & JUMP_OVER_MASKS[square]) << 25 | empty & JUMP_MASKS[square]
+    captures = _captures.get(key)
+    if captures is None:
+        captures = 0
+        for over, land in JUMPS[square]:
+            if goats & BIT[over] and empty & BIT[land]:
+                captures |= BIT[over]
+        _captures[key] = captures
+    return captures
+
+
+# Bitboard view
+
+def placements(empty):
+    return [("p", None, square, None) for square in squares(empty)]
+
+
+def steps(pieces, empty, piece_points=squares):
+    """Every step of the pieces to an empty neighbour, pass points for the sparse tigers"""
+    moves = []
+    for square in piece_points(pieces):
+        if NEIGHBOUR_MASKS[square] & empty:
+            for next_square in NEIGHBOURS[square]:
+                if empty & BIT[next_square]:
+                    moves.append(("m", square, next_square, None))
+    return moves
+
+
+def captures(tigers, goats, empty):
+    moves = []
+    for square in points(tigers):
+        for over, land in JUMPS[square]:
+            if goats & BIT[over] and empty & BIT[land]:
+                moves.append(("e", square, land, over))
+    return moves
+
+
+def goat_moves(tigers, goats, goats_in_hand):
+    empty = FULL ^ tigers ^ goats
+    if goats_in_hand > 0:
+        return placements(empty)
+    return steps(goats, empty)
+
+
+def tiger_moves(tigers, goats):
+    """Captures first, then steps"""
+    empty = FULL ^ tigers ^ goats
+    moves = captures(tigers, goats, empty)
+    moves.extend(steps(tigers, empty, points))
+    return moves
+
+
+def tigers_trapped(tigers, goats):
+    """True when no tiger can step or capture"""
+    empty = FULL ^ tigers ^ goats
+    for square in points(tigers):
+        if NEIGHBOUR_MASKS[square] & empty or capture_mask(square, goats, empty):
+            return False
+    return True
+
+
+def winner(tigers, goats, dead_goats):
+    """"Tiger", "Goat" or None while the game goes on"""
+    if dead_goats >= CAPTURES_TO_WIN:
+        return "Tiger"
+    if tigers_trapped(tigers, goats):
+        return "Goat"
+    return None
+
+
+# Grid view
+
+def graphics_coordinates_to_index(graphic_board, x, y):
+    """(row, col) of the point drawn closest to canvas coordinates (x, y)"""
+    return min(((row, col) for row in range(len(graphic_board)) for col in range(len(graphic_board[row]))),
+               key=lambda point: (graphic_board[point[0]][point[1]][0] - x) ** 2 +
+                                 (graphic_board[point[0]][point[1]][1] - y) ** 2)
+
+
+def is_reachable(row_1, col_1, row_2, col_2):
+    """True when (row_2, col_2) is joined to (row_1, col_1) by a line, a step for either piece"""
+    return bool(NEIGHBOUR_MASKS[index(row_1, col_1)] & BIT[index(row_2, col_2)])
+
+
+def is_reachable_to_eat(grid, row_1, col_1, row_2, col_2):
+    """True when a tiger on (row_1, col_1) jumps a goat landing on (row_2, col_2)"""
+    over = JUMP_OVER.get((index(row_1, col_1), index(row_2, col_2)))
+    if over is None:
+        return False
+    row, col = coordinates(over)
+    return grid[row][col] == 'G'
+
+
+def locate_goat_to_be_eaten(grid, row_1, col_1, row_2, col_2):
+    """(row, col) of the goat jumped from (row_1, col_1) to (row_2, col_2)"""
+    return coordinates(JUMP_OVER[index(row_1, col_1), index(row_2, col_2)])
+
+
+def can_move(grid, row, col):
+    """True when the piece on (row, col) has a step, or for a tiger a capture"""
+    tigers, goats = from_grid(grid)
+    empty = FULL ^ tigers ^ goats
+    square = index(row, col)
+    if NEIGHBOUR_MASKS[square] & empty:
+        return True
+    return grid[row][col] == 'T' and bool(capture_mask(square, goats, empty))
+
+
+def grid_winner(grid, goats_killed):
+    """winner() of a grid"""
+    return winner(*from_grid(grid), goats_killed)
+
+
+# Array view, direction k of every point is ALL_OFFSETS[k] (rows then columns of the 3x3 window)
+
+def _direction_tables():
+    neighbours = []
+    jumps = []
+    for square in range(POINTS):
+        row, col = coordinates(square)
+        joined = offsets(row, col)
+        neighbour_row, jump_row = [], []
+        for offset_x, offset_y in ALL_OFFSETS:
+            next_row, next_col = row + offset_x, col + offset_y
+            if (offset_x, offset_y) not in joined or not is_inside(next_row, next_col):
+                neighbour_row.append(-1)
+                jump_row.append(-1)
+                continue
+            neighbour_row.append(index(next_row, next_col))
+            landing_row, landing_col = next_row + offset_x, next_col + offset_y
+            jump_row.append(index(landing_row, landing_col) if is_inside(landing_row, landing_col) else -1)
+        neighbours.append(tuple(neighbour_row))
+        jumps.append(tuple(jump_row))
+    return tuple(neighbours), tuple(jumps)
+
+
+# DIRECTION_NEIGHBOURS[p][k]: point one step from p in direction k, DIRECTION_JUMPS[p][k]: the landing
+# point of a capture over it, -1 where the step leaves the board or p has no such diagonal
+DIRECTION_NEIGHBOURS, DIRECTION_JUMPS = _direction_tables()